@@ -0,0 +1,840 @@
+from sample_models._simple_fifo_with_logging_storewrapper import Trial, g
+from vidigi.prep import assign_resource_ids, reshape_for_animations, iter_snapshots, extend_reshape_for_animations, SnapshotCube, EntityStateIndex, generate_animation_df, ResourceLayout
+from vidigi import _kernels
+from pandas.testing import assert_frame_equal
+import pandas as pd
+import numpy as np
+import pytest
+import tracemalloc
+
+my_trial = Trial()
+my_trial.run_trial()
+
+EVENT_LOG = my_trial.all_event_logs[my_trial.all_event_logs['run']==1]
+
+@pytest.mark.parametrize(
+    "reshape_kwargs",
+    [
+        {},
+        {"step_snapshot_max": 3},
+        {"every_x_time_units": 7, "step_snapshot_max": 2},
+        {"step_snapshot_max": 1, "cap_resource_use": True},
+    ]
+)
+def test_sweep_engine_matches_loop_engine(reshape_kwargs):
+    loop_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        engine="loop",
+        **reshape_kwargs
+        )
+
+    sweep_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        engine="sweep",
+        **reshape_kwargs
+        )
+
+    assert_frame_equal(loop_df, sweep_df)
+
+def test_sweep_engine_matches_loop_engine_shuffled_log():
+    # The original index is used to break ties and to rank entities,
+    # so make sure it is respected when it is not in time order
+    shuffled_log = EVENT_LOG.sample(frac=1, random_state=42)
+
+    loop_df = reshape_for_animations(
+        event_log=shuffled_log,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        engine="loop"
+        )
+
+    sweep_df = reshape_for_animations(
+        event_log=shuffled_log,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        engine="sweep"
+        )
+
+    assert_frame_equal(loop_df, sweep_df)
+
+# Entity 1 leaves at time 20 and comes back at time 50
+REENTRANT_LOG = pd.DataFrame({
+    'entity_id': [1, 1, 1, 1, 1, 1, 2, 2],
+    'event_type': ['arrival_departure', 'queue', 'arrival_departure',
+                   'arrival_departure', 'queue', 'arrival_departure',
+                   'arrival_departure', 'queue'],
+    'event': ['arrival', 'wait', 'depart', 'arrival', 'wait', 'depart', 'arrival', 'wait'],
+    'time': [0, 5, 20, 50, 55, 70, 0, 1],
+    })
+
+def test_reentrant_entity_absent_between_stays():
+    loop_df, sweep_df = [
+        reshape_for_animations(
+            event_log=REENTRANT_LOG,
+            every_x_time_units=10,
+            limit_duration=100,
+            engine=engine
+            )
+        for engine in ["loop", "sweep"]
+        ]
+
+    assert_frame_equal(loop_df, sweep_df)
+
+    # Only the final stay gets an exit step
+    entity_snapshots = sweep_df.loc[sweep_df['entity_id'] == 1, 'snapshot_time']
+    assert set(entity_snapshots) == {0, 10, 20, 50, 60, 70, 80}
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+@pytest.mark.parametrize("tz", [None, "Europe/London"])
+def test_datetime_event_log_matches_numeric(engine, tz):
+    start = pd.Timestamp("2024-03-30", tz=tz)
+    datetime_log = EVENT_LOG.assign(time=start + pd.to_timedelta(EVENT_LOG['time'], unit='min'))
+
+    numeric_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=5,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        window_start=100,
+        engine=engine
+        )
+
+    datetime_df = reshape_for_animations(
+        event_log=datetime_log,
+        every_x_time_units="5min",
+        limit_duration=pd.Timedelta(minutes=g.sim_duration),
+        step_snapshot_max=3,
+        window_start=start + pd.Timedelta(minutes=100),
+        engine=engine
+        )
+
+    assert isinstance(datetime_df['snapshot_time'].dtype, pd.DatetimeTZDtype) == (tz is not None)
+
+    assert_frame_equal(
+        numeric_df.drop(columns=['time', 'snapshot_time']),
+        datetime_df.drop(columns=['time', 'snapshot_time'])
+        )
+    for col in ['time', 'snapshot_time']:
+        assert_frame_equal(
+            (start + pd.to_timedelta(numeric_df[col], unit='min')).to_frame(),
+            datetime_df[[col]]
+            )
+
+    # A time a nanosecond off the grid makes the tick a nanosecond, and over 300 days that is
+    # more ticks than float64 holds exactly, so it is rejected rather than silently rounded
+    precise_log = datetime_log.assign(
+        time=datetime_log['time'].where(
+            datetime_log.index != datetime_log.index[0], start + pd.Timedelta(days=200, nanoseconds=1)
+            )
+        )
+
+    with pytest.raises(ValueError, match="converted exactly"):
+        reshape_for_animations(
+            event_log=precise_log,
+            every_x_time_units="1D",
+            limit_duration=pd.Timedelta(days=300),
+            engine=engine
+            )
+
+def test_datetime_event_log_requires_timedeltas():
+    datetime_log = EVENT_LOG.assign(
+        time=pd.Timestamp("2024-01-01") + pd.to_timedelta(EVENT_LOG['time'], unit='min')
+        )
+
+    with pytest.raises(ValueError):
+        reshape_for_animations(event_log=datetime_log, every_x_time_units=10, limit_duration=600)
+
+def test_assign_resource_ids_uses_lowest_free_resource():
+    event_log = pd.DataFrame({
+        'entity_id': [1, 2, 1, 3, 4, 2, 4, 3, 5, 6],
+        'event_type': [
+            'resource_use', 'resource_use', 'resource_use_end', 'resource_use', 'resource_use',
+            'resource_use_end', 'resource_use_end', 'resource_use_end', 'resource_use', 'queue'
+            ],
+        'event': [
+            'treat', 'treat', 'treat_end', 'treat', 'treat',
+            'treat_end', 'treat_end', 'treat_end', 'scan', 'wait'
+            ],
+        'time': [0, 1, 5, 5, 6, 7, 8, 9, 6, 2],
+        'resource_id': [np.nan] * 9 + [7],
+        })
+
+    assigned = assign_resource_ids(event_log)
+
+    # Entity 3 takes the resource released by entity 1 at the same time, entity 4 the lowest
+    # free resource, and each resource use step is numbered separately
+    assert assigned['resource_id'].tolist() == [1, 2, 1, 1, 3, 2, 3, 1, 1, 7]
+    assert event_log['resource_id'].isna().sum() == 9
+
+def test_assign_resource_ids_never_overlaps():
+    assigned = assign_resource_ids(EVENT_LOG.drop(columns='resource_id'))
+
+    uses = assigned[assigned['event_type'] == 'resource_use']
+    ends = assigned[assigned['event_type'] == 'resource_use_end']
+    stays = uses.merge(
+        ends[['entity_id', 'resource_id', 'time']], on=['entity_id', 'resource_id'], suffixes=('', '_end')
+        ).sort_values('time')
+
+    assert len(stays) == len(ends)
+    assert stays['resource_id'].max() <= g.n_cubicles
+    for _, resource_stays in stays.groupby('resource_id'):
+        assert (resource_stays['time'].to_numpy()[1:] >= resource_stays['time_end'].to_numpy()[:-1]).all()
+
+def test_cap_resource_use_limits_resource_steps():
+    step_snapshot_max = 1
+
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=step_snapshot_max,
+        cap_resource_use=True
+        )
+
+    resource_steps = full_entity_df[full_entity_df['event_type'] == 'resource_use']
+    group_sizes = resource_steps.groupby(['snapshot_time', 'event']).size()
+
+    assert group_sizes.max() <= step_snapshot_max + 1
+    assert resource_steps['additional'].notna().any()
+
+def test_skip_unchanged_snapshots_only_drops_repeated_snapshots():
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=1,
+        limit_duration=g.sim_duration
+        )
+
+    skipped_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=1,
+        limit_duration=g.sim_duration,
+        skip_unchanged_snapshots=True,
+        max_snapshot_gap=30
+        )
+
+    kept_times = skipped_df['snapshot_time'].unique()
+
+    assert len(kept_times) < full_entity_df['snapshot_time'].nunique()
+    assert kept_times[0] == 0 and kept_times[-1] == g.sim_duration
+    assert (pd.Series(kept_times).diff().dropna() <= 30).all()
+
+    # Kept snapshots are unchanged, and each dropped snapshot matches the one before it
+    assert_frame_equal(
+        full_entity_df[full_entity_df['snapshot_time'].isin(kept_times)].reset_index(drop=True),
+        skipped_df
+        )
+
+    snapshots = {
+        snapshot_time: df.drop(columns='snapshot_time').reset_index(drop=True)
+        for snapshot_time, df in full_entity_df.groupby('snapshot_time')
+        }
+    for snapshot_time in set(snapshots) - set(kept_times):
+        assert_frame_equal(snapshots[snapshot_time], snapshots[snapshot_time - 1])
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+def test_max_snapshot_gap_not_a_multiple_of_snapshot_interval(engine):
+    # A few entities spread over a long run, so there are long quiet periods
+    event_log = EVENT_LOG[EVENT_LOG['entity_id'] <= 20].assign(time=lambda df: df['time'] * 20)
+    reshape_kwargs = dict(every_x_time_units=10, limit_duration=5000, engine=engine)
+
+    full_entity_df = reshape_for_animations(event_log=event_log, **reshape_kwargs)
+    skipped_df = reshape_for_animations(
+        event_log=event_log, skip_unchanged_snapshots=True, max_snapshot_gap=25, **reshape_kwargs
+        )
+
+    kept_times = skipped_df['snapshot_time'].unique()
+
+    # Quiet periods are crossed two snapshots at a time, as three would exceed the gap
+    assert pd.Series(kept_times).diff().max() == 20
+    assert_frame_equal(
+        full_entity_df[full_entity_df['snapshot_time'].isin(kept_times)].reset_index(drop=True),
+        skipped_df
+        )
+
+def test_skip_unchanged_snapshots_sweep_matches_loop_in_windows():
+    # The sweep engine only takes the snapshots near an event, while the loop engine takes them all
+    event_log = EVENT_LOG[EVENT_LOG['entity_id'] <= 20].assign(time=lambda df: df['time'] * 20)
+
+    for window_start, window_end in [(None, None), (1000, 3000), (1003, 1004), (2500, None)]:
+        loop_df, sweep_df = [
+            reshape_for_animations(
+                event_log=event_log,
+                every_x_time_units=7,
+                limit_duration=5000,
+                step_snapshot_max=2,
+                skip_unchanged_snapshots=True,
+                max_snapshot_gap=50,
+                window_start=window_start,
+                window_end=window_end,
+                engine=engine
+                )
+            for engine in ["loop", "sweep"]
+            ]
+
+        assert_frame_equal(loop_df, sweep_df)
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+def test_multi_run_reshape_matches_single_runs(engine):
+    event_logs = my_trial.all_event_logs[my_trial.all_event_logs['run'] <= 3]
+
+    multi_run_df = reshape_for_animations(
+        event_log=event_logs,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        run_col_name="run",
+        engine=engine
+        )
+
+    for run in [1, 2, 3]:
+        single_run_df = reshape_for_animations(
+            event_log=event_logs[event_logs['run'] == run],
+            limit_duration=g.sim_duration,
+            step_snapshot_max=3
+            )
+        # Empty snapshots are labelled with their run in the multi-run output
+        single_run_df['run'] = run
+
+        assert_frame_equal(
+            single_run_df,
+            multi_run_df[multi_run_df['run'] == run].reset_index(drop=True)[single_run_df.columns]
+            )
+
+def test_slim_reshape_matches_full_reshape():
+    event_log = EVENT_LOG.assign(unused_column="not needed for the animation")
+
+    full_entity_df = reshape_for_animations(
+        event_log=event_log,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3
+        )
+
+    slim_df = reshape_for_animations(
+        event_log=event_log,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        slim=True
+        )
+
+    assert "unused_column" not in slim_df.columns
+    assert isinstance(slim_df['event'].dtype, pd.CategoricalDtype)
+    assert slim_df.memory_usage(deep=True).sum() < full_entity_df.memory_usage(deep=True).sum()
+
+    decoded_df = slim_df.astype({
+        col: object if isinstance(dtype, pd.CategoricalDtype) else full_entity_df[col].dtype
+        for col, dtype in slim_df.dtypes.items()
+        })
+
+    assert_frame_equal(full_entity_df[slim_df.columns], decoded_df)
+
+@pytest.mark.parametrize("keyframe_interval", [1, 10, 50])
+def test_snapshot_cube_round_trip(keyframe_interval):
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=1,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3
+        )
+
+    cube = SnapshotCube.from_dataframe(full_entity_df, keyframe_interval=keyframe_interval)
+
+    assert len(cube) == full_entity_df['snapshot_time'].nunique()
+    assert cube.nbytes < full_entity_df.memory_usage(deep=True).sum()
+    assert_frame_equal(full_entity_df, cube.to_dataframe())
+
+    snapshot_time = cube.snapshot_times[123]
+    assert_frame_equal(
+        full_entity_df[full_entity_df['snapshot_time'] == snapshot_time].reset_index(drop=True),
+        cube.snapshot(123)
+        )
+
+def test_snapshot_cube_from_event_log_matches_iter_snapshots():
+    cube = SnapshotCube.from_event_log(
+        EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        snapshots_per_batch=7
+        )
+
+    streamed_df = pd.concat(
+        iter_snapshots(EVENT_LOG, limit_duration=g.sim_duration, step_snapshot_max=3, snapshots_per_batch=7),
+        ignore_index=True
+        )
+
+    assert_frame_equal(streamed_df, cube.to_dataframe())
+
+def test_generate_animation_df_accepts_snapshot_cube():
+    event_position_df = pd.DataFrame([
+        {'event': 'arrival', 'x':  50, 'y': 300, 'label': "Arrival"},
+        {'event': 'treatment_wait_begins', 'x':  205, 'y': 275, 'label': "Waiting for Treatment"},
+        {'event': 'treatment_begins', 'x':  205, 'y': 175, 'resource':'n_cubicles', 'label': "Being Treated"},
+        {'event': 'depart', 'x':  270, 'y': 70, 'label': "Exit"}
+        ])
+
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3
+        )
+    cube = SnapshotCube.from_dataframe(full_entity_df)
+
+    assert_frame_equal(
+        generate_animation_df(full_entity_df, event_position_df, step_snapshot_max=3),
+        generate_animation_df(cube, event_position_df, step_snapshot_max=3)
+        )
+
+def test_generate_animation_df_places_queues_and_resources():
+    event_position_df = pd.DataFrame([
+        {'event': 'wait', 'x': 100, 'y': 50, 'label': "Waiting"},
+        {'event': 'treat', 'x': 200, 'y': 100, 'resource': 'n_cubicles', 'label': "Being Treated"},
+        ])
+
+    full_entity_df = pd.DataFrame({
+        'entity_id': [1, 2, 3, 4, 5, np.nan],
+        'event_type': ['queue', 'queue', 'queue', 'resource_use', 'resource_use', np.nan],
+        'event': ['wait', 'wait', 'wait', 'treat', 'treat', np.nan],
+        'time': [0, 0, 0, 0, 0, np.nan],
+        'resource_id': [np.nan, np.nan, np.nan, 1, 3, np.nan],
+        'additional': [np.nan, np.nan, 5, np.nan, np.nan, np.nan],
+        'snapshot_time': [0, 0, 0, 0, 0, 10],
+        })
+
+    full_entity_df_plus_pos = generate_animation_df(
+        full_entity_df,
+        event_position_df,
+        step_snapshot_max=2,
+        wrap_queues_at=2,
+        wrap_resources_at=2,
+        custom_entity_icon_list=['A', 'B', 'C', 'D', 'E']
+        )
+
+    # Queues, then resources, then empty snapshots, with the '+ N more' row last
+    placed = full_entity_df_plus_pos.dropna(subset=['entity_id'])
+    assert placed['entity_id'].tolist() == [1, 2, 4, 5, 3]
+    assert placed['x_final'].tolist() == [100, 90, 200, 200, 90]
+    assert placed['y_final'].tolist() == [50, 50, 100, 130, 80]
+    assert full_entity_df_plus_pos['icon'].tolist() == ['A', 'B', 'D', 'E', 'A', '+     5 more']
+
+def test_resource_layout_markers_line_up_with_entities():
+    class Scenario:
+        n_cubicles = g.n_cubicles
+
+    event_position_df = pd.DataFrame([
+        {'event': 'arrival', 'x':  50, 'y': 300, 'label': "Arrival"},
+        {'event': 'treatment_wait_begins', 'x':  205, 'y': 275, 'label': "Waiting for Treatment"},
+        {'event': 'treatment_begins', 'x':  205, 'y': 175, 'resource':'n_cubicles', 'label': "Being Treated"},
+        {'event': 'depart', 'x':  270, 'y': 70, 'label': "Exit"}
+        ])
+
+    layout = ResourceLayout(event_position_df, scenario=Scenario(), wrap_resources_at=2)
+
+    markers = layout.markers()
+    assert markers['resource_id'].tolist() == [0, 1, 2, 3]
+    assert markers['x_final'].tolist() == [205, 195, 205, 195]
+    assert markers['y_final'].tolist() == [175, 175, 205, 205]
+
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3
+        )
+    full_entity_df_plus_pos = generate_animation_df(
+        full_entity_df, event_position_df, step_snapshot_max=3, resource_layout=layout
+        )
+
+    assert_frame_equal(
+        full_entity_df_plus_pos,
+        generate_animation_df(full_entity_df, event_position_df, step_snapshot_max=3, wrap_resources_at=2)
+        )
+
+    # Every entity using a resource sits on the marker of that resource
+    resource_use = full_entity_df_plus_pos[full_entity_df_plus_pos['event'] == 'treatment_begins']
+    marker_positions = markers.set_index(markers['resource_id'] + 1)[['x_final', 'y_final']]
+    assert_frame_equal(
+        resource_use[['x_final', 'y_final']].reset_index(drop=True),
+        marker_positions.loc[resource_use['resource_id']].reset_index(drop=True)
+        )
+
+def test_generate_animation_df_peak_memory_below_twice_output():
+    event_position_df = pd.DataFrame([
+        {'event': 'arrival', 'x':  50, 'y': 300, 'label': "Arrival"},
+        {'event': 'treatment_wait_begins', 'x':  205, 'y': 275, 'label': "Waiting for Treatment"},
+        {'event': 'treatment_begins', 'x':  205, 'y': 175, 'resource':'n_cubicles', 'label': "Being Treated"},
+        {'event': 'depart', 'x':  270, 'y': 70, 'label': "Exit"}
+        ])
+
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        every_x_time_units=1
+        )
+    original = full_entity_df.copy()
+
+    tracemalloc.start()
+    try:
+        full_entity_df_plus_pos = generate_animation_df(full_entity_df, event_position_df)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # String columns share their values with the input, so only the arrays themselves count
+    assert peak < 2 * full_entity_df_plus_pos.memory_usage().sum()
+    # The input is left untouched
+    assert_frame_equal(full_entity_df, original)
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+def test_window_matches_full_reshape(engine):
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=7,
+        limit_duration=602,
+        step_snapshot_max=2,
+        engine=engine
+        )
+
+    window_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=7,
+        limit_duration=602,
+        step_snapshot_max=2,
+        engine=engine,
+        window_start=100,
+        window_end=300
+        )
+
+    assert window_df['snapshot_time'].min() == 105 and window_df['snapshot_time'].max() == 294
+
+    assert_frame_equal(
+        full_entity_df[full_entity_df['snapshot_time'].between(100, 300)].reset_index(drop=True),
+        window_df[full_entity_df.columns]
+        )
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+def test_windows_match_full_reshape_with_entities_who_never_leave(engine):
+    # Some entities never depart, and some of those who do come back after the last snapshot
+    entity_ids = EVENT_LOG['entity_id'].unique()
+    event_log = EVENT_LOG[
+        ~(EVENT_LOG['entity_id'].isin(entity_ids[::3]) & (EVENT_LOG['event'] == 'depart'))
+        ]
+    returns = event_log[event_log['entity_id'].isin([2, 4]) & (event_log['event'] == 'arrival')]
+    event_log = pd.concat([event_log, returns.assign(time=returns['time'] + 200)])
+
+    reshape_kwargs = dict(every_x_time_units=3, limit_duration=75, engine=engine)
+    full_entity_df = reshape_for_animations(event_log=event_log, **reshape_kwargs)
+
+    for window_start, window_end in [(0, 9), (0, 54), (45, 45), (48, 66), (60, 75)]:
+        window_df = reshape_for_animations(
+            event_log=event_log, window_start=window_start, window_end=window_end, **reshape_kwargs
+            )
+
+        assert_frame_equal(
+            full_entity_df[full_entity_df['snapshot_time'].between(window_start, window_end)]
+            .reset_index(drop=True),
+            window_df[full_entity_df.columns]
+            )
+
+# Entity 1 waits from the start and never leaves. Entity 3 moves from triage to the queue at
+# time 14, and is hidden from time 20, when entity 2 joins it from an earlier row of the log
+CAPPED_QUEUE_LOG = pd.DataFrame({
+    'entity_id': [1, 1, 2, 2, 3, 3, 3, 3],
+    'event_type': ['arrival_departure', 'queue', 'arrival_departure', 'queue',
+                   'arrival_departure', 'queue', 'queue', 'arrival_departure'],
+    'event': ['arrival', 'wait', 'arrival', 'wait', 'arrival', 'triage', 'wait', 'depart'],
+    'time': [0, 0, 20, 20, 2, 2, 14, 60],
+    })
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+def test_window_omits_exit_steps_of_entities_capped_after_it(engine):
+    reshape_kwargs = dict(every_x_time_units=5, limit_duration=40, step_snapshot_max=1, engine=engine)
+    full_entity_df = reshape_for_animations(event_log=CAPPED_QUEUE_LOG, **reshape_kwargs)
+
+    # Entity 3 is still present after the window, so only the full output has its exit step
+    window_df = reshape_for_animations(
+        event_log=CAPPED_QUEUE_LOG, window_start=0, window_end=30, **reshape_kwargs
+        )
+    is_capped_exit = (full_entity_df['entity_id'] == 3) & (full_entity_df['event'] == 'depart')
+    assert full_entity_df.loc[is_capped_exit, 'snapshot_time'].tolist() == [20]
+
+    assert_frame_equal(
+        full_entity_df[full_entity_df['snapshot_time'].between(0, 30) & ~is_capped_exit]
+        .reset_index(drop=True),
+        window_df[full_entity_df.columns]
+        )
+
+    # Windows ending before entity 3 is hidden match the full output
+    for window_start, window_end in [(0, 15), (10, 15)]:
+        window_df = reshape_for_animations(
+            event_log=CAPPED_QUEUE_LOG, window_start=window_start, window_end=window_end,
+            **reshape_kwargs
+            )
+
+        assert_frame_equal(
+            full_entity_df[full_entity_df['snapshot_time'].between(window_start, window_end)]
+            .reset_index(drop=True),
+            window_df[full_entity_df.columns]
+            )
+
+@pytest.mark.parametrize("engine", ["sweep", "loop"])
+def test_window_without_entities(engine):
+    # Nobody arrives until time 100, and everybody present has left by time 400
+    event_log = EVENT_LOG[
+        EVENT_LOG['entity_id'].isin(
+            EVENT_LOG.loc[(EVENT_LOG['event'] == 'depart') & (EVENT_LOG['time'] < 150), 'entity_id']
+            )
+        ].assign(time=lambda df: df['time'] + 100)
+
+    reshape_kwargs = dict(every_x_time_units=10, limit_duration=500, engine=engine)
+    full_entity_df = reshape_for_animations(event_log=event_log, **reshape_kwargs)
+
+    for window_start, window_end in [(0, 50), (400, 500)]:
+        window_df = reshape_for_animations(
+            event_log=event_log, window_start=window_start, window_end=window_end, **reshape_kwargs
+            )
+
+        assert window_df['entity_id'].isna().all()
+        assert_frame_equal(
+            full_entity_df[full_entity_df['snapshot_time'].between(window_start, window_end)]
+            .reset_index(drop=True),
+            window_df[full_entity_df.columns]
+            )
+
+    # A window between two snapshots has no rows at all, but still has the usual columns
+    window_df = reshape_for_animations(event_log=event_log, window_start=1, window_end=2, **reshape_kwargs)
+
+    assert len(window_df) == 0
+    assert set(full_entity_df.columns) <= set(window_df.columns)
+
+def test_entity_state_index_matches_snapshots():
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        every_x_time_units=7,
+        limit_duration=602,
+        step_snapshot_max=1000
+        )
+
+    # Leave out the exit step added after each entity's last snapshot, which is not a state
+    last_snapshot = full_entity_df.groupby('entity_id')['snapshot_time'].transform('max')
+    exit_steps = (
+        (full_entity_df['event'] == 'depart')
+        & (full_entity_df['snapshot_time'] > full_entity_df['time'])
+        & (full_entity_df['snapshot_time'] == last_snapshot)
+        )
+    full_entity_df = full_entity_df[~exit_steps & full_entity_df['entity_id'].notna()]
+
+    state_index = EntityStateIndex(EVENT_LOG)
+
+    for snapshot_time, snapshot_df in full_entity_df.groupby('snapshot_time'):
+        state_df = state_index.state_at(snapshot_time).sort_values('event', kind='stable')
+
+        assert_frame_equal(
+            snapshot_df[EVENT_LOG.columns.insert(0, 'index')].reset_index(drop=True),
+            state_df[EVENT_LOG.columns.insert(0, 'index')].reset_index(drop=True),
+            check_dtype=False
+            )
+
+        assert (
+            state_index.occupancy(snapshot_time)[lambda s: s > 0].to_dict()
+            == snapshot_df['event'].value_counts().to_dict()
+            )
+
+    # Every state overlapping a period is either held at its start or begins during it
+    between_df = state_index.state_between(100, 200)
+    assert (between_df['state_start'] <= 200).all() and (between_df['state_end'] >= 100).all()
+    assert set(state_index.state_at(100)['index']) <= set(between_df['index'])
+    assert set(state_index.state_at(200)['index']) <= set(between_df['index'])
+
+@pytest.mark.parametrize(
+    "reshape_kwargs",
+    [
+        {"step_snapshot_max": 3},
+        {"every_x_time_units": 7, "step_snapshot_max": 2, "window_start": 100, "window_end": 300},
+        {"step_snapshot_max": 1, "cap_resource_use": True},
+    ]
+)
+def test_polars_backend_matches_pandas(reshape_kwargs):
+    pytest.importorskip("polars")
+
+    event_position_df = pd.DataFrame([
+        {'event': 'arrival', 'x':  50, 'y': 300, 'label': "Arrival"},
+        {'event': 'treatment_wait_begins', 'x':  205, 'y': 275, 'label': "Waiting for Treatment"},
+        {'event': 'treatment_begins', 'x':  205, 'y': 175, 'resource':'n_cubicles', 'label': "Being Treated"},
+        {'event': 'depart', 'x':  270, 'y': 70, 'label': "Exit"}
+        ])
+
+    pandas_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        **reshape_kwargs
+        )
+    polars_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        backend="polars",
+        **reshape_kwargs
+        )
+
+    # polars marks missing strings with None rather than NaN
+    assert_frame_equal(pandas_df, polars_df.to_pandas().fillna(np.nan))
+
+    assert_frame_equal(
+        generate_animation_df(pandas_df, event_position_df, step_snapshot_max=reshape_kwargs["step_snapshot_max"]),
+        generate_animation_df(
+            polars_df, event_position_df, step_snapshot_max=reshape_kwargs["step_snapshot_max"], backend="polars"
+            ).to_pandas().fillna(np.nan)
+        )
+
+@pytest.mark.parametrize(
+    "reshape_kwargs",
+    [
+        {},
+        {"every_x_time_units": 1, "step_snapshot_max": 2},
+        {"step_snapshot_max": 1, "cap_resource_use": True},
+    ]
+)
+def test_numba_kernels_match_numpy(reshape_kwargs, monkeypatch):
+    pytest.importorskip("numba")
+
+    monkeypatch.setattr(_kernels, "use_numba", False)
+    numpy_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        **reshape_kwargs
+        )
+
+    monkeypatch.setattr(_kernels, "use_numba", True)
+    monkeypatch.setattr(_kernels, "NUMBA_MIN_ROWS", 0)
+    numba_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        **reshape_kwargs
+        )
+
+    assert_frame_equal(numpy_df, numba_df)
+
+def test_numba_resource_slots_match_python(monkeypatch):
+    pytest.importorskip("numba")
+    event_log = EVENT_LOG.drop(columns='resource_id')
+
+    monkeypatch.setattr(_kernels, "use_numba", False)
+    python_log = assign_resource_ids(event_log)
+
+    monkeypatch.setattr(_kernels, "use_numba", True)
+    monkeypatch.setattr(_kernels, "NUMBA_MIN_ROWS", 0)
+    numba_log = assign_resource_ids(event_log)
+
+    assert_frame_equal(python_log, numba_log)
+
+def test_invalid_engine_raises():
+    with pytest.raises(ValueError):
+        reshape_for_animations(
+            event_log=EVENT_LOG,
+            limit_duration=g.sim_duration,
+            engine="not_an_engine"
+            )
+
+@pytest.mark.parametrize("snapshots_per_batch", [1, 7, 1000])
+def test_iter_snapshots_matches_reshape_for_animations(snapshots_per_batch):
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3
+        )
+
+    batches = list(iter_snapshots(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        snapshots_per_batch=snapshots_per_batch
+        ))
+
+    # Snapshots should be yielded in time order, with no snapshot split across batches
+    for previous_batch, batch in zip(batches, batches[1:]):
+        assert previous_batch['snapshot_time'].max() < batch['snapshot_time'].min()
+
+    streamed_df = pd.concat(batches, ignore_index=True)[full_entity_df.columns]
+
+    assert_frame_equal(full_entity_df, streamed_df)
+
+def test_parallel_reshape_matches_serial():
+    serial_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3
+        )
+
+    parallel_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=3,
+        n_jobs=2
+        )
+
+    assert_frame_equal(serial_df, parallel_df)
+
+@pytest.mark.parametrize("step_snapshot_max", [50, 3])
+def test_extend_reshape_matches_full_reshape(step_snapshot_max):
+    full_entity_df = reshape_for_animations(
+        event_log=EVENT_LOG,
+        limit_duration=g.sim_duration,
+        step_snapshot_max=step_snapshot_max
+        )
+
+    split_times = [150, 300, g.sim_duration]
+
+    extended_df, reshape_state = reshape_for_animations(
+        event_log=EVENT_LOG[EVENT_LOG['time'] <= split_times[0]],
+        limit_duration=split_times[0],
+        step_snapshot_max=step_snapshot_max,
+        return_state=True
+        )
+
+    for previous_limit, limit in zip(split_times, split_times[1:]):
+        extended_df, reshape_state = extend_reshape_for_animations(
+            extended_df,
+            reshape_state,
+            new_event_log=EVENT_LOG[(EVENT_LOG['time'] > previous_limit) & (EVENT_LOG['time'] <= limit)],
+            limit_duration=limit
+            )
+
+    assert_frame_equal(full_entity_df, extended_df)
+
+    # Entity 1 has left by the first split, and comes back for a second stay after it. Nobody
+    # leaves between the first and second splits
+    reshape_kwargs = dict(every_x_time_units=10, step_snapshot_max=step_snapshot_max)
+    full_entity_df = reshape_for_animations(event_log=REENTRANT_LOG, limit_duration=100, **reshape_kwargs)
+
+    split_times = [30, 60, 100]
+
+    extended_df, reshape_state = reshape_for_animations(
+        event_log=REENTRANT_LOG[REENTRANT_LOG['time'] <= split_times[0]],
+        limit_duration=split_times[0],
+        return_state=True,
+        **reshape_kwargs
+        )
+
+    for previous_limit, limit in zip(split_times, split_times[1:]):
+        extended_df, reshape_state = extend_reshape_for_animations(
+            extended_df,
+            reshape_state,
+            new_event_log=REENTRANT_LOG[
+                (REENTRANT_LOG['time'] > previous_limit) & (REENTRANT_LOG['time'] <= limit)
+                ],
+            limit_duration=limit
+            )
+
+    assert_frame_equal(full_entity_df, extended_df)
+
+def test_extend_reshape_rejects_events_before_limit():
+    extended_df, reshape_state = reshape_for_animations(
+        event_log=EVENT_LOG[EVENT_LOG['time'] <= 300],
+        limit_duration=300,
+        return_state=True
+        )
+
+    with pytest.raises(ValueError):
+        extend_reshape_for_animations(
+            extended_df,
+            reshape_state,
+            new_event_log=EVENT_LOG[EVENT_LOG['time'] > 200],
+            limit_duration=g.sim_duration
+            )
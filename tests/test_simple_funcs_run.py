@@ -1,8 +1,10 @@
 from sample_models._simple_fifo_with_logging_storewrapper import Trial, g
-from vidigi.prep import reshape_for_animations, generate_animation_df
+from vidigi.prep import reshape_for_animations, generate_animation_df, assign_resource_ids
 from vidigi.animation import generate_animation, animate_activity_log
+import vidigi.animation
 import pandas as pd
 import plotly.io as pio
+import plotly.express as px
 pio.renderers.default = "notebook"
 import os
 import pytest
@@ -107,3 +109,309 @@ def test_all_in_one_ANIMATE_ACTIVITY_LOG():
         )
     except:
         pytest.fail("animation.animate_activity_log() function failed to run with default params")
+
+@pytest.mark.parametrize("time_display_units", [None, "d"])
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_max_memory_matches_unpaged(time_display_units):
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5,
+        time_display_units=time_display_units,
+        start_date="2024-01-01"
+        )
+
+    unpaged_fig = animate_activity_log(**animation_kwargs)
+    paged_fig = animate_activity_log(max_memory="200KB", **animation_kwargs)
+
+    assert paged_fig.to_json() == unpaged_fig.to_json()
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_window_without_entities():
+    # Nobody arrives until time 100
+    event_log = my_trial.all_event_logs[my_trial.all_event_logs['run']==1].assign(
+        time=lambda df: df['time'] + 100
+        )
+    animation_kwargs = dict(
+        event_log=event_log,
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=10
+        )
+
+    fig = animate_activity_log(window_start=0, window_end=50, **animation_kwargs)
+
+    assert len(fig.frames) == 6
+
+    with pytest.raises(ValueError, match="No snapshots"):
+        animate_activity_log(window_start=1, window_end=2, **animation_kwargs)
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_polars_backend_matches_pandas():
+    pytest.importorskip("polars")
+
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5
+        )
+
+    pandas_fig = animate_activity_log(**animation_kwargs)
+    polars_fig = animate_activity_log(backend="polars", **animation_kwargs)
+
+    assert polars_fig.to_json() == pandas_fig.to_json()
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_datetime_event_log_matches_numeric():
+    event_log = my_trial.all_event_logs[my_trial.all_event_logs['run']==1]
+    datetime_log = event_log.assign(
+        time=pd.Timestamp("2024-01-01") + pd.to_timedelta(event_log['time'], unit='min')
+        )
+
+    animation_kwargs = dict(
+        event_position_df=event_position_df,
+        scenario=g(),
+        time_display_units="dhm"
+        )
+
+    numeric_fig = animate_activity_log(
+        event_log=event_log,
+        limit_duration=g.sim_duration,
+        every_x_time_units=5,
+        start_date="2024-01-01",
+        **animation_kwargs
+        )
+    datetime_fig = animate_activity_log(
+        event_log=datetime_log,
+        limit_duration=pd.Timedelta(minutes=g.sim_duration),
+        every_x_time_units="5min",
+        **animation_kwargs
+        )
+
+    # Hover text shows the event times themselves, which differ, but every frame is the same
+    assert [frame.name for frame in datetime_fig.frames] == [frame.name for frame in numeric_fig.frames]
+    for numeric_frame, datetime_frame in zip(numeric_fig.frames, datetime_fig.frames):
+        for numeric_trace, datetime_trace in zip(numeric_frame.data, datetime_frame.data):
+            assert list(numeric_trace.x) == list(datetime_trace.x)
+            assert list(numeric_trace.y) == list(datetime_trace.y)
+            assert list(numeric_trace.text) == list(datetime_trace.text)
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_resourceless_event_log():
+    # A model without resources logs no resource use and has no resource ID column
+    event_log = my_trial.all_event_logs[my_trial.all_event_logs['run']==1].drop(columns='resource_id')
+    event_log['event_type'] = event_log['event_type'].replace('resource_use', 'queue')
+    resourceless_event_position_df = event_position_df.drop(columns='resource')
+
+    full_entity_df = reshape_for_animations(
+        event_log=event_log, limit_duration=g.sim_duration, every_x_time_units=5
+        )
+    full_entity_df_plus_pos = generate_animation_df(
+        full_entity_df=full_entity_df, event_position_df=resourceless_event_position_df
+        )
+
+    assert full_entity_df_plus_pos[['x_final', 'y_final']].notna().all().all()
+
+    fig = animate_activity_log(
+        event_log=event_log,
+        event_position_df=resourceless_event_position_df,
+        limit_duration=g.sim_duration,
+        every_x_time_units=5
+        )
+
+    assert len(fig.frames) == full_entity_df['snapshot_time'].nunique()
+
+@pytest.mark.parametrize("slim", [False, True])
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_low_memory_matches_default(slim):
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5,
+        slim=slim
+        )
+
+    default_fig = animate_activity_log(**animation_kwargs)
+    low_memory_fig = animate_activity_log(low_memory=True, **animation_kwargs)
+
+    assert low_memory_fig.to_json() == default_fig.to_json()
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_infer_resource_ids():
+    event_log = my_trial.all_event_logs[my_trial.all_event_logs['run']==1]
+
+    animation_kwargs = dict(
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5
+        )
+
+    inferred_fig = animate_activity_log(
+        event_log=event_log.drop(columns='resource_id'), infer_resource_ids=True, **animation_kwargs
+        )
+    assigned_fig = animate_activity_log(event_log=assign_resource_ids(event_log), **animation_kwargs)
+
+    assert inferred_fig.to_json() == assigned_fig.to_json()
+
+@pytest.mark.parametrize("time_display_units", [None, "dhm"])
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_frames_match_plotly_express(monkeypatch, time_display_units):
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5,
+        time_display_units=time_display_units
+        )
+
+    fig = animate_activity_log(**animation_kwargs)
+
+    monkeypatch.setattr(
+        vidigi.animation, "_animated_scatter",
+        lambda *args, frame_encoding, compact_frames, hover_decimals, **kwargs: px.scatter(*args, **kwargs)
+        )
+    px_fig = animate_activity_log(**animation_kwargs)
+
+    assert len(fig.frames) > 1
+    assert fig.to_json() == px_fig.to_json()
+
+def test_snapshot_time_labels_formatted_per_unique_time():
+    snapshot_time = pd.Series([0.0, 0.0, 1425.0, 1425.0, 1440.0, 0.0], index=[5, 3, 8, 1, 9, 0])
+
+    snapshot_time_labels, snapshot_time_display = vidigi.animation._format_snapshot_times(
+        snapshot_time, time_display_units="day_clock", start_date="2024-01-01", start_time="08:00:00"
+        )
+
+    expected = ["Simulation Day 1\n08:00", "Simulation Day 1\n08:00",
+                "Simulation Day 2\n07:45", "Simulation Day 2\n07:45",
+                "Simulation Day 2\n08:00", "Simulation Day 1\n08:00"]
+    assert snapshot_time_display.tolist() == expected
+    assert snapshot_time_labels.tolist() == expected
+    assert snapshot_time_display.index.equals(snapshot_time.index)
+
+def test_snapshot_time_labels_match_display_units_exactly():
+    snapshot_time = pd.Series([0.0, 1440.0])
+    format_kwargs = dict(start_date="2024-01-01", start_time="08:00:00")
+
+    snapshot_time_labels, snapshot_time_display = vidigi.animation._format_snapshot_times(
+        snapshot_time, time_display_units="d", **format_kwargs
+        )
+
+    assert snapshot_time_display.tolist() == ["Monday 01 January 2024", "Tuesday 02 January 2024"]
+    assert snapshot_time_labels.tolist() == ["2024-01-01", "2024-01-02"]
+
+    # Any other string is a strftime format of its own, even one that "d" contains
+    snapshot_time_labels, snapshot_time_display = vidigi.animation._format_snapshot_times(
+        snapshot_time, time_display_units="", **format_kwargs
+        )
+
+    assert snapshot_time_display.tolist() == ["", ""]
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_delta_frames_show_same_entities():
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5
+        )
+
+    full_fig = animate_activity_log(**animation_kwargs)
+    delta_fig = animate_activity_log(frame_encoding="delta", **animation_kwargs)
+
+    n_entity_traces = len(delta_fig.data) - (len(full_fig.data) - 1)
+    delta_frames = {frame.name: frame for frame in delta_fig.frames}
+
+    def entities_shown(traces):
+        return sorted(
+            (entity_id, x, y, icon)
+            for trace in traces
+            for entity_id, x, y, icon in zip(trace.ids, trace.x, trace.y, trace.text)
+            )
+
+    # Merge each delta frame onto its chain of base frames, as plotly does when showing it
+    for full_frame in full_fig.frames:
+        frame = delta_frames[full_frame.name]
+        chain = [frame]
+        while frame.baseframe is not None:
+            frame = delta_frames[frame.baseframe]
+            chain.append(frame)
+        traces = {}
+        for frame in reversed(chain):
+            traces.update(zip(frame.traces, frame.data))
+
+        assert sorted(traces) == list(range(n_entity_traces))
+        assert entities_shown(traces.values()) == entities_shown(full_frame.data)
+
+    assert [step.label for step in delta_fig.layout.sliders[0].steps] == \
+        [step.label for step in full_fig.layout.sliders[0].steps]
+    assert sum(len(trace.x) for frame in delta_fig.frames for trace in frame.data) < \
+        sum(len(trace.x) for frame in full_fig.frames for trace in frame.data) / 2
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_delta_frames_rejected_with_max_memory():
+    with pytest.raises(ValueError, match="max_memory"):
+        animate_activity_log(
+            event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+            event_position_df=event_position_df,
+            scenario=g(),
+            frame_encoding="delta",
+            max_memory="1MB"
+            )
+
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_compact_frames():
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5
+        )
+
+    fig = animate_activity_log(**animation_kwargs)
+    compact_fig = animate_activity_log(compact_frames=True, **animation_kwargs)
+
+    assert len(compact_fig.to_json()) < len(fig.to_json()) * 0.75
+    assert len(compact_fig.frames) == len(fig.frames)
+
+    for frame, compact_frame in zip(fig.frames, compact_fig.frames):
+        trace, compact_trace = frame.data[0], compact_frame.data[0]
+        assert compact_trace.x.dtype.kind == "i"
+        assert list(compact_trace.x) == [round(x) for x in trace.x]
+        assert list(compact_trace.y) == [round(y) for y in trace.y]
+        assert list(compact_trace.ids) == list(trace.ids)
+        # Entity ID, time and resource ID, with the snapshot time left to snapshot_time_display
+        assert compact_trace.customdata.dtype == "float32"
+        assert compact_trace.customdata.shape == (len(trace.x), 3)
+        assert "time=%{customdata[1]:.2~f}" in compact_trace.hovertemplate
+        assert f"snapshot_time_display={frame.name}" in compact_trace.hovertemplate
+
+    # A clock showing whole minutes needs event times to no finer than a minute
+    clock_fig = animate_activity_log(compact_frames=True, time_display_units="dhm", **animation_kwargs)
+
+    for frame, clock_frame in zip(fig.frames, clock_fig.frames):
+        trace, clock_trace = frame.data[0], clock_frame.data[0]
+        assert "time=%{customdata[1]:.0~f}" in clock_trace.hovertemplate
+        assert list(clock_trace.customdata[:, 1]) == [round(t) for t in trace.customdata[:, 1]]
+
+@pytest.mark.parametrize("time_display_units", [None, "dhm"])
+def test_all_in_one_ANIMATE_ACTIVITY_LOG_streamed_html_matches_write_html(tmp_path, time_display_units):
+    animation_kwargs = dict(
+        event_log=my_trial.all_event_logs[my_trial.all_event_logs['run']==1],
+        event_position_df=event_position_df,
+        scenario=g(),
+        limit_duration=g.sim_duration,
+        every_x_time_units=5,
+        time_display_units=time_display_units
+        )
+    html_options = dict(include_plotlyjs="cdn", div_id="animation")
+
+    animate_activity_log(**animation_kwargs).write_html(tmp_path / "figure.html", **html_options)
+    streamed = animate_activity_log(
+        max_memory="200KB", html_file=tmp_path / "streamed.html", html_options=html_options,
+        **animation_kwargs
+        )
+
+    assert streamed is None
+    assert (tmp_path / "streamed.html").read_text(encoding="utf-8") == \
+        (tmp_path / "figure.html").read_text(encoding="utf-8")
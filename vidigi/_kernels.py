@@ -0,0 +1,418 @@
+"""
+Numeric kernels used by the sweep engine and by assign_resource_ids() in vidigi.prep.
+
+The work done for each batch of snapshots - expanding the snapshot ranges in which each event
+is the latest event of its entity, ranking entities within each event and applying the
+step_snapshot_max limit - has a NumPy implementation and a Numba implementation. When Numba is
+installed (`pip install vidigi[numba]`) the compiled version is used for batches of at least
+NUMBA_MIN_ROWS rows, below which the time taken to compile it on first use would outweigh the
+time saved. Both implementations give identical results, so the NumPy version also serves as
+the reference for the compiled one.
+
+Assigning resource slots to intervals of resource use is inherently sequential, so it has a
+pure Python implementation using heapq, which is compiled with Numba in the same way.
+"""
+import heapq
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Set to False to always use the NumPy implementation, e.g. when comparing the two
+use_numba = numba is not None
+
+NUMBA_MIN_ROWS = 50_000
+
+def offsets_within(counts):
+    """
+    For an array of counts, return the position of each element within its block when
+    np.repeat(..., counts) is applied (e.g. [2, 3] gives [0, 1, 0, 1, 2]).
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    block_starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(block_starts, counts)
+
+################################################################################
+# NumPy implementation
+################################################################################
+
+def _rank_and_cap(rows,
+                  snapshot_idx,
+                  event_codes,
+                  rank_key,
+                  time_key,
+                  time_order,
+                  uncapped_rows,
+                  step_snapshot_max):
+    """
+    Rank entities within each (snapshot, event) group and apply the step_snapshot_max limit.
+
+    Entities are ranked by their rank_key. Groups are capped unless the earliest row in the
+    group belongs to an uncapped event type. In capped groups only ranks up to
+    step_snapshot_max + 1 are kept, with the final kept row carrying the number of additional
+    entities not shown.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The rank of each row, the number of additional entities (NaN for all but the
+        '+ N more' rows), and a boolean mask of the rows to keep.
+    """
+    row_count = len(rows)
+    rank = np.empty(row_count, dtype=float)
+    additional = np.full(row_count, np.nan)
+    keep = np.ones(row_count, dtype=bool)
+
+    if row_count == 0:
+        return rank, additional, keep
+
+    order = np.lexsort((rank_key[rows], event_codes[rows], snapshot_idx))
+    sorted_rows = rows[order]
+    sorted_events = event_codes[sorted_rows]
+    sorted_snapshots = snapshot_idx[order]
+
+    new_group = np.ones(row_count, dtype=bool)
+    new_group[1:] = (
+        (sorted_snapshots[1:] != sorted_snapshots[:-1]) |
+        (sorted_events[1:] != sorted_events[:-1])
+        )
+    group_starts = np.flatnonzero(new_group)
+    group_ids = np.cumsum(new_group) - 1
+    group_sizes = np.diff(np.append(group_starts, row_count))
+
+    sorted_rank = np.arange(row_count) - group_starts[group_ids] + 1
+
+    # The loop engine decides whether to cap a group based on its earliest event
+    group_first_rows = time_order[np.minimum.reduceat(time_key[sorted_rows], group_starts)]
+    group_capped = ~uncapped_rows[group_first_rows][group_ids]
+
+    sorted_keep = ~group_capped | (sorted_rank <= step_snapshot_max + 1)
+    sorted_is_additional = group_capped & (sorted_rank == step_snapshot_max + 1)
+
+    rank[order] = sorted_rank
+    keep[order] = sorted_keep
+    additional[order[sorted_is_additional]] = (
+        group_sizes[group_ids] - sorted_rank
+        )[sorted_is_additional]
+
+    return rank, additional, keep
+
+def _snapshot_rows_numpy(segment_rows,
+                         segment_start,
+                         segment_lengths,
+                         event_codes,
+                         rank_key,
+                         time_key,
+                         time_order,
+                         uncapped_rows,
+                         step_snapshot_max):
+    # Expand each range into one row per snapshot
+    rows = np.repeat(segment_rows, segment_lengths)
+    snapshot_idx = np.repeat(segment_start, segment_lengths) + offsets_within(segment_lengths)
+
+    # Rows whose event is missing are dropped by the loop engine's groupby
+    has_event = event_codes[rows] >= 0
+    rows, snapshot_idx = rows[has_event], snapshot_idx[has_event]
+
+    rank, additional, keep = _rank_and_cap(
+        rows=rows,
+        snapshot_idx=snapshot_idx,
+        event_codes=event_codes,
+        rank_key=rank_key,
+        time_key=time_key,
+        time_order=time_order,
+        uncapped_rows=uncapped_rows,
+        step_snapshot_max=step_snapshot_max
+    )
+
+    rows, snapshot_idx = rows[keep], snapshot_idx[keep]
+    rank, additional = rank[keep], additional[keep]
+
+    # Within each snapshot, keep events in time order with any '+ N more' rows last
+    # - a stable sort by snapshot and event then matches the loop engine
+    output_order = np.lexsort((time_key[rows], ~np.isnan(additional), snapshot_idx))
+
+    return (
+        rows[output_order],
+        snapshot_idx[output_order],
+        rank[output_order],
+        additional[output_order]
+    )
+
+################################################################################
+# Numba implementation
+################################################################################
+
+# Rather than sorting every row, the compiled version sorts the (far fewer) ranges. Expanding
+# the ranges in order of event and rank into per-snapshot buckets then leaves each snapshot's
+# rows ranked, and expanding them again in time order gives the output order. A range never
+# covers the same snapshot as another range of the same row, so ties between ranges do not
+# affect the result.
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _snapshot_rows_numba(segment_rows,
+                             segment_start,
+                             segment_lengths,
+                             event_codes,
+                             rank_key,
+                             time_key,
+                             time_order,
+                             uncapped_rows,
+                             step_snapshot_max):
+        segment_count = len(segment_rows)
+
+        # Position of each range's first row in the expanded rows, and the snapshots covered
+        row_base = np.empty(segment_count, dtype=np.int64)
+        row_count = 0
+        first_snapshot = np.iinfo(np.int64).max
+        last_snapshot = np.iinfo(np.int64).min
+        for s in range(segment_count):
+            if event_codes[segment_rows[s]] < 0:
+                # Rows whose event is missing are dropped by the loop engine's groupby
+                segment_lengths[s] = 0
+            row_base[s] = row_count
+            row_count += segment_lengths[s]
+            if segment_lengths[s] > 0:
+                first_snapshot = min(first_snapshot, segment_start[s])
+                last_snapshot = max(last_snapshot, segment_start[s] + segment_lengths[s])
+
+        if row_count == 0:
+            return (np.empty(0, dtype=segment_rows.dtype), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64))
+
+        # Number of rows in each snapshot, counted from where ranges begin and end, and where
+        # each snapshot's bucket starts
+        snapshot_count = last_snapshot - first_snapshot
+        range_changes = np.zeros(snapshot_count + 1, dtype=np.int64)
+        for s in range(segment_count):
+            if segment_lengths[s] > 0:
+                range_changes[segment_start[s] - first_snapshot] += 1
+                range_changes[segment_start[s] - first_snapshot + segment_lengths[s]] -= 1
+
+        bucket_starts = np.zeros(snapshot_count + 1, dtype=np.int64)
+        bucket_size = 0
+        for b in range(snapshot_count):
+            bucket_size += range_changes[b]
+            bucket_starts[b + 1] = bucket_starts[b] + bucket_size
+
+        # Fill each snapshot's bucket in order of event then rank key; event codes are below
+        # the number of event log rows, so this key cannot overflow
+        key_scale = len(rank_key)
+        rank_keys = np.empty(segment_count, dtype=np.int64)
+        for s in range(segment_count):
+            rank_keys[s] = event_codes[segment_rows[s]] * key_scale + rank_key[segment_rows[s]]
+
+        # Each bucket holds the position of the row in the expanded rows, and its event log row
+        bucket_rows = np.empty(row_count, dtype=np.int64)
+        bucket_log_rows = np.empty(row_count, dtype=np.int64)
+        next_position = bucket_starts[:-1].copy()
+        for s in np.argsort(rank_keys):
+            for offset in range(segment_lengths[s]):
+                b = segment_start[s] - first_snapshot + offset
+                bucket_rows[next_position[b]] = row_base[s] + offset
+                bucket_log_rows[next_position[b]] = segment_rows[s]
+                next_position[b] += 1
+
+        # Rank and cap each (snapshot, event) group, recording the results by expanded row
+        rank = np.empty(row_count, dtype=np.float64)
+        additional = np.full(row_count, np.nan)
+        keep = np.ones(row_count, dtype=np.bool_)
+        kept_counts = np.zeros(snapshot_count, dtype=np.int64)
+
+        cap_rank = step_snapshot_max + 1
+        for b in range(snapshot_count):
+            start = bucket_starts[b]
+            while start < bucket_starts[b + 1]:
+                group_event = event_codes[bucket_log_rows[start]]
+                earliest_time_key = time_key[bucket_log_rows[start]]
+
+                end = start + 1
+                while (end < bucket_starts[b + 1] and
+                       event_codes[bucket_log_rows[end]] == group_event):
+                    earliest_time_key = min(earliest_time_key, time_key[bucket_log_rows[end]])
+                    end += 1
+
+                # The loop engine decides whether to cap a group based on its earliest event
+                capped = not uncapped_rows[time_order[earliest_time_key]]
+                group_size = end - start
+
+                for i in range(start, end):
+                    group_rank = i - start + 1
+                    rank[bucket_rows[i]] = group_rank
+                    if capped and group_rank > cap_rank:
+                        keep[bucket_rows[i]] = False
+                    elif capped and group_rank == cap_rank:
+                        additional[bucket_rows[i]] = group_size - group_rank
+                    if keep[bucket_rows[i]]:
+                        kept_counts[b] += 1
+
+                start = end
+
+        # Output the kept rows of each snapshot in time order, with '+ N more' rows last
+        output_starts = np.zeros(snapshot_count + 1, dtype=np.int64)
+        for b in range(snapshot_count):
+            output_starts[b + 1] = output_starts[b] + kept_counts[b]
+
+        additional_counts = np.zeros(snapshot_count, dtype=np.int64)
+        for s in range(segment_count):
+            for offset in range(segment_lengths[s]):
+                if not np.isnan(additional[row_base[s] + offset]):
+                    additional_counts[segment_start[s] - first_snapshot + offset] += 1
+
+        next_position = output_starts[:-1].copy()
+        next_additional = np.empty(snapshot_count, dtype=np.int64)
+        for b in range(snapshot_count):
+            next_additional[b] = output_starts[b + 1] - additional_counts[b]
+
+        time_keys = np.empty(segment_count, dtype=np.int64)
+        for s in range(segment_count):
+            time_keys[s] = time_key[segment_rows[s]]
+
+        output_count = output_starts[snapshot_count]
+        output_rows = np.empty(output_count, dtype=segment_rows.dtype)
+        output_snapshots = np.empty(output_count, dtype=np.int64)
+        output_rank = np.empty(output_count, dtype=np.float64)
+        output_additional = np.empty(output_count, dtype=np.float64)
+
+        for s in np.argsort(time_keys):
+            for offset in range(segment_lengths[s]):
+                expanded_row = row_base[s] + offset
+                if not keep[expanded_row]:
+                    continue
+                b = segment_start[s] - first_snapshot + offset
+                if np.isnan(additional[expanded_row]):
+                    position = next_position[b]
+                    next_position[b] += 1
+                else:
+                    position = next_additional[b]
+                    next_additional[b] += 1
+                output_rows[position] = segment_rows[s]
+                output_snapshots[position] = segment_start[s] + offset
+                output_rank[position] = rank[expanded_row]
+                output_additional[position] = additional[expanded_row]
+
+        return output_rows, output_snapshots, output_rank, output_additional
+
+################################################################################
+# Resource slot assignment
+################################################################################
+
+def _lowest_free_slots_python(pool_codes, starts, ends):
+    """
+    Give each interval the lowest numbered slot (from 1) of its pool that is free when it
+    starts, with intervals sorted by pool and then start. A slot freed at the time an interval
+    starts can be used by it.
+    """
+    slots = np.empty(len(starts), dtype=np.int64)
+    # (end, slot) of the intervals in progress, and the slots freed by those that have ended
+    busy = [(0, 0)]
+    free = [0]
+    busy.pop()
+    free.pop()
+    next_slot = 1
+    pool = -1
+
+    for i in range(len(starts)):
+        if pool_codes[i] != pool:
+            pool = pool_codes[i]
+            busy = [(0, 0)]
+            free = [0]
+            busy.pop()
+            free.pop()
+            next_slot = 1
+
+        while len(busy) > 0 and busy[0][0] <= starts[i]:
+            heapq.heappush(free, heapq.heappop(busy)[1])
+
+        if len(free) > 0:
+            slot = heapq.heappop(free)
+        else:
+            slot = next_slot
+            next_slot += 1
+
+        heapq.heappush(busy, (ends[i], slot))
+        slots[i] = slot
+
+    return slots
+
+if numba is not None:
+    _lowest_free_slots_numba = numba.njit(cache=True)(_lowest_free_slots_python)
+
+def lowest_free_slots(pool_codes, starts, ends):
+    """
+    Assign resource slots to intervals of resource use by interval colouring.
+
+    Parameters
+    ----------
+    pool_codes : np.ndarray
+        The pool of resources each interval uses. Intervals must be sorted by pool, and then by
+        start.
+    starts, ends : np.ndarray
+        The start and end of each interval, as integers.
+
+    Returns
+    -------
+    np.ndarray
+        The slot of each interval, counting from 1 within each pool.
+    """
+    pool_codes = np.asarray(pool_codes, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    if use_numba and numba is not None and len(starts) >= NUMBA_MIN_ROWS:
+        return _lowest_free_slots_numba(pool_codes, starts, ends)
+
+    return _lowest_free_slots_python(pool_codes, starts, ends)
+
+################################################################################
+# Dispatch
+################################################################################
+
+def snapshot_rows(segment_rows,
+                  segment_start,
+                  segment_lengths,
+                  event_codes,
+                  rank_key,
+                  time_key,
+                  time_order,
+                  uncapped_rows,
+                  step_snapshot_max):
+    """
+    Compute the rows of a batch of snapshots from the ranges of snapshots in which each event
+    is the latest event of its entity.
+
+    Parameters
+    ----------
+    segment_rows, segment_start, segment_lengths : np.ndarray
+        The event log row of each range, the index of the first snapshot it covers and the
+        number of snapshots it covers.
+    event_codes, rank_key, time_key, time_order, uncapped_rows : np.ndarray
+        Per event log row arrays from _SnapshotSweep.
+    step_snapshot_max : int
+        The maximum number of entities to include in each snapshot for each event.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The event log row, snapshot index, rank and number of additional entities
+        (NaN unless the row is a '+ N more' row) for every row of the snapshots. Rows are
+        ordered by snapshot, then by time, with any '+ N more' rows last.
+    """
+    segment_start = np.asarray(segment_start, dtype=np.int64)
+    segment_lengths = np.asarray(segment_lengths, dtype=np.int64)
+
+    if use_numba and numba is not None and segment_lengths.sum() >= NUMBA_MIN_ROWS:
+        return _snapshot_rows_numba(
+            segment_rows, segment_start, segment_lengths.copy(), event_codes, rank_key,
+            time_key, time_order, uncapped_rows, step_snapshot_max
+            )
+
+    return _snapshot_rows_numpy(
+        segment_rows, segment_start, segment_lengths, event_codes, rank_key,
+        time_key, time_order, uncapped_rows, step_snapshot_max
+        )
@@ -3,11 +3,377 @@ import time
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from vidigi.prep import reshape_for_animations, generate_animation_df
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs
+from vidigi.prep import (reshape_for_animations, iter_snapshots, generate_animation_df, ResourceLayout,
+                         assign_resource_ids)
+from vidigi import _kernels
 import numpy as np
 from copy import deepcopy
+from pathlib import Path
 
 
+def _decode_slim_column(values):
+    """
+    Decode a dictionary-encoded or downcast column from slim mode back to its labels or
+    full-width type.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    elif values.dtype == np.float32:
+        return values.astype(np.float64)
+    elif values.dtype == np.int32:
+        return values.astype(np.int64)
+    return values
+
+# Seconds in each simulation time unit and in the finest unit shown by each time_display_units
+# option, with months and years approximated as in _format_snapshot_times()
+_SECONDS_PER_TIME_UNIT = {
+    "second": 1, "minute": 60, "hour": 60*60, "day": 60*60*24, "week": 60*60*24*7,
+    "month": 60*60*24*30, "year": 60*60*24*365
+    }
+_DISPLAY_RESOLUTION_SECONDS = {
+    "dhms": 1, "dhms_ampm": 1, "dhm": 60, "dhm_ampm": 60, "dh": 60*60, "dh_ampm": 60*60,
+    "d": 60*60*24, "m": 60*60*24*30, "y": 60*60*24*365,
+    "day_clock": 60, "day_clock_ampm": 60, "simulation_day_clock": 60, "simulation_day_clock_ampm": 60
+    }
+
+def _time_display_decimals(simulation_time_unit="minutes", time_display_units=None):
+    """
+    Work out how many decimal places of simulation time are needed to tell apart the finest
+    unit shown by `time_display_units`, e.g. none for "dhm" in a simulation run in minutes, or
+    two for "dhms". Raw simulation times and custom strftime formats are given hundredths.
+    """
+    simulation_seconds = _SECONDS_PER_TIME_UNIT.get(str(simulation_time_unit).removesuffix("s"))
+    display_seconds = _DISPLAY_RESOLUTION_SECONDS.get(time_display_units)
+    if simulation_seconds is None or display_seconds is None:
+        return 2
+    return max(0, int(np.ceil(np.log10(simulation_seconds / display_seconds))))
+
+def _format_snapshot_times(snapshot_time, simulation_time_unit="minutes", time_display_units=None,
+                           start_date=None, start_time=None):
+    """
+    Work out the values to use for the snapshot_time and snapshot_time_display columns of the
+    animation from the simulation time of each snapshot. See `generate_animation` for details of
+    the time display options.
+
+    Every entity shown in a snapshot shares its time, so the conversion and formatting is done
+    once for each unique snapshot time and the labels then mapped back to the rows.
+    """
+    if time_display_units is None:
+        return snapshot_time, snapshot_time
+
+    snapshot_codes, unique_times = pd.factorize(snapshot_time)
+    unique_times = pd.Series(unique_times)
+
+    # Snapshots of event logs with datetime times are already real-world times, so need no
+    # conversion from simulation time units
+    is_datetime = pd.api.types.is_datetime64_any_dtype(snapshot_time)
+
+    if not is_datetime:
+
+        if simulation_time_unit in ("second", "seconds"):
+            unit = "s"
+        elif simulation_time_unit in ("minute", "minutes"):
+            unit = "m"
+        elif simulation_time_unit in ("hour", "hours"):
+            unit = "h"
+        elif simulation_time_unit in ("day", "days"):
+            unit = "d"
+        elif simulation_time_unit in ("week", "weeks"):
+            unit = "w"
+        elif simulation_time_unit in ("month", "months"):
+            # Approximate 1 month as 30 days
+            unique_times = unique_times * 30
+            unit = "d"
+        elif simulation_time_unit in ("year", "years"):
+            # Approximate 1 year as 365 days
+            unique_times = unique_times * 365
+            unit = "d"
+
+        # Work out the datetime the start of the simulation corresponds to
+        if start_date is None and start_time is None:
+            simulation_start = dt.date.today() + pd.DateOffset(days=165)
+
+        elif start_date is not None and start_time is None:
+            simulation_start = dt.datetime.strptime(start_date, "%Y-%m-%d")
+
+        else:
+            start_time_dt = dt.datetime.strptime(start_time, "%H:%M:%S")
+
+            start_time_time_delta = dt.timedelta(
+                    hours=start_time_dt.hour,
+                    minutes=start_time_dt.minute,
+                    seconds=start_time_dt.second
+                )
+
+            if start_date is None:
+                simulation_start = dt.date.today() + pd.DateOffset(days=165) + start_time_time_delta
+            else:
+                simulation_start = dt.datetime.strptime(start_date, "%Y-%m-%d") + start_time_time_delta
+
+        simulation_start = pd.Timestamp(simulation_start)
+
+        unique_times = simulation_start + pd.to_timedelta(unique_times.to_numpy(), unit=unit)
+
+    else:
+        unique_times = pd.DatetimeIndex(unique_times)
+        # Count simulation days from start_date, if given, or else from the first snapshot
+        if start_date is not None:
+            simulation_start = pd.Timestamp(start_date).tz_localize(unique_times.tz)
+        else:
+            simulation_start = unique_times.min()
+
+    # https://strftime.org/
+    if time_display_units in ("dhms", "dhms_ampm"):
+        display_fmt = '%d %B %Y\n%I:%M:%S %p' if time_display_units.endswith("ampm") else '%d %B %Y\n%H:%M:%S'
+        time_fmt = display_fmt
+
+    elif time_display_units in ("dhm", "dhm_ampm"):
+        display_fmt = '%d %B %Y\n%I:%M %p' if time_display_units.endswith("ampm") else '%d %B %Y\n%H:%M'
+        time_fmt = display_fmt
+
+    elif time_display_units in ("dh", "dh_ampm"):
+        display_fmt = '%d %B %Y\n%I %p' if time_display_units.endswith("ampm") else '%d %B %Y\n%H'
+        time_fmt = display_fmt
+
+    elif time_display_units == "d":
+        display_fmt = '%A %d %B %Y'
+        time_fmt = '%Y-%m-%d'
+
+    elif time_display_units == "m":
+        display_fmt = '%B %Y'
+        time_fmt = display_fmt
+
+    elif time_display_units == "y":
+        display_fmt = '%Y'
+        time_fmt = display_fmt
+
+    elif time_display_units in ("day_clock", "simulation_day_clock", "day_clock_ampm", "simulation_day_clock_ampm"):
+        display_fmt = None
+        clock_fmt = "%I:%M %p" if time_display_units.endswith("_ampm") else "%H:%M"
+
+    else:
+        display_fmt = time_display_units
+        time_fmt = display_fmt
+
+    if display_fmt is None:
+        # Count days from the start of the simulation rather than the first snapshot shown,
+        # so labels are the same however the snapshots are split up
+        sim_day = (unique_times.normalize() - simulation_start.normalize()).days + 1
+        unique_display = "Simulation Day " + sim_day.astype(str) + "\n" + unique_times.strftime(clock_fmt)
+        unique_labels = unique_display
+    else:
+        try:
+            unique_display = unique_times.strftime(display_fmt)
+            unique_labels = unique_display if time_fmt == display_fmt else unique_times.strftime(time_fmt)
+        except ValueError:
+            raise ValueError("Invalid time_display_units option provided. Valid options are: dhms, dhm, dh, d, m, y. Alternatively, you can provide your own valid strftime format (e.g. '%Y-%m-%d %H'). See the strftime documentation for more details: https://strftime.org/")
+
+    def to_rows(unique_values):
+        # Rows without a snapshot time (code -1) pick up the trailing missing value
+        values = np.append(np.asarray(unique_values, dtype=object), np.nan)
+        return pd.Series(values[snapshot_codes], index=snapshot_time.index, name=snapshot_time.name)
+
+    return to_rows(unique_labels), to_rows(unique_display)
+
+
+def _animated_scatter(df, x, y, animation_frame, animation_group, text, hover_name, hover_data,
+                      frame_encoding="full", compact_frames=False, hover_decimals=2, **scatter_kwargs):
+    """
+    Build the same animated scatter plot as px.scatter() with these arguments, constructing
+    the frames directly from arrays rather than having plotly express group, sort and style
+    every frame of the dataframe.
+
+    Plotly express is only used to lay out a figure from the first row of the first two
+    frames, from which the layout, the animation controls and the styling and hover template
+    of the trace are taken. Every frame is then filled in with slices of the columns, grouped
+    by a single stable argsort of the frame of each row.
+
+    With `frame_encoding="delta"`, the frames are instead encoded by `_fill_delta_frames`, and
+    the hover template leaves out the frame. With `compact_frames`, numeric hover data is stored
+    in single precision where that keeps it exact to `hover_decimals` decimal places.
+    """
+    scatter_kwargs = dict(
+        x=x, y=y, animation_frame=animation_frame, animation_group=animation_group, text=text,
+        hover_name=hover_name, hover_data=hover_data, **scatter_kwargs
+        )
+
+    # Frames in order of first appearance, as plotly express orders them, with rows
+    # without a frame dropped
+    frame_codes, frame_names = pd.factorize(df[animation_frame])
+
+    if len(frame_names) < 2:
+        # Plotly express adds no frames or animation controls for a single frame
+        return px.scatter(df, **scatter_kwargs)
+
+    template_fig = px.scatter(
+        df.iloc[[np.argmax(frame_codes == 0), np.argmax(frame_codes == 1)]], **scatter_kwargs
+        )
+    template_trace = template_fig.frames[0].data[0].to_plotly_json()
+    frame_label = f"{animation_frame}={frame_names[0]}<br>"
+
+    customdata_cols = [col for col in dict.fromkeys(hover_data) if col not in [x, y]]
+    # Rows without a frame (code -1) sort first, and are skipped by starting after them
+    order = np.argsort(frame_codes, kind="stable")
+    frame_ends = np.cumsum(np.bincount(frame_codes + 1, minlength=len(frame_names) + 1))
+    frame_starts, frame_ends = frame_ends[:-1], frame_ends[1:]
+
+    columns = {
+        'x': df[x].to_numpy()[order],
+        'y': df[y].to_numpy()[order],
+        'ids': df[animation_group].to_numpy()[order],
+        'text': df[text].to_numpy()[order],
+        'hovertext': df[hover_name].to_numpy()[order],
+        }
+    if customdata_cols:
+        customdata = df[customdata_cols]
+        # Plotly express hands timezone-aware datetimes to plotly as naive local times
+        customdata = customdata.assign(**{
+            col: customdata[col].dt.tz_localize(None)
+            for col in customdata_cols if isinstance(customdata[col].dtype, pd.DatetimeTZDtype)
+            }).to_numpy()
+        # Below this, single precision is accurate to within half of the last decimal place shown
+        if compact_frames and customdata.dtype.kind == "f" and \
+                np.nanmax(np.abs(customdata), initial=0) < 2**23 * 10.0**-hover_decimals:
+            customdata = customdata.astype(np.float32)
+        columns['customdata'] = customdata[order]
+
+    step_template = template_fig.layout.sliders[0].steps[0].to_plotly_json()
+    template_fig.layout.sliders[0].steps = [
+        dict(step_template, args=[[str(frame_name)], step_template['args'][1]], label=str(frame_name))
+        for frame_name in frame_names
+        ]
+
+    if frame_encoding == "delta":
+        template_fig.data[0].hovertemplate = template_trace['hovertemplate'].replace(frame_label, "", 1)
+        _fill_delta_frames(
+            template_fig,
+            {attr: values[frame_starts[0]:] for attr, values in columns.items()},
+            frame_codes[order[frame_starts[0]:]],
+            [str(frame_name) for frame_name in frame_names]
+            )
+        return template_fig
+
+    frames = []
+    for frame_name, start, end in zip(frame_names, frame_starts, frame_ends):
+        frame_name = str(frame_name)
+        trace = dict(template_trace, **{attr: values[start:end] for attr, values in columns.items()})
+        trace['hovertemplate'] = template_trace['hovertemplate'].replace(
+            frame_label, f"{animation_frame}={frame_name}<br>", 1
+            )
+        frames.append(dict(data=[trace], name=frame_name))
+
+    # Fill the template figure in place, so its layout keeps the order plotly express gives it
+    template_fig.data[0].update(frames[0]['data'][0])
+    template_fig.frames = frames
+
+    return template_fig
+
+# Entities are split between traces in blocks of this many, in order of first appearance
+_ENTITIES_PER_DELTA_TRACE = 8
+# Every this many frames, a delta encoded animation has a frame with all of its traces, so
+# plotly never has to merge more than this many frames to show one
+_DELTA_KEYFRAME_INTERVAL = 50
+
+def _fill_delta_frames(fig, columns, row_frames, frame_names):
+    """
+    Add frames to the figure that only carry the points that changed since the previous frame.
+
+    The entities are split between several copies of the figure's entity trace. Each block of
+    entities, taken in order of first appearance, is given the lowest numbered trace that is
+    not showing entities at any time from its first appearance to the last disappearance of its
+    entities. A frame lists only the traces whose points (position, icon, hover data or the
+    entities present) differ from the previous frame, and names the previous frame as its
+    `baseframe`. Plotly merges frames along the chain of base frames when showing one, so
+    every frame still shows every entity, including when jumping to it with the slider.
+
+    Parameters
+    ----------
+    fig : plotly.graph_objects.Figure
+        Figure with a single entity trace, which is copied for each trace the entities are
+        split between.
+    columns : dict
+        Arrays of the per-point trace attributes, with a row per entity per frame, in frame order.
+    row_frames : np.ndarray
+        The frame of each row, counting from 0.
+    frame_names : list of str
+        The name of each frame.
+    """
+    n_frames = len(frame_names)
+    entity_codes, _ = pd.factorize(columns['ids'])
+    n_entities = entity_codes.max() + 1
+
+    # Rows are in frame order, so each entity's first and last rows are in its first and last frames
+    first_frame = row_frames[np.unique(entity_codes, return_index=True)[1]]
+    last_frame = row_frames[len(entity_codes) - 1 - np.unique(entity_codes[::-1], return_index=True)[1]]
+
+    block_starts = np.arange(0, n_entities, _ENTITIES_PER_DELTA_TRACE)
+    block_traces = _kernels.lowest_free_slots(
+        np.zeros(len(block_starts)),
+        first_frame[block_starts],
+        np.maximum.reduceat(last_frame, block_starts) + 1
+        ) - 1
+    n_traces = block_traces.max() + 1
+
+    # Group the rows by frame and then trace, keeping their order within each group
+    group_codes = row_frames * n_traces + block_traces[entity_codes // _ENTITIES_PER_DELTA_TRACE]
+    order = np.argsort(group_codes, kind="stable")
+    group_codes = group_codes[order]
+    columns = {attr: values[order] for attr, values in columns.items()}
+    group_counts = np.bincount(group_codes, minlength=n_frames * n_traces)
+    group_ends = np.cumsum(group_counts)
+    group_starts = group_ends - group_counts
+
+    # Compare each row with the row in the same place in the group of the previous frame, where
+    # the groups have the same number of rows
+    point_columns = [
+        column for values in columns.values()
+        for column in (values.T if values.ndim > 1 else [values])
+        ]
+    point_codes = pd.DataFrame(dict(enumerate(point_columns))).groupby(
+        list(range(len(point_columns))), sort=False, dropna=False
+        ).ngroup().to_numpy()
+    same_count = np.zeros(n_frames * n_traces, dtype=bool)
+    same_count[n_traces:] = group_counts[n_traces:] == group_counts[:-n_traces]
+    compared = np.flatnonzero(same_count[group_codes])
+    compared_groups = group_codes[compared]
+    previous_rows = compared - group_starts[compared_groups] + group_starts[compared_groups - n_traces]
+    differing = np.bincount(
+        compared_groups,
+        weights=point_codes[compared] != point_codes[previous_rows],
+        minlength=n_frames * n_traces
+        )
+    changed = (~same_count | (differing > 0)).reshape(n_frames, n_traces)
+    changed[::_DELTA_KEYFRAME_INTERVAL] = True
+
+    entity_trace = fig.data[0].to_plotly_json()
+    first_frame_data = [
+        {attr: values[group_starts[trace]:group_ends[trace]] for attr, values in columns.items()}
+        for trace in range(n_traces)
+        ]
+    fig.data[0].update(first_frame_data[0])
+    fig.add_traces([dict(entity_trace, **trace_data) for trace_data in first_frame_data[1:]])
+
+    frames = []
+    for frame, frame_name in enumerate(frame_names):
+        traces = np.flatnonzero(changed[frame])
+        groups = frame * n_traces + traces
+        delta_frame = dict(
+            data=[
+                {attr: values[group_starts[group]:group_ends[group]] for attr, values in columns.items()}
+                for group in groups
+                ],
+            traces=traces.tolist(),
+            name=frame_name
+            )
+        if frame % _DELTA_KEYFRAME_INTERVAL:
+            delta_frame['baseframe'] = frame_names[frame - 1]
+        frames.append(delta_frame)
+
+    fig.frames = frames
+
 def generate_animation(
         full_entity_df_plus_pos,
         event_position_df,
@@ -39,7 +405,11 @@ def generate_animation(
         setup_mode=False,
         frame_duration=400, #milliseconds
         frame_transition_duration=600, #milliseconds
-        debug_mode=False
+        debug_mode=False,
+        resource_layout=None,
+        low_memory=False,
+        frame_encoding="full",
+        compact_frames=False
 ):
     """
     Generate an animated visualization of patient flow through a system.
@@ -51,7 +421,8 @@ def generate_animation(
     full_entity_df_plus_pos : pd.DataFrame
         DataFrame containing entity data with position information.
         This will be the output of passing an event log through the reshape_for_animations()
-        and generate_animation_df() functions
+        and generate_animation_df() functions. A polars DataFrame from the 'polars' backend
+        of those functions is converted to pandas here.
     event_position_df : pd.DataFrame
         DataFrame specifying the positions of different events.
     scenario : object, optional
@@ -136,6 +507,34 @@ def generate_animation(
         Duration of transition between frames in milliseconds (default is 600).
     debug_mode : bool, optional
         Whether to run in debug mode with additional output (default is False).
+    resource_layout : ResourceLayout, optional
+        The layout the resource markers are drawn from, which should be the one passed to
+        generate_animation_df(). If given, `scenario`, `wrap_resources_at`,
+        `gap_between_resources` and `gap_between_resource_rows` are taken from the layout.
+        Defaults to a layout built from `event_position_df`, `scenario` and those arguments,
+        if a scenario is given.
+    low_memory : bool, optional
+        If True, only the columns shown in the figure are taken from `full_entity_df_plus_pos`,
+        already in snapshot order, rather than copying the whole dataframe and then sorting the
+        copy (default is False). The figure is the same either way.
+    frame_encoding : str, optional
+        How the positions of the entities are stored in the animation frames (default is "full").
+        "full" gives every frame the position, icon and hover data of every entity shown.
+        "delta" splits the entities between several traces, and gives each frame only the
+        traces with an entity that has moved, changed icon, appeared or disappeared since the
+        previous frame, which makes the figure and its HTML much smaller when most entities
+        stay where they are between snapshots. Plotly fills in the rest of each frame from the
+        frames before it, so the animation plays and can be scrubbed as before, but the hover
+        text of each entity no longer includes the snapshot time, which is shown on the slider.
+    compact_frames : bool, optional
+        If True, store the frames in a compact form for smaller, faster loading exported HTML
+        (default is False). Entity positions are rounded to whole pixels, numeric event times
+        are rounded to the finest unit shown by `time_display_units` (e.g. whole minutes for
+        'dhm' when `simulation_time_unit` is minutes, or hundredths of a time unit when raw
+        simulation times or a custom format are shown), and numbers are stored in the smallest
+        types that hold them, which plotly writes as base64 encoded typed arrays. The snapshot_time
+        hover field, which repeats the snapshot time already shown as snapshot_time_display,
+        is left out of the hover text.
 
     Returns
     -------
@@ -152,10 +551,80 @@ def generate_animation(
       datetimes using the `simulation_time_unit` and optionally `start_date` and `start_time`.
     - If `start_date` and/or `start_time` are not provided, a default offset from today's date
       is used.
+    - If the snapshot times are already datetimes (because the event log's time column held
+      datetimes), they are displayed as they are, and `simulation_time_unit` and `start_time`
+      are not used. Simulation days are then counted from `start_date`, if given, or else from
+      the first snapshot.
     - The `snapshot_time` column is transformed to datetime strings, and a `snapshot_time_display`
       column is created for visual display.
     """
-    full_entity_df_plus_pos_copy = full_entity_df_plus_pos.copy()
+    if frame_encoding not in ("full", "delta"):
+        raise ValueError(f"Invalid frame_encoding '{frame_encoding}'. Valid options are: 'full', 'delta'.")
+
+    if resource_layout is None and scenario is not None:
+        resource_layout = ResourceLayout(
+            event_position_df,
+            scenario=scenario,
+            wrap_resources_at=wrap_resources_at,
+            gap_between_resources=gap_between_resources,
+            gap_between_resource_rows=gap_between_resource_rows,
+            event_col_name=event_col_name
+            )
+    show_resources = resource_layout is not None and resource_layout.resource_counts is not None
+
+    # We are effectively making use of an animated plotly express scatterplot
+    # to do all of the heavy lifting
+    # Because of the way plots animate in this, it deals with all of the difficulty
+    # of paths between individual positions - so we just have to tell it where to put
+    # people at each defined step of the process, and the scattergraph will move them
+    if show_resources:
+        if pathway_col_name is not None:
+            hovers = [entity_col_name, pathway_col_name, time_col_name, "snapshot_time", resource_col_name]
+        else:
+            hovers = [entity_col_name, time_col_name, "snapshot_time", resource_col_name]
+
+    else:
+        if pathway_col_name is not None:
+            hovers = [entity_col_name, pathway_col_name, time_col_name, "snapshot_time"]
+        else:
+            hovers = [entity_col_name, time_col_name, "snapshot_time"]
+
+    if frame_encoding == "delta":
+        # The snapshot time changes every frame, so would put every entity in every frame
+        hovers.remove("snapshot_time")
+    elif compact_frames:
+        # Every entity in a frame shares its snapshot time, which the hover text already shows
+        # as snapshot_time_display
+        hovers.remove("snapshot_time")
+
+    if low_memory:
+        # Take only the columns shown in the figure, in snapshot order, one column at a time,
+        # rather than copying and then sorting the whole dataframe
+        columns = list(dict.fromkeys(
+            ["snapshot_time", "x_final", "y_final", entity_col_name, "icon", event_col_name, *hovers]
+            ))
+        if not isinstance(full_entity_df_plus_pos, pd.DataFrame):
+            full_entity_df_plus_pos = full_entity_df_plus_pos.select(columns).to_pandas()
+        snapshot_order = np.argsort(full_entity_df_plus_pos["snapshot_time"].to_numpy(), kind="stable")
+        full_entity_df_plus_pos_copy = pd.DataFrame(index=full_entity_df_plus_pos.index.take(snapshot_order))
+        for col in columns:
+            full_entity_df_plus_pos_copy[col] = _decode_slim_column(
+                full_entity_df_plus_pos[col].take(snapshot_order)
+                ).array
+        del snapshot_order
+    else:
+        if isinstance(full_entity_df_plus_pos, pd.DataFrame):
+            full_entity_df_plus_pos_copy = full_entity_df_plus_pos.copy()
+        else:
+            # Output of the 'polars' backend; plotly express is given a pandas dataframe
+            full_entity_df_plus_pos_copy = full_entity_df_plus_pos.to_pandas()
+
+        # Decode any dictionary-encoded or downcast columns from slim mode back to their labels
+        # and full-width types before doing any time arithmetic
+        for col, values in full_entity_df_plus_pos_copy.items():
+            decoded = _decode_slim_column(values)
+            if decoded is not values:
+                full_entity_df_plus_pos_copy[col] = decoded
 
     if override_x_max is not None:
         x_max = override_x_max
@@ -174,166 +643,42 @@ def generate_animation(
     # important for sorting
     full_entity_df_plus_pos_copy["snapshot_time_base"] = full_entity_df_plus_pos_copy["snapshot_time"]
 
-    # Assuming time display units are set to something other
-
-    if time_display_units is not None:
-
-        if simulation_time_unit in ("second", "seconds"):
-            unit = "s"
-        elif simulation_time_unit in ("minute", "minutes"):
-            unit = "m"
-        elif simulation_time_unit in ("hour", "hours"):
-            unit = "h"
-        elif simulation_time_unit in ("day", "days"):
-            unit = "d"
-        elif simulation_time_unit in ("week", "weeks"):
-            unit = "w"
-        elif simulation_time_unit in ("month", "months"):
-            # Approximate 1 month as 30 days
-            full_entity_df_plus_pos_copy["snapshot_time"] *= 30
-            unit = "d"
-        elif simulation_time_unit in ("year", "years"):
-            # Approximate 1 year as 365 days
-            full_entity_df_plus_pos_copy["snapshot_time"] *= 365
-            unit = "d"
-
-        if start_date is None and start_time is None:
-            full_entity_df_plus_pos_copy["snapshot_time"] = (
-                dt.date.today() +
-                pd.DateOffset(days=165) +
-                pd.TimedeltaIndex(full_entity_df_plus_pos_copy["snapshot_time"], unit=unit)
-                )
-
-        elif start_date is not None and start_time is None:
-
-            full_entity_df_plus_pos_copy["snapshot_time"] = (
-                dt.datetime.strptime(start_date, "%Y-%m-%d") +
-                pd.TimedeltaIndex(full_entity_df_plus_pos_copy["snapshot_time"], unit=unit)
-                )
-
-        else:
-            start_time_dt = dt.datetime.strptime(start_time, "%H:%M:%S")
-
-            start_time_time_delta = dt.timedelta(
-                    hours=start_time_dt.hour,
-                    minutes=start_time_dt.minute,
-                    seconds=start_time_dt.second
-                )
-
-            if start_date is None:
-                full_entity_df_plus_pos_copy["snapshot_time"] = (
-                    dt.date.today() +
-                    pd.DateOffset(days=165) +
-                    start_time_time_delta +
-                    pd.TimedeltaIndex(full_entity_df_plus_pos_copy["snapshot_time"], unit=unit)
-                    )
-
-            else:
-                full_entity_df_plus_pos_copy["snapshot_time"] = (
-                    dt.datetime.strptime(start_date, "%Y-%m-%d") +
-                    start_time_time_delta +
-                    pd.TimedeltaIndex(full_entity_df_plus_pos_copy["snapshot_time"], unit=unit)
-                    )
-
-        # https://strftime.org/
-        if time_display_units in ("dhms", "dhms_ampm"):
-            fmt = '%d %B %Y\n%I:%M:%S %p' if time_display_units.endswith("ampm") else '%d %B %Y\n%H:%M:%S'
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, fmt)
-            )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, fmt)
+    full_entity_df_plus_pos_copy["snapshot_time"], full_entity_df_plus_pos_copy["snapshot_time_display"] = (
+        _format_snapshot_times(
+            full_entity_df_plus_pos_copy["snapshot_time"],
+            simulation_time_unit=simulation_time_unit,
+            time_display_units=time_display_units,
+            start_date=start_date,
+            start_time=start_time
             )
+        )
 
-        elif time_display_units in ("dhm", "dhm_ampm"):
-            fmt = '%d %B %Y\n%I:%M %p' if time_display_units.endswith("ampm") else '%d %B %Y\n%H:%M'
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, fmt)
-            )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, fmt)
+    if not low_memory:
+        full_entity_df_plus_pos_copy = full_entity_df_plus_pos_copy.sort_values(
+            "snapshot_time_base", kind="stable"
             )
 
-        elif time_display_units in ("dh", "dh_ampm"):
-            fmt = '%d %B %Y\n%I %p' if time_display_units.endswith("ampm") else '%d %B %Y\n%H'
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, fmt)
-            )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, fmt)
-            )
+    # Numeric hover data is shown to hundredths, unless the event times are rounded below
+    hover_decimals = 2
 
-        elif time_display_units in ("d"):
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, '%A %d %B %Y')
-                )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, '%Y-%m-%d')
+    if compact_frames:
+        # Place entities on whole pixels, which plotly stores as the smallest integer type
+        # that holds them
+        for col in ["x_final", "y_final"]:
+            rounded = full_entity_df_plus_pos_copy[col].round()
+            full_entity_df_plus_pos_copy[col] = (
+                rounded.astype(np.float32) if rounded.isna().any() else rounded.astype(np.int64)
                 )
 
-        elif time_display_units in ("m"):
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, '%B %Y')
-                )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, '%B %Y')
+        if pd.api.types.is_numeric_dtype(full_entity_df_plus_pos_copy[time_col_name]):
+            hover_decimals = _time_display_decimals(simulation_time_unit, time_display_units)
+            full_entity_df_plus_pos_copy[time_col_name] = (
+                full_entity_df_plus_pos_copy[time_col_name].round(hover_decimals)
                 )
+            hovers = {col: f":.{hover_decimals}~f" if col == time_col_name else True for col in hovers}
 
-        elif time_display_units in ("y"):
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, '%Y')
-                )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: dt.datetime.strftime(x, '%Y')
-                )
-        elif time_display_units in ("day_clock", "simulation_day_clock", "day_clock_ampm", "simulation_day_clock_ampm"):
-            use_ampm = time_display_units.endswith("_ampm")
-            def format_day_clock(t):
-                delta = t - pd.Timestamp(t.date())
-                sim_day = (t.normalize() - full_entity_df_plus_pos_copy["snapshot_time"].min().normalize()).days + 1
-                time_fmt = "%I:%M %p" if use_ampm else "%H:%M"
-                return f"Simulation Day {sim_day}\n{t.strftime(time_fmt)}"
-
-            full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: format_day_clock(pd.to_datetime(x))
-            )
-            full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                lambda x: format_day_clock(pd.to_datetime(x))
-            )
-        else:
-            try:
-                full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                    lambda x: dt.datetime.strftime(x, time_display_units)
-                    )
-                full_entity_df_plus_pos_copy["snapshot_time"] = full_entity_df_plus_pos_copy["snapshot_time"].apply(
-                    lambda x: dt.datetime.strftime(x, time_display_units)
-                    )
-            except:
-                raise "Invalid time_display_units option provided. Valid options are: dhms, dhm, dh, d, m, y. Alternatively, you can provide your own valid strftime format (e.g. '%Y-%m-%d %H'). See the strftime documentation for more details: https://strftime.org/"
-
-
-    else:
-        full_entity_df_plus_pos_copy["snapshot_time_display"] = full_entity_df_plus_pos_copy["snapshot_time"]
-
-    # We are effectively making use of an animated plotly express scatterplot
-    # to do all of the heavy lifting
-    # Because of the way plots animate in this, it deals with all of the difficulty
-    # of paths between individual positions - so we just have to tell it where to put
-    # people at each defined step of the process, and the scattergraph will move them
-    if scenario is not None:
-        if pathway_col_name is not None:
-            hovers = [entity_col_name, pathway_col_name, time_col_name, "snapshot_time", resource_col_name]
-        else:
-            hovers = [entity_col_name, time_col_name, "snapshot_time", resource_col_name]
-
-    else:
-        if pathway_col_name is not None:
-            hovers = [entity_col_name, pathway_col_name, time_col_name, "snapshot_time"]
-        else:
-            hovers = [entity_col_name, time_col_name, "snapshot_time"]
-
-    fig = px.scatter(
-            full_entity_df_plus_pos_copy.sort_values("snapshot_time_base"),
+    fig = _animated_scatter(
+            full_entity_df_plus_pos_copy,
             x="x_final",
             y="y_final",
             # Each frame is one step of time, with the gap being determined
@@ -344,6 +689,9 @@ def generate_animation(
             text="icon",
             hover_name=event_col_name,
             hover_data=hovers,
+            frame_encoding=frame_encoding,
+            compact_frames=compact_frames,
+            hover_decimals=hover_decimals,
             range_x=[0, x_max],
             range_y=[0, y_max],
             height=plotly_height,
@@ -352,7 +700,6 @@ def generate_animation(
             opacity=0
             )
 
-
     # Update the size of the icons and labels
     # This is what determines the size of the individual emojis that
     # represent our people!
@@ -389,34 +736,8 @@ def generate_animation(
     # Make an additional dataframe that has one row per resource type
     # Then, starting from the initial position, make that many large circles
     # make them semi-transparent or you won't see the people using them!
-    if scenario is not None:
-        events_with_resources = event_position_df[event_position_df['resource'].notnull()].copy()
-        events_with_resources['resource_count'] = events_with_resources['resource'].apply(lambda x: getattr(scenario, x))
-
-        events_with_resources = events_with_resources.join(events_with_resources.apply(
-            lambda r: pd.Series({'x_final': [r['x']-(gap_between_resources*(i+1))
-                                             for i in range(r['resource_count'])]}), axis=1).explode('x_final'),
-            how='right')
-
-        # events_with_resources = events_with_resources.assign(resource_id=range(len(events_with_resources)))
-        # After exploding
-        events_with_resources[resource_col_name] = events_with_resources.groupby([event_col_name]).cumcount()
-
-        if wrap_resources_at is not None:
-            events_with_resources['row'] = np.floor((events_with_resources[resource_col_name]) / (wrap_resources_at))
-
-            events_with_resources['x_final'] = (
-                events_with_resources['x_final']
-                + (wrap_resources_at * events_with_resources['row'] * gap_between_resources)
-                + gap_between_resources
-                )
-
-            events_with_resources['y_final'] = (
-                events_with_resources['y']
-                + (events_with_resources['row'] * gap_between_resource_rows)
-                )
-        else:
-            events_with_resources['y_final'] = events_with_resources['y']
+    if show_resources:
+        events_with_resources = resource_layout.markers(resource_col_name=resource_col_name)
 
         # This just adds an additional scatter trace that creates large dots
         # that represent the individual resources
@@ -525,6 +846,275 @@ def generate_animation(
 
     return fig
 
+# Rough ratio of the peak memory used while positioning a window of snapshots and turning it
+# into frames to the memory used by the reshaped snapshots themselves
+_PAGED_MEMORY_FACTOR = 10
+
+# Number of snapshots reshaped at a time while filling each window
+_PAGED_SNAPSHOTS_PER_BATCH = 10
+
+_MEMORY_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+def _parse_memory_size(max_memory):
+    """
+    Convert a memory size given in bytes or as a string such as "512MB" or "2 GB" to bytes.
+    """
+    if isinstance(max_memory, str):
+        size = max_memory.strip().upper().replace(" ", "")
+        for unit in sorted(_MEMORY_UNITS, key=len, reverse=True):
+            if size.endswith(unit):
+                try:
+                    return int(float(size[:-len(unit)]) * _MEMORY_UNITS[unit])
+                except ValueError:
+                    break
+        raise ValueError(
+            f"Invalid max_memory '{max_memory}'. Provide a number of bytes or a string such as '2GB'."
+            )
+
+    if max_memory <= 0:
+        raise ValueError("max_memory must be positive.")
+
+    return int(max_memory)
+
+def _frame_boundaries(snapshot_times, animation_kwargs):
+    """
+    Find the snapshot times that a window of snapshots can end at without splitting an
+    animation frame across windows, along with the number of frames up to and including each.
+    Several snapshots share a frame when they share a display label (e.g. when only the date
+    is shown).
+    """
+    _, frame_labels = _format_snapshot_times(
+        pd.Series(snapshot_times),
+        simulation_time_unit=animation_kwargs["simulation_time_unit"],
+        time_display_units=animation_kwargs["time_display_units"],
+        start_date=animation_kwargs["start_date"],
+        start_time=animation_kwargs["start_time"]
+        )
+
+    # Frames are numbered in order of first appearance
+    frame_codes = pd.factorize(frame_labels)[0]
+    positions = np.arange(len(frame_codes))
+    last_position = pd.Series(positions).groupby(frame_codes).transform("max").to_numpy()
+
+    # A window can end at a snapshot if no frame seen so far appears again after it
+    can_end = np.maximum.accumulate(last_position) == positions
+
+    return snapshot_times[can_end], (np.maximum.accumulate(frame_codes) + 1)[can_end]
+
+def _iter_snapshot_windows(event_log, memory_budget, boundary_times, boundary_frames, reshape_kwargs):
+    """
+    Yield consecutive windows of reshaped snapshots, each estimated to need no more than
+    `memory_budget` bytes once positioned and turned into frames where possible.
+    Windows only end at the snapshot times in `boundary_times`, and each window holds at least
+    two frames so that it can be animated on its own, unless the whole animation has fewer.
+    """
+    def estimated_memory(df):
+        return df.memory_usage(deep=True).sum() * _PAGED_MEMORY_FACTOR
+
+    buffer = []
+    buffer_memory = 0
+    frames_before = 0
+    pending_window = None
+
+    for batch in iter_snapshots(
+            event_log, snapshots_per_batch=_PAGED_SNAPSHOTS_PER_BATCH, **reshape_kwargs
+            ):
+        buffer.append(batch)
+        buffer_memory += estimated_memory(batch)
+
+        if buffer_memory <= memory_budget:
+            continue
+
+        # Find the latest point the buffered snapshots can be cut at
+        last_boundary = np.searchsorted(
+            boundary_times, batch["snapshot_time"].to_numpy()[-1], side="right"
+            ) - 1
+        if last_boundary < 0 or boundary_frames[last_boundary] - frames_before < 2:
+            continue
+
+        buffered_df = pd.concat(buffer, ignore_index=True)
+        in_window = buffered_df["snapshot_time"] <= boundary_times[last_boundary]
+
+        if pending_window is not None:
+            yield pending_window
+        pending_window = buffered_df[in_window].reset_index(drop=True)
+        frames_before = boundary_frames[last_boundary]
+
+        remainder = buffered_df[~in_window].reset_index(drop=True)
+        buffer = [remainder] if len(remainder) > 0 else []
+        buffer_memory = estimated_memory(remainder)
+
+    if len(buffer) > 0:
+        remainder = pd.concat(buffer, ignore_index=True)
+        # The last window is only held back so that a final single frame can be added to it
+        if pending_window is not None and boundary_frames[-1] - frames_before < 2:
+            pending_window = pd.concat([pending_window, remainder], ignore_index=True)
+        else:
+            if pending_window is not None:
+                yield pending_window
+            pending_window = remainder
+
+    if pending_window is not None:
+        yield pending_window
+
+def _scan_snapshots(event_log, reshape_kwargs):
+    """
+    Find every entity shown and every snapshot time of the animation, one batch of snapshots
+    at a time, without keeping the snapshots themselves.
+    """
+    entity_col_name = reshape_kwargs["entity_col_name"]
+
+    entity_ids = []
+    snapshot_times = []
+    for batch in iter_snapshots(
+            event_log, snapshots_per_batch=_PAGED_SNAPSHOTS_PER_BATCH, **reshape_kwargs
+            ):
+        entity_ids.append(batch[entity_col_name].drop_duplicates())
+        snapshot_times.append(batch["snapshot_time"].unique())
+
+    return (
+        pd.concat(entity_ids, ignore_index=True).drop_duplicates(),
+        np.unique(np.concatenate(snapshot_times))
+        )
+
+def _iter_window_figures(event_log, memory_budget, entity_ids, snapshot_times,
+                         reshape_kwargs, animation_df_kwargs, animation_kwargs):
+    """
+    Yield the figure for each window of snapshots in turn, each holding the frames of its window.
+    """
+    debug_mode = reshape_kwargs["debug_mode"]
+
+    # Icons are assigned across every entity shown, and windows must not split frames,
+    # so all entities and snapshot times are found before positioning any window
+    boundary_times, boundary_frames = _frame_boundaries(snapshot_times, animation_kwargs)
+
+    for window_df in _iter_snapshot_windows(
+            event_log, memory_budget, boundary_times, boundary_frames, reshape_kwargs
+            ):
+        window_df_plus_pos = generate_animation_df(
+            full_entity_df=window_df, entity_ids=entity_ids, **animation_df_kwargs
+            )
+        del window_df
+
+        window_fig = generate_animation(full_entity_df_plus_pos=window_df_plus_pos, **animation_kwargs)
+        del window_df_plus_pos
+
+        yield window_fig
+
+        if debug_mode:
+            print(f'Frames for window complete at {time.strftime("%H:%M:%S", time.localtime())}')
+
+def _animate_activity_log_paged(event_log, max_memory, reshape_kwargs, animation_df_kwargs, animation_kwargs):
+    """
+    Build the animation one window of snapshots at a time, adding the frames of each window
+    to the figure built for the first window.
+    """
+    memory_budget = _parse_memory_size(max_memory)
+    entity_ids, snapshot_times = _scan_snapshots(event_log, reshape_kwargs)
+
+    fig = None
+    frames = []
+    slider_steps = []
+
+    for window_fig in _iter_window_figures(
+            event_log, memory_budget, entity_ids, snapshot_times,
+            reshape_kwargs, animation_df_kwargs, animation_kwargs
+            ):
+        if fig is None:
+            fig = window_fig
+
+        frames.extend(window_fig.frames)
+        if window_fig.layout.sliders:
+            slider_steps.extend(window_fig.layout.sliders[0].steps)
+
+    fig.frames = frames
+    if fig.layout.sliders:
+        fig.layout.sliders[0].steps = slider_steps
+
+    return fig
+
+# Frame name standing in for the frames in the HTML written around them
+_HTML_FRAMES_PLACEHOLDER = "__vidigi_frames__"
+
+def _write_animation_html_paged(html_file, event_log, max_memory, reshape_kwargs, animation_df_kwargs,
+                                animation_kwargs, html_options):
+    """
+    Write the animation to an HTML file one window of snapshots at a time, so that only the
+    frames of one window are ever held in memory.
+
+    The HTML around the frames is written from the figure of the first window, with a slider
+    step for every frame of the animation and a placeholder in place of the frames, which is
+    then filled in with the frames of each window as they are built. Plotly writes the frames
+    as a compact JSON list, so the file is the same as writing the whole figure at once.
+    """
+    memory_budget = _parse_memory_size(max_memory)
+    entity_ids, snapshot_times = _scan_snapshots(event_log, reshape_kwargs)
+
+    # Frames are named after their display labels, in order of first appearance
+    _, frame_labels = _format_snapshot_times(
+        pd.Series(snapshot_times),
+        simulation_time_unit=animation_kwargs["simulation_time_unit"],
+        time_display_units=animation_kwargs["time_display_units"],
+        start_date=animation_kwargs["start_date"],
+        start_time=animation_kwargs["start_time"]
+        )
+    frame_names = [str(frame_label) for frame_label in pd.unique(frame_labels)]
+
+    window_figs = _iter_window_figures(
+        event_log, memory_budget, entity_ids, snapshot_times,
+        reshape_kwargs, animation_df_kwargs, animation_kwargs
+        )
+    fig = next(window_figs)
+
+    if isinstance(html_file, (str, Path)):
+        file = open(html_file, "w", encoding="utf-8")
+    else:
+        file = html_file
+
+    try:
+        if not fig.frames:
+            # A single frame is shown without any animation frames
+            file.write(pio.to_html(fig, **html_options))
+        else:
+            _write_frames_html(file, fig, window_figs, frame_names, html_options)
+    finally:
+        if file is not html_file:
+            file.close()
+
+    if (isinstance(html_file, (str, Path)) and html_options.get("full_html", True)
+            and html_options.get("include_plotlyjs", True) == "directory"):
+        bundle_path = Path(html_file).parent / "plotly.min.js"
+        if not bundle_path.exists():
+            bundle_path.write_text(get_plotlyjs(), encoding="utf-8")
+
+def _write_frames_html(file, fig, window_figs, frame_names, html_options):
+    """
+    Write the HTML of the figure of the first window with the frames of every window in it.
+    """
+    window_frames = to_json_plotly(fig.to_dict()["frames"])
+
+    step = fig.layout.sliders[0].steps[0].to_plotly_json()
+    fig.layout.sliders[0].steps = [
+        dict(step, args=[[frame_name], step['args'][1]], label=frame_name) for frame_name in frame_names
+        ]
+    fig.frames = [dict(name=_HTML_FRAMES_PLACEHOLDER)]
+    html_before_frames, html_after_frames = pio.to_html(fig, **html_options).split(
+        to_json_plotly([dict(name=_HTML_FRAMES_PLACEHOLDER)]), 1
+        )
+    del fig
+
+    file.write(html_before_frames)
+    file.write(window_frames[:-1])
+
+    for window_fig in window_figs:
+        window_frames = to_json_plotly(window_fig.to_dict()["frames"])
+        del window_fig
+        file.write(",")
+        file.write(window_frames[1:-1])
+
+    file.write("]")
+    file.write(html_after_frames)
+
 def animate_activity_log(
         event_log,
         event_position_df,
@@ -540,7 +1130,13 @@ def animate_activity_log(
         wrap_queues_at=20,
         wrap_resources_at=20,
         step_snapshot_max=50,
+        cap_resource_use=False,
+        skip_unchanged_snapshots=False,
+        max_snapshot_gap=None,
+        slim=False,
         limit_duration=10*60*24,
+        window_start=None,
+        window_end=None,
         plotly_height=900,
         plotly_width=None,
         include_play_button=True,
@@ -565,7 +1161,16 @@ def animate_activity_log(
         frame_transition_duration=600, #milliseconds
         debug_mode=False,
         custom_entity_icon_list=None,
-        debug_write_intermediate_objects=False
+        debug_write_intermediate_objects=False,
+        max_memory=None,
+        backend="pandas",
+        resource_layout=None,
+        low_memory=False,
+        infer_resource_ids=False,
+        frame_encoding="full",
+        compact_frames=False,
+        html_file=None,
+        html_options=None
         ):
     """
     Generate an animated visualization of patient flow through a system.
@@ -583,7 +1188,9 @@ def animate_activity_log(
         An object containing attributes for resource counts at different steps.
         time_col_name : str, default="time"
         Name of the column in `event_log` that contains the timestamp of each event.
-        Timestamps should represent the number of time units since the simulation began.
+        Timestamps should represent the number of time units since the simulation began, or be
+        datetime64 values, e.g. real timestamps from historical data. In that case the snapshot
+        grid is built directly from the datetimes, with no conversion to time units needed.
     entity_col_name : str, default="entity_id"
         Name of the column in `event_log` that contains the unique identifier for each entity
         (e.g., "entity_id",  "entity", "patient", "patient_id", "customer", "ID").
@@ -603,15 +1210,43 @@ def animate_activity_log(
         Time unit used within the simulation (default is minutes).
         Possible values are 'seconds', 'minutes', 'hours', 'days', 'weeks', 'years'
     every_x_time_units : int, optional
-        Time interval between animation frames in minutes (default is 10).
+        Time interval between animation frames in minutes (default is 10). If the time column
+        holds datetimes, this must be a timedelta, e.g. pd.Timedelta(minutes=10) or "10min".
     wrap_queues_at : int, optional
         Maximum number of entities to display in a queue before wrapping to a new row (default is 20).
     wrap_resources_at : int, optional
         Number of resources to show before wrapping to a new row (default is 20).
     step_snapshot_max : int, optional
         Maximum number of patients to show in each snapshot per event (default is 50).
+    cap_resource_use : bool, optional
+        If True, step_snapshot_max is also applied to resource use steps, rather than showing
+        every entity using a resource (default is False).
+    skip_unchanged_snapshots : bool, optional
+        If True, only produce frames when the state of the system changes, skipping idle
+        periods (default is False). every_x_time_units then acts as the minimum time between
+        frames. The time shown on each frame remains correct.
+    max_snapshot_gap : int, optional
+        When skip_unchanged_snapshots is True, the maximum time between frames during idle
+        periods (default is None, meaning no limit). A timedelta if the time column holds
+        datetimes.
+    slim : bool, optional
+        If True, only keep the columns needed for the animation and store them in compact,
+        dictionary-encoded types while preparing it, to reduce memory use on large event logs
+        (default is False). The figure produced is unchanged.
     limit_duration : int, optional
-        Maximum duration to animate in minutes (default is 10 days or 14400 minutes).
+        Maximum duration to animate in minutes (default is 10 days or 14400 minutes). If the time
+        column holds datetimes, this must be a timedelta measured from the first frame, or the
+        datetime of the last frame.
+    window_start : float, optional
+        If given, only animate the part of the simulation from this time onwards (default is
+        None, meaning the animation starts at time 0). Only the events of entities present
+        during the window are processed, so a short window of a long simulation is quick to
+        render. The clock shown is unchanged. Not to be confused with start_time, which sets
+        the clock time the simulation starts at. A datetime if the time column holds datetimes.
+    window_end : float, optional
+        If given, only animate the part of the simulation up to this time (default is None,
+        meaning the animation continues to limit_duration). A datetime if the time column holds
+        datetimes.
     plotly_height : int, optional
         Height of the Plotly figure in pixels (default is 900).
     plotly_width : int, optional
@@ -672,11 +1307,60 @@ def animate_activity_log(
         If True, print debug information during processing (default is False).
     custom_entity_icon_list: list, optional
         If given, overrides the default list of emojis used to represent entities
+    max_memory : int or str, optional
+        Approximate memory budget for preparing the animation, either in bytes or as a string
+        such as "500MB" or "2GB" (default is None, meaning the whole animation is prepared at
+        once). If given, the snapshots are reshaped, positioned and turned into animation frames
+        one time window at a time, with each window sized to fit within the budget, and the
+        frames are then joined into a single figure. The figure is identical to the one produced
+        without a budget. Cannot be combined with skip_unchanged_snapshots, window_start or
+        window_end.
+        The budget does not cover the finished figure itself, which holds every frame, unless
+        the animation is written straight to `html_file`.
+    backend : str, optional
+        The dataframe library used to reshape and position the snapshots (default is "pandas").
+        "polars" does this with polars, which is faster on large event logs, converting to pandas
+        only when building the figure. Requires the optional dependency polars
+        (`pip install vidigi[polars]`), and cannot be combined with skip_unchanged_snapshots or
+        slim. With max_memory, only the positioning of each window uses polars.
+    resource_layout : ResourceLayout, optional
+        The layout of the resource slots, used both to place entities using resources and to
+        draw the resource markers. Build one with ResourceLayout() and pass it to each call to
+        reuse it across renders of the same model. If given, `scenario`, `wrap_resources_at`,
+        `gap_between_resources` and `gap_between_resource_rows` are taken from the layout.
+        Defaults to a layout built once from `event_position_df`, `scenario` and those arguments.
+    low_memory : bool, optional
+        If True, build the figure in the low memory mode of generate_animation(), which takes
+        only the columns shown in the figure rather than copying the whole positioned dataframe
+        (default is False). The figure is the same either way.
+    infer_resource_ids : bool, optional
+        If True, the resource ID of each resource use step is worked out with
+        assign_resource_ids(), for event logs from models (such as those using a plain
+        simpy.Resource) that cannot record which resource each entity is using. Any resource
+        IDs already in the event log are replaced (default is False).
+    frame_encoding : str, optional
+        How the positions of the entities are stored in the animation frames; see
+        generate_animation() (default is "full"). "delta" only stores the entities that changed
+        between frames, and cannot be combined with max_memory.
+    compact_frames : bool, optional
+        If True, store the frames in the compact form of generate_animation(), with positions
+        rounded to whole pixels, event times rounded to the finest unit shown by
+        time_display_units and numbers stored as small typed arrays, for smaller exported HTML
+        (default is False).
+    html_file : str, pathlib.Path or file-like, optional
+        If given, the animation is written to this HTML file instead of being returned
+        (default is None). With max_memory, the file is written one window of snapshots at a
+        time as the frames are built, so the whole figure never has to be held in memory.
+        The file is the same as calling write_html() on the figure returned without html_file.
+    html_options : dict, optional
+        Keyword arguments for plotly's write_html(), such as include_plotlyjs, full_html,
+        auto_play or div_id, used when writing to `html_file` (default is None).
 
     Returns
     -------
-    plotly.graph_objs._figure.Figure
-        An animated Plotly figure object representing the patient flow.
+    plotly.graph_objs._figure.Figure or None
+        An animated Plotly figure object representing the patient flow, or None if the
+        animation was written to `html_file`.
 
     Notes
     -----
@@ -690,8 +1374,28 @@ def animate_activity_log(
         start_time_function = time.perf_counter()
         print(f'Animation function called at {time.strftime("%H:%M:%S", time.localtime())}')
 
-    full_entity_df = reshape_for_animations(
-        event_log,
+    if infer_resource_ids:
+        event_log = assign_resource_ids(
+            event_log,
+            entity_col_name=entity_col_name,
+            event_type_col_name=event_type_col_name,
+            event_col_name=event_col_name,
+            time_col_name=time_col_name,
+            resource_col_name=resource_col_name
+            )
+
+    # Entities and resource markers are placed from the same layout, built once
+    if resource_layout is None:
+        resource_layout = ResourceLayout(
+            event_position_df,
+            scenario=scenario,
+            wrap_resources_at=wrap_resources_at,
+            gap_between_resources=gap_between_resources,
+            gap_between_resource_rows=gap_between_resource_rows,
+            event_col_name=event_col_name
+            )
+
+    reshape_kwargs = dict(
         every_x_time_units=every_x_time_units,
         limit_duration=limit_duration,
         step_snapshot_max=step_snapshot_max,
@@ -700,39 +1404,32 @@ def animate_activity_log(
         entity_col_name=entity_col_name,
         event_type_col_name=event_type_col_name,
         event_col_name=event_col_name,
-        pathway_col_name=pathway_col_name
+        pathway_col_name=pathway_col_name,
+        cap_resource_use=cap_resource_use
         )
 
-    if debug_write_intermediate_objects:
-        full_entity_df.to_csv("output_reshape_for_animations.csv")
-
-    if debug_mode:
-        print(f'Reshaped animation dataframe finished construction at {time.strftime("%H:%M:%S", time.localtime())}')
-
-    full_entity_df_plus_pos = generate_animation_df(
-                                full_entity_df=full_entity_df,
-                                event_position_df=event_position_df,
-                                wrap_queues_at=wrap_queues_at,
-                                wrap_resources_at=wrap_resources_at,
-                                step_snapshot_max=step_snapshot_max,
-                                gap_between_entities=gap_between_entities,
-                                gap_between_resources=gap_between_resources,
-                                gap_between_resource_rows=gap_between_resource_rows,
-                                gap_between_queue_rows=gap_between_queue_rows,
-                                debug_mode=debug_mode,
-                                custom_entity_icon_list=custom_entity_icon_list,
-                                time_col_name=time_col_name,
-                                entity_col_name=entity_col_name,
-                                event_type_col_name=event_type_col_name,
-                                event_col_name=event_col_name,
-                                resource_col_name=resource_col_name
-                                )
-
-    if debug_write_intermediate_objects:
-        full_entity_df_plus_pos.to_csv("output_generate_animation_df.csv")
+    animation_df_kwargs = dict(
+        event_position_df=event_position_df,
+        wrap_queues_at=wrap_queues_at,
+        wrap_resources_at=wrap_resources_at,
+        step_snapshot_max=step_snapshot_max,
+        gap_between_entities=gap_between_entities,
+        gap_between_resources=gap_between_resources,
+        gap_between_resource_rows=gap_between_resource_rows,
+        gap_between_queue_rows=gap_between_queue_rows,
+        debug_mode=debug_mode,
+        custom_entity_icon_list=custom_entity_icon_list,
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_type_col_name=event_type_col_name,
+        event_col_name=event_col_name,
+        resource_col_name=resource_col_name,
+        slim=slim,
+        backend=backend,
+        resource_layout=resource_layout
+        )
 
-    animation = generate_animation(
-        full_entity_df_plus_pos=full_entity_df_plus_pos,
+    animation_kwargs = dict(
         event_position_df=event_position_df,
         scenario=scenario,
         simulation_time_unit=simulation_time_unit,
@@ -762,8 +1459,89 @@ def animate_activity_log(
         entity_col_name=entity_col_name,
         event_col_name=event_col_name,
         pathway_col_name=pathway_col_name,
-        resource_col_name=resource_col_name
-    )
+        resource_col_name=resource_col_name,
+        resource_layout=resource_layout,
+        low_memory=low_memory,
+        frame_encoding=frame_encoding,
+        compact_frames=compact_frames
+        )
+
+    if max_memory is not None:
+        if skip_unchanged_snapshots:
+            raise ValueError("skip_unchanged_snapshots cannot be used with max_memory.")
+
+        if window_start is not None or window_end is not None:
+            raise ValueError("window_start and window_end cannot be used with max_memory.")
+
+        if frame_encoding == "delta":
+            raise ValueError("frame_encoding='delta' cannot be used with max_memory.")
+
+        if html_file is not None:
+            _write_animation_html_paged(
+                html_file,
+                event_log,
+                max_memory=max_memory,
+                reshape_kwargs=reshape_kwargs,
+                animation_df_kwargs=animation_df_kwargs,
+                animation_kwargs=animation_kwargs,
+                html_options=html_options or {}
+                )
+            animation = None
+        else:
+            animation = _animate_activity_log_paged(
+                event_log,
+                max_memory=max_memory,
+                reshape_kwargs=reshape_kwargs,
+                animation_df_kwargs=animation_df_kwargs,
+                animation_kwargs=animation_kwargs
+                )
+
+    else:
+        full_entity_df = reshape_for_animations(
+            event_log,
+            skip_unchanged_snapshots=skip_unchanged_snapshots,
+            max_snapshot_gap=max_snapshot_gap,
+            resource_col_name=resource_col_name,
+            slim=slim,
+            window_start=window_start,
+            window_end=window_end,
+            backend=backend,
+            **reshape_kwargs
+            )
+
+        if len(full_entity_df) == 0:
+            raise ValueError(
+                "No snapshots fall between window_start and window_end, so there is nothing to animate."
+                )
+
+        if debug_write_intermediate_objects:
+            (full_entity_df.to_pandas() if backend == "polars" else full_entity_df).to_csv(
+                "output_reshape_for_animations.csv"
+                )
+
+        if debug_mode:
+            print(f'Reshaped animation dataframe finished construction at {time.strftime("%H:%M:%S", time.localtime())}')
+
+        full_entity_df_plus_pos = generate_animation_df(
+            full_entity_df=full_entity_df,
+            **animation_df_kwargs
+            )
+        # The reshaped snapshots are not needed once the entities have been positioned
+        del full_entity_df
+
+        if debug_write_intermediate_objects:
+            (full_entity_df_plus_pos.to_pandas() if backend == "polars" else full_entity_df_plus_pos).to_csv(
+                "output_generate_animation_df.csv"
+                )
+
+        animation = generate_animation(
+            full_entity_df_plus_pos=full_entity_df_plus_pos,
+            **animation_kwargs
+            )
+
+        if html_file is not None:
+            animation.write_html(html_file, **(html_options or {}))
+            animation = None
 
     if debug_mode:
         end_time_function = time.perf_counter()
@@ -966,6 +1744,12 @@ def add_repeating_overlay(
             rect_data = go.Scatter(x=[], y=[], xaxis='x2', yaxis='y2')
             text_data = go.Scatter(x=[], y=[], mode='text', xaxis='x2', yaxis='y2')
 
+        if frame.traces is not None:
+            # Frames that only update some traces (such as delta encoded frames) name them
+            frame.data = list(frame.data) + [rect_data, text_data]
+            frame.traces = list(frame.traces) + [rect_trace_idx, text_trace_idx]
+            continue
+
         # Extend frame data to include overlay traces
         frame_data = list(frame.data) if frame.data else []
 
@@ -1,7 +1,1283 @@
+import datetime as dt
 import gc
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
+from vidigi import _kernels
+
+def _import_polars():
+    """
+    Import polars, which is needed by the 'polars' backend but is not installed with vidigi
+    by default.
+    """
+    try:
+        import polars as pl
+    except ImportError:
+        raise ImportError(
+            "The 'polars' backend requires the dependency 'polars', but this is not installed with vidigi by default. "
+            "Install it with: pip install vidigi[polars]"
+        )
+    return pl
+
+def _check_backend(backend):
+    """
+    Raise a ValueError if `backend` is not a supported dataframe backend.
+    """
+    if backend not in ("pandas", "polars"):
+        raise ValueError(f"Invalid backend '{backend}'. Valid options are: 'pandas', 'polars'.")
+
+def _entity_lifetimes(event_log,
+                      time_col_name="time",
+                      entity_col_name="entity_id",
+                      event_col_name="event",
+                      run_col_name=None,
+                      departures_seen=False):
+    """
+    Find the periods in which each entity is present in the system from its 'arrival' and
+    'depart' events, giving one row per stay with 'arrival' and 'depart' columns.
+
+    Entities who leave and come back have one row for each stay. Each entity's arrivals and
+    departures are taken in time order (with ties broken by the original index, as for the
+    snapshots themselves): an arrival opens a stay unless one is already open, and a departure
+    closes the open stay, if any. A stay with no departure has a missing 'depart' time, and
+    lasts indefinitely.
+
+    If run_col_name is provided, entities are identified by their run and entity ID.
+
+    Rows are sorted by entity (and run), then arrival. If the log has no 'arrival' or no
+    'depart' events at all, no stays are returned, unless departures_seen is True (meaning the
+    log continues a longer one that has departures).
+    """
+    entity_keys = [entity_col_name] if run_col_name is None else [run_col_name, entity_col_name]
+
+    lifetime_events = event_log[
+        event_log[event_col_name].isin(['arrival', 'depart']) &
+        event_log[[*entity_keys, time_col_name]].notnull().all(axis=1)
+        ]
+    is_arrival = (lifetime_events[event_col_name] == 'arrival').to_numpy()
+
+    if not is_arrival.any() or (is_arrival.all() and not departures_seen):
+        return pd.DataFrame(
+            {**{key: event_log[key].iloc[:0] for key in entity_keys},
+             'arrival': pd.Series(dtype=float),
+             'depart': pd.Series(dtype=float)}
+            )
+
+    entity_codes, entities = _entity_codes(lifetime_events, entity_col_name, run_col_name)
+    times = lifetime_events[time_col_name].to_numpy(dtype=float)
+    index_codes = pd.factorize(lifetime_events.index, sort=True)[0]
+    positions = np.arange(len(lifetime_events))
+
+    order = np.lexsort((positions, index_codes, times, entity_codes))
+    entity_codes, times, is_arrival = entity_codes[order], times[order], is_arrival[order]
+
+    # A stay opens at an arrival following a departure (or nothing), and closes at a departure
+    # following an arrival, so opening and closing events alternate for each entity
+    same_entity = np.zeros(len(order), dtype=bool)
+    same_entity[1:] = entity_codes[1:] == entity_codes[:-1]
+    follows_arrival = np.zeros(len(order), dtype=bool)
+    follows_arrival[1:] = is_arrival[:-1]
+    follows_arrival &= same_entity
+
+    changes = np.flatnonzero(is_arrival != follows_arrival)
+    change_opens = is_arrival[changes]
+    change_entities = entity_codes[changes]
+
+    opens = np.flatnonzero(change_opens)
+    closed = np.zeros(len(opens), dtype=bool)
+    has_next = opens + 1 < len(changes)
+    closed[has_next] = change_entities[opens[has_next] + 1] == change_entities[opens[has_next]]
+
+    departs = np.full(len(opens), np.nan)
+    departs[closed] = times[changes[opens[closed] + 1]]
+
+    stay_entities = entities.take(change_entities[opens])
+    if run_col_name is None:
+        lifetimes = pd.DataFrame({entity_col_name: stay_entities})
+    else:
+        lifetimes = stay_entities.to_frame(index=False, name=entity_keys)
+
+    lifetimes['arrival'] = times[changes[opens]]
+    lifetimes['depart'] = departs
+
+    return lifetimes
+
+def _reshape_loop(event_log,
+                  lifetimes,
+                  every_x_time_units,
+                  limit_duration,
+                  step_snapshot_max,
+                  time_col_name,
+                  entity_col_name,
+                  event_type_col_name,
+                  event_col_name,
+                  cap_resource_use=False,
+                  run_col_name=None,
+                  debug_mode=False,
+                  window_start=None,
+                  window_end=None):
+    """
+    Reference engine for reshape_for_animations().
+
+    Filters, sorts and groups the full event log once per snapshot, so the cost grows with
+    the number of snapshots multiplied by the size of the log. Returns the concatenated
+    snapshot dataframe, before the final exit step is added.
+
+    If run_col_name is provided, each run is reshaped in turn and the results joined.
+
+    If window_start and window_end are provided, only the snapshots between them are taken.
+    """
+    if run_col_name is not None:
+        run_dfs = []
+        for run, run_event_log in event_log.groupby(run_col_name, sort=True):
+            run_df = _reshape_loop(
+                run_event_log,
+                lifetimes[lifetimes[run_col_name] == run],
+                every_x_time_units=every_x_time_units,
+                limit_duration=limit_duration,
+                step_snapshot_max=step_snapshot_max,
+                time_col_name=time_col_name,
+                entity_col_name=entity_col_name,
+                event_type_col_name=event_type_col_name,
+                event_col_name=event_col_name,
+                cap_resource_use=cap_resource_use,
+                debug_mode=debug_mode,
+                window_start=window_start,
+                window_end=window_end
+                )
+            # Empty snapshots need to be labelled with their run too
+            run_df[run_col_name] = run
+            run_dfs.append(run_df)
+        return pd.concat(run_dfs, ignore_index=True)
+
+    entity_dfs = []
+
+    ################################################################################
+    # Iterate through every matching minute
+    # and generate snapshot df of position of any entities present at that moment
+    ################################################################################
+    # Note that we want to do this for everything up to AND INCLUDING the duration
+    for time_unit in range(0, limit_duration+every_x_time_units, every_x_time_units):
+        # print(minute)
+        # Get entities who arrived before the current minute and who left the system after the current minute
+        # (or arrived but didn't reach the point of being seen before the model run ended)
+        # When turning this into a function, think we will want user to pass
+        # 'first step' and 'last step' or something similar
+        # and will want to reshape the event log for this so that it has a clear start/end regardless
+        # of pathway (move all the pathway stuff into a separate column?)
+
+        # Think we maybe need a pathway order and pathway precedence column
+        # But what about shared elements of each pathway?
+        in_window = (
+            (window_start is None or time_unit >= window_start) and
+            (window_end is None or time_unit <= window_end)
+            )
+        if in_window:
+            # Work out which entities - if any - were present in the simulation at the current time
+            # They will have arrived at or before the minute in question, and they will depart at
+            # or after the minute in question, or never depart during our model run
+            # (which can happen if they arrive towards the end, or there is a bottleneck)
+            # Entities who leave and come back have one row per stay, so only need one stay
+            # to cover the current time
+            current_entities_in_moment = (lifetimes[
+
+                (lifetimes['arrival'] <= time_unit) &
+
+                (
+                    (lifetimes['depart'] >= time_unit) |
+                    (lifetimes['depart'].isnull() )
+                )]
+            [entity_col_name]
+            .values
+            )
+
+            # If we do have any entities, they will have been passed as a list
+            # so now just filter our event log down to the events these entities have been
+            # involved in
+            if len(current_entities_in_moment) > 0:
+                # Grab just those entities from the filtered log (the unpivoted version)
+
+                # Filter out any events that have taken place after the minute we are interested in
+
+                entity_minute_df = event_log[
+                    (event_log[entity_col_name].isin(current_entities_in_moment)) &
+                    (event_log[time_col_name] <= time_unit)
+                    ]
+
+                # Each entity can only be in a single place at once
+
+                # TODO: Are there instances where this assumption may be broken, and how would we
+                # handle them? e.g. someone who is in a ward but waiting for an x-ray to be read
+                # could need to be represented in both queues simultaneously
+
+                # We have filtered out  events that occurred later than the current minute,
+                # so filter out any events then just take the latest event that has
+                # taken place for each entity
+                most_recent_events_time_unit_ungrouped = entity_minute_df \
+                    .reset_index(drop=False) \
+                    .sort_values([time_col_name, 'index'], ascending=True) \
+                    .groupby([entity_col_name], observed=True) \
+                    .tail(1)
+
+                # Now rank entities within a given event by the order in which they turned up to that event
+                most_recent_events_time_unit_ungrouped['rank'] = most_recent_events_time_unit_ungrouped \
+                              .groupby([event_col_name], observed=True)['index'] \
+                              .rank(method='first')
+
+                most_recent_events_time_unit_ungrouped['max'] = (
+                    most_recent_events_time_unit_ungrouped.groupby(event_col_name, observed=True)['rank'] \
+                    .transform('max')
+                    )
+
+                # ----------------------------------------------------------------------------- #
+
+                # Exclude event types that should not be part of snapshot logic
+                excluded_types = [] if cap_resource_use else ['resource_use', 'resource_use_end']
+
+                # Apply snapshot logic per event (assuming 'event_id' identifies each event)
+                def process_event_group(df):
+                    if df[event_type_col_name].iloc[0] in excluded_types:
+                        return df  # Return unchanged
+                    else:
+                        # Keep only top (step_snapshot_max + 1) ranks
+                        df = df[df['rank'] <= (step_snapshot_max + 1)].copy()
+
+                        # Identify max rank row (to possibly add 'additional' column)
+                        max_row = df[df['rank'] == float(step_snapshot_max + 1)].copy()
+                        if len(max_row) > 0:
+                            max_row['additional'] = max_row['max'] - max_row['rank']
+                            df = pd.concat([
+                                df[df['rank'] != float(step_snapshot_max + 1)],
+                                max_row
+                            ], ignore_index=True)
+                        return df
+
+                # Apply the per-event logic
+                most_recent_events_time_unit_ungrouped = (
+                    most_recent_events_time_unit_ungrouped
+                    .groupby(event_col_name, group_keys=False, observed=True)
+                    .apply(process_event_group)
+                )
+
+                # Clean up and store snapshot
+                entity_dfs.append(
+                    most_recent_events_time_unit_ungrouped
+                    .drop(columns='max', errors='ignore')
+                    .assign(snapshot_time=time_unit)
+                )
+
+            else:
+                # If no entities, append a DataFrame with just the snapshot_time
+                # This creates a row with NaN for all other columns, preserving the time step.
+                empty_df = pd.DataFrame([{'snapshot_time': time_unit}])
+                entity_dfs.append(empty_df)
+
+    if debug_mode:
+        print(f'Iteration through time-unit-by-time-unit logs complete {time.strftime("%H:%M:%S", time.localtime())}')
+
+    # Join together all entity dfs - so the dataframe created per time snapshot - are put into
+    # one large dataframe
+    full_entity_df = (pd.concat(entity_dfs, ignore_index=True)).reset_index(drop=True)
+
+    # We no longer need to keep the individual dataframes in that list, so get rid of them
+    # to free up memory asap
+    del entity_dfs
+    gc.collect()
+
+    return full_entity_df
+
+def _entity_codes(event_log, entity_col_name="entity_id", run_col_name=None):
+    """
+    Factorize the entities of an event log, returning a code per row (-1 where the entity is
+    missing) and the sorted unique entities. If run_col_name is provided, the same entity ID
+    in different runs is treated as a different entity, and the uniques are a MultiIndex of
+    (run, entity).
+    """
+    if run_col_name is None:
+        return pd.factorize(event_log[entity_col_name], sort=True)
+
+    entity_keys = [run_col_name, entity_col_name]
+    entity_codes, entities = pd.factorize(
+        pd.MultiIndex.from_frame(event_log[entity_keys]), sort=True
+        )
+    entity_codes[event_log[entity_keys].isnull().any(axis=1).to_numpy()] = -1
+    return entity_codes, entities
+
+class _SnapshotSweep:
+    """
+    Sorted, precomputed view of an event log used by the sweep engine.
+
+    For every event, works out the range of snapshots in which it is the latest event of its
+    entity while that entity is present in the system. Snapshots can then be produced by
+    expanding these ranges, either all at once or a batch of consecutive snapshots at a time.
+
+    Parameters
+    ----------
+    event_log : pd.DataFrame
+        The event log being reshaped.
+    lifetimes : pd.DataFrame
+        Output of _entity_lifetimes() for the same event log.
+    snapshot_times : np.ndarray
+        Sorted array of the times at which snapshots are taken.
+    step_snapshot_max : int
+        The maximum number of entities to include in each snapshot for each event.
+    time_col_name, entity_col_name, event_type_col_name, event_col_name : str
+        Names of the relevant columns in `event_log`.
+    cap_resource_use : bool, optional
+        If True, resource use events are capped in the same way as other events.
+    run_col_name : str, optional
+        Name of the column identifying the run each event belongs to. If provided, entities
+        are identified by their run and entity ID, and each run is ranked and capped separately.
+    """
+    # Exclude event types that should not be part of snapshot logic
+    excluded_types = ['resource_use', 'resource_use_end']
+
+    def __init__(self,
+                 event_log,
+                 lifetimes,
+                 snapshot_times,
+                 step_snapshot_max,
+                 time_col_name="time",
+                 entity_col_name="entity_id",
+                 event_type_col_name="event_type",
+                 event_col_name="event",
+                 cap_resource_use=False,
+                 run_col_name=None):
+        self.snapshot_times = snapshot_times
+        self.step_snapshot_max = step_snapshot_max
+        self.entity_col_name = entity_col_name
+        self.event_col_name = event_col_name
+
+        # Keep the original index as a column in the same way as the loop engine, as it is used
+        # both to break ties between simultaneous events and to rank entities within an event
+        self.event_log = event_log.reset_index(drop=False)
+
+        times = self.event_log[time_col_name].to_numpy(dtype=float)
+        self.event_codes = pd.factorize(self.event_log[event_col_name])[0]
+
+        self.entity_codes, entities = _entity_codes(self.event_log, entity_col_name, run_col_name)
+        if run_col_name is None:
+            entity_keys = [entity_col_name]
+            self.run_codes = np.zeros(len(self.event_log), dtype=np.int64)
+            self.runs = None
+        else:
+            # Rank each run's events separately
+            entity_keys = [run_col_name, entity_col_name]
+            self.run_codes, self.runs = pd.factorize(self.event_log[run_col_name], sort=True)
+            self.event_codes = np.where(
+                self.event_codes >= 0,
+                pd.factorize(self.run_codes * (self.event_codes.max() + 1) + self.event_codes)[0],
+                -1
+                )
+        if cap_resource_use:
+            self.uncapped_rows = np.zeros(len(self.event_log), dtype=bool)
+        else:
+            self.uncapped_rows = self.event_log[event_type_col_name].isin(self.excluded_types).to_numpy()
+        index_codes = pd.factorize(self.event_log['index'], sort=True)[0]
+        positions = np.arange(len(self.event_log))
+
+        # Position of each event when sorted by time (ties broken by index), and when sorted by
+        # index (ties broken by time) - the latter being the order entities are ranked in
+        self.time_order = np.lexsort((positions, index_codes, times))
+        self.time_key = np.empty_like(positions)
+        self.time_key[self.time_order] = positions
+
+        rank_order = np.lexsort((positions, times, index_codes))
+        self.rank_key = np.empty_like(positions)
+        self.rank_key[rank_order] = positions
+
+        self.entity_count = len(entities)
+
+        # Work in a 'global' snapshot coordinate so that the snapshot ranges of different entities
+        # never overlap; entity e covers [e * stride, e * stride + snapshot_count)
+        snapshot_count = len(snapshot_times)
+        stride = snapshot_count + 1
+
+        ################################################################################
+        # Snapshot ranges in which each entity is present in the system
+        ################################################################################
+        if run_col_name is None:
+            life_entities = entities.get_indexer(lifetimes[entity_col_name])
+        else:
+            life_entities = entities.get_indexer(pd.MultiIndex.from_frame(lifetimes[entity_keys]))
+        life_start = np.searchsorted(
+            snapshot_times, lifetimes['arrival'].to_numpy(dtype=float), side='left'
+            )
+        # Entities who never depart remain present until the end of the animation
+        life_end = np.searchsorted(
+            snapshot_times, lifetimes['depart'].fillna(np.inf).to_numpy(dtype=float), side='right'
+            )
+        valid_lifetimes = (life_entities >= 0) & (life_start < life_end)
+        life_start = life_entities[valid_lifetimes] * stride + life_start[valid_lifetimes]
+        life_end = life_entities[valid_lifetimes] * stride + life_end[valid_lifetimes]
+
+        # Merge overlapping ranges so each entity is described by a set of disjoint ranges
+        life_order = np.argsort(life_start, kind='stable')
+        life_start, life_end = life_start[life_order], life_end[life_order]
+        if len(life_start) > 0:
+            new_range = np.ones(len(life_start), dtype=bool)
+            new_range[1:] = life_start[1:] > np.maximum.accumulate(life_end)[:-1]
+            range_starts = np.flatnonzero(new_range)
+            life_end = np.maximum.reduceat(life_end, range_starts)
+            life_start = life_start[range_starts]
+
+        ################################################################################
+        # Snapshot ranges in which each event is the latest event for its entity
+        ################################################################################
+        valid_events = (self.entity_codes >= 0) & ~np.isnan(times)
+        event_rows = np.lexsort((positions, index_codes, times, self.entity_codes))
+        event_rows = event_rows[valid_events[event_rows]]
+
+        event_entities = self.entity_codes[event_rows]
+        event_times = times[event_rows]
+        next_times = np.append(event_times[1:], np.inf)
+        next_times[:-1][event_entities[1:] != event_entities[:-1]] = np.inf
+
+        segment_start = event_entities * stride + np.searchsorted(snapshot_times, event_times, side='left')
+        segment_end = event_entities * stride + np.searchsorted(snapshot_times, next_times, side='left')
+
+        # Intersect each event's range with the entity's presence ranges
+        first_range = np.searchsorted(life_end, segment_start, side='right')
+        last_range = np.searchsorted(life_start, segment_end, side='left')
+        overlap_counts = np.where(segment_start < segment_end, np.maximum(last_range - first_range, 0), 0)
+
+        segment_ids = np.repeat(np.arange(len(event_rows)), overlap_counts)
+        range_ids = np.repeat(first_range, overlap_counts) + _kernels.offsets_within(overlap_counts)
+
+        overlap_start = np.maximum(segment_start[segment_ids], life_start[range_ids])
+        overlap_end = np.minimum(segment_end[segment_ids], life_end[range_ids])
+
+        # Store the overlaps in snapshot index terms, ordered by the first snapshot they cover
+        segment_entities = event_entities[segment_ids]
+        overlap_order = np.argsort(overlap_start - segment_entities * stride, kind='stable')
+        self.segment_rows = event_rows[segment_ids][overlap_order]
+        self.segment_start = (overlap_start - segment_entities * stride)[overlap_order]
+        self.segment_end = (overlap_end - segment_entities * stride)[overlap_order]
+
+    def snapshot_rows(self, first=0, last=None, segments=None):
+        """
+        Compute the rows for the snapshots with indices in [first, last).
+
+        Parameters
+        ----------
+        first : int, optional
+            Index of the first snapshot to compute (default is 0).
+        last : int, optional
+            Index after the last snapshot to compute (default is the end of the animation).
+        segments : np.ndarray, optional
+            Indices of the stored ranges that may overlap the requested snapshots. If None,
+            all ranges are considered.
+
+        Returns
+        -------
+        tuple of np.ndarray
+            The event log row, snapshot index, rank and number of additional entities
+            (NaN unless the row is a '+ N more' row) for every row of the snapshots. Rows are
+            ordered by snapshot, then by time, with any '+ N more' rows last.
+        """
+        if last is None:
+            last = len(self.snapshot_times)
+        if segments is None:
+            segments = np.arange(len(self.segment_rows))
+
+        overlap_start = np.maximum(self.segment_start[segments], first)
+        overlap_end = np.minimum(self.segment_end[segments], last)
+        overlap_lengths = np.maximum(overlap_end - overlap_start, 0)
+
+        return _kernels.snapshot_rows(
+            segment_rows=self.segment_rows[segments],
+            segment_start=overlap_start,
+            segment_lengths=overlap_lengths,
+            event_codes=self.event_codes,
+            rank_key=self.rank_key,
+            time_key=self.time_key,
+            time_order=self.time_order,
+            uncapped_rows=self.uncapped_rows,
+            step_snapshot_max=self.step_snapshot_max
+            )
+
+    def iter_snapshot_rows(self, snapshots_per_batch=1):
+        """
+        Yield the rows of consecutive batches of snapshots, in time order.
+
+        Only the stored ranges that are active during each batch are expanded, so the work
+        done per batch grows with the number of entities present rather than the size of the
+        event log.
+
+        Yields
+        ------
+        tuple
+            The first and (exclusive) last snapshot index of the batch, followed by the
+            arrays returned by snapshot_rows() for that batch.
+        """
+        snapshot_count = len(self.snapshot_times)
+        next_segment = 0
+        active_segments = np.array([], dtype=np.int64)
+
+        for first in range(0, snapshot_count, snapshots_per_batch):
+            last = min(first + snapshots_per_batch, snapshot_count)
+
+            # Stored ranges are ordered by start, so add any that begin before this batch ends
+            # and drop any that ended before it began
+            new_segment_end = np.searchsorted(self.segment_start, last, side='left')
+            active_segments = np.concatenate(
+                [active_segments, np.arange(next_segment, new_segment_end)]
+                )
+            next_segment = new_segment_end
+            active_segments = active_segments[self.segment_end[active_segments] > first]
+
+            yield (first, last) + self.snapshot_rows(first, last, active_segments)
+
+    # Arrays needed by snapshot_rows(), which are all a worker process needs to compute
+    # a window of snapshots
+    shared_array_names = (
+        'snapshot_times', 'segment_rows', 'segment_start', 'segment_end', 'event_codes',
+        'rank_key', 'time_key', 'time_order', 'uncapped_rows'
+        )
+
+    def shared_arrays(self):
+        """
+        Return the arrays needed by snapshot_rows() as a dictionary, keyed by attribute name.
+        """
+        return {name: getattr(self, name) for name in self.shared_array_names}
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, step_snapshot_max):
+        """
+        Rebuild a sweep from the output of shared_arrays(), without access to the event log.
+        Only snapshot_rows() and iter_snapshot_rows() can be used on the result.
+        """
+        sweep = cls.__new__(cls)
+        sweep.step_snapshot_max = step_snapshot_max
+        for name, array in arrays.items():
+            setattr(sweep, name, array)
+        return sweep
+
+    def to_dataframe(self, rows, snapshot_idx, rank, additional, polars_log=None):
+        """
+        Turn snapshot rows into a dataframe of the matching event log rows, with 'rank',
+        'snapshot_time' and 'additional' columns added.
+
+        If polars_log (a polars copy of the event log with its index as an 'index' column) is
+        given, the rows are taken from it and a polars dataframe is returned instead.
+        """
+        if polars_log is not None:
+            pl = _import_polars()
+            return polars_log[rows].with_columns(
+                pl.Series('rank', rank, nan_to_null=True),
+                pl.Series('snapshot_time', self.snapshot_times[snapshot_idx]),
+                pl.Series('additional', additional, nan_to_null=True)
+                )
+
+        entity_df = self.event_log.take(rows).reset_index(drop=True)
+        entity_df['rank'] = rank
+        entity_df['snapshot_time'] = self.snapshot_times[snapshot_idx]
+        entity_df['additional'] = additional
+        return entity_df
+
+def _share_arrays(arrays):
+    """
+    Copy a dictionary of arrays into shared memory.
+
+    Returns the shared memory blocks, which the caller is responsible for closing and
+    unlinking, and a picklable description of each array that _attach_arrays() can use to
+    access it from another process.
+    """
+    blocks = []
+    array_specs = {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        array_specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, array_specs
+
+def _attach_arrays(array_specs):
+    """
+    Access arrays shared by _share_arrays(). Returns the attached blocks, which must be closed
+    once the arrays are no longer in use, and a dictionary of arrays backed by them.
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in array_specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+def _sweep_window_rows(array_specs, step_snapshot_max, first, last):
+    """
+    Worker function for parallel reshaping - compute the snapshot rows for the snapshots with
+    indices in [first, last), reading the sweep arrays from shared memory.
+    """
+    blocks, arrays = _attach_arrays(array_specs)
+    try:
+        sweep = _SnapshotSweep.from_shared_arrays(arrays, step_snapshot_max)
+        segments = np.flatnonzero((sweep.segment_start < last) & (sweep.segment_end > first))
+        # The results are built with fancy indexing, so are copies rather than views
+        # of shared memory
+        window_rows = sweep.snapshot_rows(first, last, segments)
+    finally:
+        # Views onto the shared memory must be released before it can be closed
+        sweep = arrays = None
+        for block in blocks:
+            block.close()
+    return window_rows
+
+def _parallel_snapshot_rows(sweep, n_jobs):
+    """
+    Compute all snapshot rows for a sweep, splitting the snapshots into consecutive time
+    windows that are computed in parallel by a pool of n_jobs worker processes.
+
+    The arrays describing the event log are placed in shared memory rather than being
+    pickled and sent to each worker. The output is identical to sweep.snapshot_rows().
+    """
+    snapshot_count = len(sweep.snapshot_times)
+    # Use a few windows per worker so that busy periods of the simulation don't leave
+    # other workers idle
+    window_count = max(min(snapshot_count, n_jobs * 4), 1)
+    window_bounds = np.linspace(0, snapshot_count, window_count + 1).astype(int)
+
+    blocks, array_specs = _share_arrays(sweep.shared_arrays())
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(
+                    _sweep_window_rows, array_specs, sweep.step_snapshot_max, int(first), int(last)
+                    )
+                for first, last in zip(window_bounds[:-1], window_bounds[1:])
+            ]
+            window_rows = [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # Windows are consecutive and each is ordered by snapshot, so joining them in window order
+    # gives the same result as computing every snapshot at once
+    return tuple(np.concatenate(arrays) for arrays in zip(*window_rows))
+
+def _changing_snapshot_times(snapshot_times, event_times, every_x_time_units):
+    """
+    Cut snapshot_times down to the snapshots that may differ from the one before them, for
+    skip_unchanged_snapshots.
+
+    Who is present, their latest event and their rank can only change at a snapshot if an event
+    happened since the one before, and exit steps are added one snapshot after an entity is last
+    shown, so a snapshot can only differ from the one before if an event falls at most two
+    snapshots before it. Snapshots followed by an event within one snapshot are kept as well, so
+    that the last snapshot each entity is shown in is taken and its exit step falls in the right
+    place. The first two snapshots (the second being the first of a window, as the sweep starts
+    one snapshot early) and the last are always kept.
+    """
+    event_times = np.sort(event_times)
+    near_event = (
+        np.searchsorted(event_times, snapshot_times + every_x_time_units, side='right') >
+        np.searchsorted(event_times, snapshot_times - 2 * every_x_time_units, side='left')
+        )
+    near_event[:2] = True
+    near_event[-1] = True
+
+    return snapshot_times[near_event]
+
+def _reshape_sweep(event_log,
+                   lifetimes,
+                   every_x_time_units,
+                   limit_duration,
+                   step_snapshot_max,
+                   time_col_name,
+                   entity_col_name,
+                   event_type_col_name,
+                   event_col_name,
+                   cap_resource_use=False,
+                   run_col_name=None,
+                   debug_mode=False,
+                   n_jobs=1,
+                   window_start=None,
+                   window_end=None,
+                   polars_log=None,
+                   changing_only=False):
+    """
+    Sweep-line engine for reshape_for_animations().
+
+    Sorts the event log once and works out, for every event, the range of snapshots for which
+    it is the latest event of its entity. Intersecting these ranges with the range of snapshots
+    in which each entity is present gives every (snapshot, event) row of the output in a single
+    pass, without filtering the log per snapshot.
+
+    If n_jobs is greater than 1, snapshots are computed in parallel over time windows.
+
+    If run_col_name is provided, every run is swept at once, with an empty snapshot row added
+    for each run and snapshot time without any entities.
+
+    If window_start and window_end are provided, only the snapshots between them are taken.
+
+    If polars_log (a polars copy of the event log with its index as an 'index' column) is
+    provided, the output is built from it as a polars dataframe.
+
+    If changing_only is True, the snapshots identical to the one before them are not taken,
+    apart from some that _changing_snapshot_times() cannot rule out, which are left for
+    _skip_unchanged_snapshots() to drop.
+
+    Returns a dataframe matching the one produced by _reshape_loop() once both have been sorted
+    by snapshot time and event.
+    """
+    snapshot_times = np.arange(0, limit_duration + every_x_time_units, every_x_time_units)
+    if window_start is not None:
+        snapshot_times = snapshot_times[snapshot_times >= window_start]
+    if window_end is not None:
+        snapshot_times = snapshot_times[snapshot_times <= window_end]
+    if changing_only and len(snapshot_times) > 0:
+        snapshot_times = _changing_snapshot_times(
+            snapshot_times, event_log[time_col_name].to_numpy(dtype=float), every_x_time_units
+            )
+
+    sweep = _SnapshotSweep(
+        event_log,
+        lifetimes,
+        snapshot_times=snapshot_times,
+        step_snapshot_max=step_snapshot_max,
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_type_col_name=event_type_col_name,
+        event_col_name=event_col_name,
+        cap_resource_use=cap_resource_use,
+        run_col_name=run_col_name
+        )
+
+    if n_jobs > 1:
+        rows, snapshot_idx, rank, additional = _parallel_snapshot_rows(sweep, n_jobs)
+    else:
+        rows, snapshot_idx, rank, additional = sweep.snapshot_rows()
+
+    if debug_mode:
+        print(f'Sweep through event and snapshot times complete {time.strftime("%H:%M:%S", time.localtime())}')
+
+    if run_col_name is None:
+        present = np.zeros(len(snapshot_times), dtype=bool)
+        present[snapshot_idx] = True
+        empty_snapshots = pd.DataFrame({'snapshot_time': snapshot_times[~present]})
+    else:
+        present = np.zeros((len(sweep.runs), len(snapshot_times)), dtype=bool)
+        present[sweep.run_codes[rows], snapshot_idx] = True
+        empty_runs, empty_idx = np.nonzero(~present)
+        empty_snapshots = pd.DataFrame({
+            run_col_name: sweep.runs.take(empty_runs),
+            'snapshot_time': snapshot_times[empty_idx]
+            })
+
+    if polars_log is not None:
+        pl = _import_polars()
+        empty_snapshots = pl.from_pandas(empty_snapshots)
+
+    if len(rows) == 0:
+        return empty_snapshots
+
+    # Match the column order the loop engine ends up with, which depends on whether the first
+    # snapshot was empty and whether any snapshot needed a '+ N more' row
+    entity_df = sweep.to_dataframe(rows, snapshot_idx, rank, additional, polars_log=polars_log)
+    is_additional = ~np.isnan(additional)
+    entity_cols = [col for col in entity_df.columns if col != 'additional']
+    if is_additional[snapshot_idx == 0].any():
+        entity_cols.insert(entity_cols.index('snapshot_time'), 'additional')
+    elif is_additional.any():
+        entity_cols.append('additional')
+
+    if polars_log is not None:
+        entity_df = entity_df.select(entity_cols)
+    elif entity_cols != list(entity_df.columns):
+        entity_df = entity_df[entity_cols]
+
+    if present.all():
+        return entity_df
+    elif present[..., 0].all():
+        snapshot_dfs = [entity_df, empty_snapshots]
+    else:
+        snapshot_dfs = [empty_snapshots, entity_df]
+
+    if polars_log is not None:
+        return pl.concat(snapshot_dfs, how='diagonal_relaxed')
+
+    return pd.concat(snapshot_dfs, ignore_index=True)
+
+def _event_log_window(event_log,
+                      lifetimes,
+                      window_start,
+                      window_end,
+                      time_col_name="time",
+                      entity_col_name="entity_id",
+                      run_col_name=None):
+    """
+    Cut an event log down to the events needed for the snapshots between window_start and
+    window_end: the events of entities present at some point in the window, up to its end.
+
+    `lifetimes` is the output of _entity_lifetimes() for the whole event log. Returns the cut
+    event log along with the stays of the entities it keeps, which are found from the whole
+    log as cutting it can drop the departures that close them.
+    """
+    if len(lifetimes) == 0:
+        # Nobody is ever present, so there is nothing to cut down
+        return event_log, lifetimes
+
+    present_in_window = lifetimes[
+        (lifetimes['arrival'] <= window_end) &
+        ((lifetimes['depart'] >= window_start) | lifetimes['depart'].isnull())
+        ]
+
+    if run_col_name is None:
+        is_present = event_log[entity_col_name].isin(present_in_window[entity_col_name])
+        keeps_stays = lifetimes[entity_col_name].isin(present_in_window[entity_col_name])
+    else:
+        entity_keys = [run_col_name, entity_col_name]
+        present_entities = pd.MultiIndex.from_frame(present_in_window[entity_keys])
+        is_present = pd.MultiIndex.from_frame(event_log[entity_keys]).isin(present_entities)
+        keeps_stays = pd.MultiIndex.from_frame(lifetimes[entity_keys]).isin(present_entities)
+
+    return (
+        event_log[is_present & (event_log[time_col_name] <= window_end)],
+        lifetimes[keeps_stays].reset_index(drop=True)
+        )
+
+def _continuing_after_window(lifetimes, every_x_time_units, limit_duration, window_end, entity_keys):
+    """
+    Find the entities shown again in a snapshot after window_end, from the stays found by
+    _entity_lifetimes(). Their last step within the window is not their last step overall, so
+    they do not get an exit step in it.
+
+    A stay is only shown in the snapshots it covers, so a stay starting after the last snapshot,
+    or falling between two snapshots, does not count. Ranks are not taken into account, so an
+    entity that step_snapshot_max hides in every later snapshot still counts as shown again.
+    """
+    snapshot_times = np.arange(0, limit_duration + every_x_time_units, every_x_time_units)
+    later_snapshots = snapshot_times[snapshot_times > window_end]
+
+    first_shown = np.searchsorted(later_snapshots, lifetimes['arrival'].to_numpy(dtype=float), side='left')
+    last_shown = np.searchsorted(
+        later_snapshots, lifetimes['depart'].fillna(np.inf).to_numpy(dtype=float), side='right'
+        )
+
+    return lifetimes.loc[first_shown < last_shown, entity_keys]
+
+def _slim_dataframe(df, columns=None):
+    """
+    Reduce the memory used by a dataframe passing through the animation pipeline.
+
+    Projects the dataframe to `columns` (ignoring any that are not present) if given,
+    dictionary-encodes string columns as categoricals, and downcasts numeric columns to 32-bit
+    types where this does not change any values. Categories are sorted, so sorting an encoded
+    column gives the same order as sorting the original labels.
+    """
+    if columns is not None:
+        df = df[[col for col in dict.fromkeys(columns) if col in df.columns]]
+
+    slim_columns = {}
+    for col, values in df.items():
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            values = values.astype('category')
+        elif pd.api.types.is_integer_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            int32 = np.iinfo(np.int32)
+            if len(values) == 0 or (values.min() >= int32.min and values.max() <= int32.max):
+                values = values.astype(np.int32)
+        elif pd.api.types.is_float_dtype(values):
+            values_32 = values.astype(np.float32)
+            if ((values_32 == values) | values.isna()).all():
+                values = values_32
+        slim_columns[col] = values
+
+    return pd.DataFrame(slim_columns, index=df.index)
+
+def _skip_unchanged_snapshots(full_entity_df, every_x_time_units, max_snapshot_gap=None, run_col_name=None):
+    """
+    Drop snapshots that are identical to the one before them.
+
+    Every column except 'snapshot_time' is compared, so a snapshot is only kept if an entity
+    has moved, arrived, left or changed rank since the previous snapshot. The first and last
+    snapshots (of each run, if run_col_name is given) are always kept, and if max_snapshot_gap
+    is given, copies of the last kept snapshot are added at multiples of every_x_time_units
+    during unchanged periods, so no two kept snapshots are more than max_snapshot_gap apart.
+
+    Expects `full_entity_df` to be sorted by (run and) snapshot time, as returned by
+    reshape_for_animations(). It does not need to hold every snapshot, as long as each one left
+    out is identical to the one before it. Snapshot times are left unchanged.
+    """
+    if len(full_entity_df) == 0:
+        return full_entity_df
+
+    snapshot_keys = ['snapshot_time'] if run_col_name is None else [run_col_name, 'snapshot_time']
+    new_snapshot = (
+        full_entity_df[snapshot_keys].ne(full_entity_df[snapshot_keys].shift()).any(axis=1).to_numpy()
+        )
+    snapshot_starts = np.flatnonzero(new_snapshot)
+    snapshot_sizes = np.diff(np.append(snapshot_starts, len(full_entity_df)))
+    snapshot_times = full_entity_df['snapshot_time'].to_numpy()[snapshot_starts]
+
+    row_hashes = pd.util.hash_pandas_object(
+        full_entity_df.drop(columns='snapshot_time'), index=False
+        ).to_numpy()
+
+    # Compare each row with the row in the same position of the previous snapshot
+    same_size = np.zeros(len(snapshot_times), dtype=bool)
+    same_size[1:] = snapshot_sizes[1:] == snapshot_sizes[:-1]
+    row_sizes = np.repeat(snapshot_sizes, snapshot_sizes)
+    row_positions = np.arange(len(full_entity_df))
+    previous_positions = np.maximum(row_positions - row_sizes, 0)
+    row_unchanged = (
+        np.repeat(same_size, snapshot_sizes) &
+        (row_hashes == row_hashes[previous_positions])
+        )
+
+    keep = ~np.logical_and.reduceat(row_unchanged, snapshot_starts)
+    keep[0] = True
+    keep[-1] = True
+    same_run = np.ones(len(snapshot_times) - 1, dtype=bool)
+    if run_col_name is not None:
+        snapshot_runs = full_entity_df[run_col_name].to_numpy()[snapshot_starts]
+        same_run = snapshot_runs[1:] == snapshot_runs[:-1]
+        keep[1:] |= ~same_run
+        keep[:-1] |= ~same_run
+
+    skipped_df = full_entity_df[np.repeat(keep, snapshot_sizes)]
+
+    if max_snapshot_gap is None:
+        return skipped_df.reset_index(drop=True)
+
+    # Every snapshot between two kept ones matches the first of them, so fill each gap with
+    # copies of it, as many grid steps apart as fit within max_snapshot_gap
+    fill_step = (max_snapshot_gap // every_x_time_units) * every_x_time_units
+    kept_idx = np.flatnonzero(keep)
+    gap_starts, gap_ends = kept_idx[:-1], kept_idx[1:]
+    fill_counts = np.where(
+        same_run[gap_starts],
+        np.ceil((snapshot_times[gap_ends] - snapshot_times[gap_starts]) / fill_step) - 1,
+        0
+        ).astype(int)
+    if fill_counts.sum() == 0:
+        return skipped_df.reset_index(drop=True)
+
+    fill_sources = np.repeat(gap_starts, fill_counts)
+    fill_steps = np.arange(len(fill_sources)) - np.repeat(np.cumsum(fill_counts) - fill_counts, fill_counts) + 1
+    fill_sizes = snapshot_sizes[fill_sources]
+    fill_rows = (
+        np.repeat(snapshot_starts[fill_sources] - (np.cumsum(fill_sizes) - fill_sizes), fill_sizes) +
+        np.arange(fill_sizes.sum())
+        )
+    fill_df = full_entity_df.iloc[fill_rows].assign(
+        snapshot_time=np.repeat(snapshot_times[fill_sources] + fill_steps * fill_step, fill_sizes).astype(
+            full_entity_df['snapshot_time'].dtype
+            )
+        )
+
+    return (
+        pd.concat([skipped_df, fill_df])
+        .sort_values(snapshot_keys, kind='stable')
+        .reset_index(drop=True)
+        )
+
+def _finish_reshape_polars(full_entity_df,
+                           lifetimes,
+                           every_x_time_units,
+                           limit_duration,
+                           entity_col_name="entity_id",
+                           event_col_name="event",
+                           run_col_name=None,
+                           window_start=None,
+                           window_end=None):
+    """
+    Polars version of the last steps of reshape_for_animations(), used by the 'polars'
+    backend: add an exit step for each entity, cut the snapshots down to the window (if
+    window_start and window_end are given) and sort them.
+    """
+    pl = _import_polars()
+
+    entity_keys = [entity_col_name] if run_col_name is None else [run_col_name, entity_col_name]
+
+    final_step = (
+        full_entity_df
+        .drop_nulls(entity_keys)
+        .sort([*entity_keys, 'snapshot_time'], maintain_order=True)
+        .group_by(entity_keys, maintain_order=True)
+        .tail(1)
+        .select(full_entity_df.columns)
+        .with_columns(
+            pl.col('snapshot_time') + every_x_time_units,
+            pl.lit("depart").alias(event_col_name)
+            )
+        .filter(pl.col('snapshot_time') <= limit_duration)
+        )
+
+    windowed = window_start is not None and window_end is not None
+
+    if windowed:
+        continuing = _continuing_after_window(
+            lifetimes, every_x_time_units, limit_duration, window_end, entity_keys
+            )
+        final_step = final_step.join(
+            pl.from_pandas(continuing[entity_keys]).cast(final_step.select(entity_keys).schema),
+            on=entity_keys,
+            how='anti'
+            )
+
+    full_entity_df = pl.concat([full_entity_df, final_step], how='vertical_relaxed')
+
+    if windowed:
+        full_entity_df = full_entity_df.filter(
+            pl.col('snapshot_time').is_between(window_start, window_end)
+            )
+
+    sort_keys = ['snapshot_time', event_col_name] if run_col_name is None else [run_col_name, 'snapshot_time', event_col_name]
+    return full_entity_df.sort(sort_keys, nulls_last=True, maintain_order=True)
+
+class _DatetimeGrid:
+    """
+    Maps the datetime64 times of an event log onto the numeric time units used by the
+    reshaping engines, and back again.
+
+    Times are counted in ticks since an origin: the start of the snapshot interval containing
+    the earliest event. The tick is the greatest common divisor of the snapshot interval and
+    every event's offset from the origin, so every time is a whole number of ticks. The engines
+    hold times as float64, which counts whole ticks exactly only up to 2**53, so a ValueError is
+    raised if the events or limit_duration lie further than that from the origin (e.g. times
+    with nanosecond precision spread over more than about 104 days). Within that range the
+    conversion is reversed exactly.
+
+    Parameters
+    ----------
+    times : pd.Series
+        The datetime64 time column of the event log.
+    every_x_time_units : timedelta-like
+        The time between snapshots, e.g. pd.Timedelta(minutes=15) or "15min".
+    """
+    def __init__(self, times, every_x_time_units):
+        every = self._to_timedelta(every_x_time_units, "every_x_time_units")
+        if every <= pd.Timedelta(0):
+            raise ValueError("every_x_time_units must be positive.")
+        self.tz = getattr(times.dtype, "tz", None)
+
+        # Nanoseconds since the epoch (in UTC, for timezone-aware times), with NaT as the
+        # smallest int64
+        times_ns = pd.DatetimeIndex(times).asi8
+        self._valid = times_ns != np.iinfo(np.int64).min
+
+        every_ns = every.value
+        if self._valid.any():
+            self.origin_ns = times_ns[self._valid].min() // every_ns * every_ns
+        else:
+            self.origin_ns = 0
+
+        offsets = times_ns[self._valid] - self.origin_ns
+        self.tick_ns = int(np.gcd.reduce(np.append(offsets, every_ns)))
+        self._times_ns = times_ns
+
+        if len(offsets):
+            self._check_exact(offsets.max() // self.tick_ns, "The event times")
+
+    @staticmethod
+    def _to_timedelta(value, name):
+        if isinstance(value, (int, float, np.number)):
+            raise ValueError(
+                f"{name} must be given as a timedelta (e.g. pd.Timedelta(minutes=10) or '10min') "
+                "when the time column holds datetimes."
+                )
+        return pd.Timedelta(value)
+
+    def _check_exact(self, ticks, name):
+        if ticks > 2**53:
+            raise ValueError(
+                f"{name} span too many multiples of {pd.Timedelta(self.tick_ns, unit='ns')} (the "
+                "precision of the event times) to be converted exactly. Round the time column to "
+                "a coarser precision, e.g. with .dt.round('s'), or shorten limit_duration."
+                )
+
+    def _to_ns(self, value):
+        value = pd.Timestamp(value)
+        if self.tz is not None and value.tz is None:
+            value = value.tz_localize(self.tz)
+        return value.value
+
+    def times(self):
+        """
+        The event times as a float array of ticks since the origin, with NaT as NaN.
+        """
+        units = np.full(len(self._times_ns), np.nan)
+        units[self._valid] = (self._times_ns[self._valid] - self.origin_ns) // self.tick_ns
+        return units
+
+    def duration(self, value, name):
+        """
+        Convert a timedelta to a whole number of ticks, rounding down.
+        """
+        return self._to_timedelta(value, name).value // self.tick_ns
+
+    def limit(self, limit_duration):
+        """
+        Convert limit_duration, given either as the datetime of the last snapshot or as a
+        timedelta measured from the origin, to a whole number of ticks.
+        """
+        if isinstance(limit_duration, (dt.datetime, np.datetime64)):
+            ticks = (self._to_ns(limit_duration) - self.origin_ns) // self.tick_ns
+        else:
+            ticks = self.duration(limit_duration, "limit_duration")
+        self._check_exact(ticks, "limit_duration and the event times")
+        return ticks
+
+    def timestamp(self, value, name, round_up=False):
+        """
+        Convert a datetime to a whole number of ticks since the origin, rounding down (or up,
+        if round_up is True). None is passed through.
+        """
+        if value is None:
+            return None
+        try:
+            offset = self._to_ns(value) - self.origin_ns
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a datetime when the time column holds datetimes.")
+        return -(-offset // self.tick_ns) if round_up else offset // self.tick_ns
+
+    def to_datetimes(self, units):
+        """
+        Convert an array of ticks since the origin back to datetimes, with NaN as NaT.
+        """
+        units = np.asarray(units, dtype=float)
+        missing = np.isnan(units)
+        times_ns = np.where(missing, 0, units).astype(np.int64) * self.tick_ns + self.origin_ns
+        times_ns[missing] = np.iinfo(np.int64).min
+        times = pd.DatetimeIndex(times_ns.view("datetime64[ns]"))
+        if self.tz is not None:
+            times = times.tz_localize("UTC").tz_convert(self.tz)
+        return times
+
+    def restore(self, df, time_col_name):
+        """
+        Convert the time and snapshot_time columns of reshaped snapshots back to datetimes.
+        Works with both pandas and polars dataframes.
+        """
+        columns = [col for col in [time_col_name, "snapshot_time"] if col in df.columns]
+        if isinstance(df, pd.DataFrame):
+            return df.assign(**{
+                col: self.to_datetimes(df[col].to_numpy(dtype=float, na_value=np.nan))
+                for col in columns
+                })
+
+        pl = _import_polars()
+        return df.with_columns([
+            pl.Series(col, self.to_datetimes(df[col].cast(pl.Float64).to_numpy()))
+            for col in columns
+            ])
+
+def assign_resource_ids(event_log,
+                        entity_col_name="entity_id",
+                        event_type_col_name="event_type",
+                        event_col_name="event",
+                        time_col_name="time",
+                        resource_col_name="resource_id",
+                        run_col_name=None):
+    """
+    Assign a resource ID to each resource use step of an event log that does not record one.
+
+    Models using a plain simpy.Resource cannot log which of the resources each entity is
+    using, so their 'resource_use' events cannot be placed on individual resources. This
+    function works out a consistent assignment after the fact: each entity takes the lowest
+    numbered resource that is free when it starts using the resource, and keeps it until its
+    matching 'resource_use_end' event.
+
+    Parameters
+    ----------
+    event_log : pd.DataFrame
+        The event log. Any existing values in `resource_col_name` are replaced for
+        'resource_use' and 'resource_use_end' events, and kept for all other events.
+    entity_col_name : str, default="entity_id"
+        Name of the column in `event_log` that contains the unique identifier for each entity.
+    event_type_col_name : str, default="event_type"
+        Name of the column in `event_log` that specifies the category of the event.
+    event_col_name : str, default="event"
+        Name of the column in `event_log` that specifies the actual event that occurred.
+        Resources are numbered separately for each 'resource_use' event, as each is laid out
+        as a separate set of resources in the animation.
+    time_col_name : str, default="time"
+        Name of the column in `event_log` that contains the timestamp of each event.
+    resource_col_name : str, default="resource_id"
+        Name of the column to write the resource IDs to.
+    run_col_name : str, optional, default=None
+        Name of the column identifying the run each event belongs to. Resources are then
+        numbered separately for each run.
+
+    Returns
+    -------
+    pd.DataFrame
+        A copy of `event_log` with the resource ID of each 'resource_use' event and its
+        matching 'resource_use_end' event in `resource_col_name`, counting from 1.
+
+    Notes
+    -----
+    - Each entity's 'resource_use' events are matched to its 'resource_use_end' events in
+      time order, so entities are assumed to release resources in the order they started
+      using them. A 'resource_use' event without a matching end keeps its resource until the
+      end of the log, and an unmatched 'resource_use_end' event is given no resource ID.
+    - A resource released at the same time another entity starts using one is free to be
+      taken by that entity, as it would be in SimPy.
+    - Matching events and ordering the intervals of resource use are done with array
+      operations, and resources are then assigned with a heap of free resources and a heap
+      of intervals in progress, taking O(n log n) time overall. If Numba is installed
+      (`pip install vidigi[numba]`), the assignment is compiled for large event logs.
+    """
+    event_log = event_log.copy()
+    event_types = event_log[event_type_col_name].to_numpy()
+    use_rows = np.flatnonzero(event_types == 'resource_use')
+    end_rows = np.flatnonzero(event_types == 'resource_use_end')
+
+    resource_ids = np.full(len(event_log), np.nan)
+    if resource_col_name in event_log.columns:
+        resource_ids[:] = pd.to_numeric(event_log[resource_col_name], errors='coerce')
+    resource_ids[use_rows] = np.nan
+    resource_ids[end_rows] = np.nan
+
+    if len(use_rows) > 0:
+        run_keys = [] if run_col_name is None else [run_col_name]
+        entity_codes, _ = _entity_codes(event_log, entity_col_name, run_col_name)
+        # Times as integer ranks, which keeps their order whatever their type
+        time_codes, _ = pd.factorize(event_log[time_col_name], sort=True)
+
+        # The k-th 'resource_use' event of each entity is matched to its k-th
+        # 'resource_use_end' event, in time order
+        time_count = time_codes.max() + 2
+        def nth_of_entity(rows):
+            # Sorted by entity and time, with ties kept in log order
+            rows = rows[np.argsort(entity_codes[rows] * time_count + time_codes[rows], kind='stable')]
+            _, counts = np.unique(entity_codes[rows], return_counts=True)
+            return rows, entity_codes[rows], _kernels.offsets_within(counts)
+
+        use_rows, use_entities, use_nth = nth_of_entity(use_rows)
+        end_rows, end_entities, end_nth = nth_of_entity(end_rows)
+        key_width = max(len(use_rows), len(end_rows)) + 1
+        end_keys = end_entities * key_width + end_nth
+        use_keys = use_entities * key_width + use_nth
+        matched_ends = np.searchsorted(end_keys, use_keys)
+        is_matched = matched_ends < len(end_keys)
+        is_matched[is_matched] = end_keys[matched_ends[is_matched]] == use_keys[is_matched]
+
+        # Resource use without a matching end lasts beyond the end of the log
+        starts = time_codes[use_rows]
+        ends = np.full(len(use_rows), time_count - 1)
+        ends[is_matched] = time_codes[end_rows[matched_ends[is_matched]]]
+        ends = np.maximum(ends, starts)
+
+        # Resources are numbered separately for each resource use step (and run)
+        pool_codes, _ = pd.factorize(
+            pd.MultiIndex.from_frame(event_log[[*run_keys, event_col_name]].iloc[use_rows])
+            )
+        order = np.lexsort((use_rows, starts, pool_codes))
+        slots = np.empty(len(use_rows))
+        slots[order] = _kernels.lowest_free_slots(pool_codes[order], starts[order], ends[order])
+
+        resource_ids[use_rows] = slots
+        resource_ids[end_rows[matched_ends[is_matched]]] = slots[is_matched]
+
+    event_log[resource_col_name] = resource_ids
+
+    return event_log
 
 def reshape_for_animations(event_log,
                            every_x_time_units=10,
@@ -12,7 +1288,19 @@ def reshape_for_animations(event_log,
                            event_type_col_name="event_type",
                            event_col_name="event",
                            pathway_col_name=None,
-                           debug_mode=False):
+                           run_col_name=None,
+                           resource_col_name="resource_id",
+                           cap_resource_use=False,
+                           debug_mode=False,
+                           engine="sweep",
+                           n_jobs=1,
+                           return_state=False,
+                           skip_unchanged_snapshots=False,
+                           max_snapshot_gap=None,
+                           slim=False,
+                           window_start=None,
+                           window_end=None,
+                           backend="pandas"):
     """
     Reshape event log data for animation purposes.
 
@@ -23,16 +1311,20 @@ def reshape_for_animations(event_log,
     ----------
     event_log : pd.DataFrame
         The input event log containing entity events and timestamps in the form of a number of time
-        units since the simulation began.
+        units since the simulation began, or as datetimes (see Notes).
     every_x_time_units : int, optional
-        The time interval between snapshots in preferred time units (default is 10).
+        The time interval between snapshots in preferred time units (default is 10). If the time
+        column holds datetimes, this must be a timedelta, e.g. pd.Timedelta(minutes=10) or "10min".
     limit_duration : int, optional
-        The maximum duration to consider in preferred time units (default is 10 days).
+        The maximum duration to consider in preferred time units (default is 10 days). If the time
+        column holds datetimes, this must be a timedelta measured from the first snapshot, or the
+        datetime of the last snapshot.
     step_snapshot_max : int, optional
         The maximum number of entities to include in each snapshot for each event (default is 50).
     time_col_name : str, default="time"
         Name of the column in `event_log` that contains the timestamp of each event.
-        Timestamps should represent the number of time units since the simulation began.
+        Timestamps should represent the number of time units since the simulation began, or be
+        datetime64 values.
     entity_col_name : str, default="entity_id"
         Name of the column in `event_log` that contains the unique identifier for each entity
         (e.g., "entity_id", "entity", "patient", "patient_id", "customer", "ID").
@@ -46,14 +1338,86 @@ def reshape_for_animations(event_log,
         Name of the column in `event_log` that identifies the specific pathway or
         process flow the entity is following. If `None`, it is assumed that pathway
         information is not present.
+    run_col_name : str, optional, default=None
+        Name of the column in `event_log` that identifies the run (replication) each event
+        belongs to, e.g. "run" or "run_number". If provided, every run in `event_log` is
+        reshaped in a single pass, with the same entity ID in different runs treated as
+        different entities, and the run included as a key in the output. If `None`, the event
+        log is assumed to contain a single run.
+    resource_col_name : str, default="resource_id"
+        Name of the column for the resource identifier. Only used to decide which columns to
+        keep when `slim` is True.
+    cap_resource_use : bool, optional
+        If True, 'resource_use' and 'resource_use_end' events are also limited to
+        step_snapshot_max entities per snapshot, with the final entity shown carrying the number
+        of additional entities not shown (default is False, meaning every entity using a resource
+        is shown). Useful when there are hundreds of resources in use at once.
     debug_mode : bool, optional
         If True, print debug information during processing (default is False).
+    engine : str, optional
+        The method used to compute the snapshots (default is "sweep").
+        "sweep" sorts the event log once and computes every snapshot in a single pass over
+        the event and snapshot times.
+        "loop" filters and groups the full event log separately for each snapshot. It is much
+        slower on long runs, but is kept as a reference implementation; both engines produce
+        identical output.
+    n_jobs : int, optional
+        Number of worker processes to use when computing snapshots (default is 1, meaning no
+        parallelism). If -1, one worker is used per CPU. The snapshots are split into time windows
+        that are computed in parallel and then joined, giving output identical to n_jobs=1.
+        Only used by the "sweep" engine.
+    return_state : bool, optional
+        If True, also return a ReshapeState that can be passed to extend_reshape_for_animations()
+        to add snapshots for newly arrived events without reprocessing the full log (default is
+        False). limit_duration must be a multiple of every_x_time_units when this is used.
+    skip_unchanged_snapshots : bool, optional
+        If True, snapshots in which nothing has changed since the previous snapshot are dropped,
+        so frames are only produced when the state of the system changes (default is False).
+        every_x_time_units then acts as the minimum spacing between snapshots. The first and
+        last snapshots are always kept, and the 'snapshot_time' of every kept snapshot is
+        unchanged, so clock labels remain correct. With the "sweep" engine, snapshots that
+        cannot have changed are never built, so quiet periods cost neither time nor memory.
+        Cannot be combined with return_state.
+    max_snapshot_gap : int, optional
+        When skip_unchanged_snapshots is True, the maximum time between kept snapshots during
+        periods with no changes, so the clock keeps moving through quiet periods (default is
+        None, meaning no limit). Snapshots are still taken at multiples of every_x_time_units,
+        so quiet periods are crossed in steps of the largest such multiple within the gap. A
+        timedelta if the time column holds datetimes.
+    slim : bool, optional
+        If True, reduce the memory used by the output (default is False). Only the columns
+        needed to position entities and label them in the animation are kept (the time, entity,
+        event type, event, pathway, run and resource columns, plus the snapshot columns added
+        here), string columns are stored as categoricals, and numeric columns are downcast to
+        32-bit types where no values change. generate_animation() decodes these again when
+        building the figure.
+    window_start : float, optional
+        If given, only snapshots taken at or after this time are returned (default is None,
+        meaning snapshots start at time 0). A datetime if the time column holds datetimes.
+        Only the events of entities present at some point in the window are processed, so the
+        time taken depends on the length of the window rather than the length of the
+        simulation. Cannot be combined with return_state.
+    window_end : float, optional
+        If given, only snapshots taken at or before this time are returned (default is None,
+        meaning snapshots continue to limit_duration). A datetime if the time column holds
+        datetimes. Cannot be combined with return_state. A window in which nobody is present
+        gives only empty snapshots, with the usual columns.
+    backend : str, optional
+        The dataframe library used to build the output (default is "pandas").
+        "polars" assembles, adds exit steps to and sorts the snapshots with polars, and returns
+        a polars DataFrame with the same rows and columns. This is faster on large event logs,
+        and the result can be passed straight on to generate_animation_df() with the same
+        backend. Requires the optional dependency polars (`pip install vidigi[polars]`). Only
+        available with the "sweep" engine, and cannot be combined with return_state,
+        skip_unchanged_snapshots or slim.
 
     Returns
     -------
     DataFrame
         A reshaped DataFrame containing snapshots of entity positions at regular time intervals,
-        sorted by minute and event.
+        sorted by minute and event (and first by run, if run_col_name is provided).
+        If `return_state` is True, a tuple of this DataFrame and a ReshapeState is returned instead.
+        If `backend` is "polars", this is a polars DataFrame.
 
     Notes
     -----
@@ -63,202 +1427,1881 @@ def reshape_for_animations(event_log,
     - A maximum number of patients per event can be set to limit the number of entities who will be
       displayed on screen within any one event type at a time.
     - An 'exit' event is added for each entity at the end of their journey.
+    - Entities may leave and come back: each arrival and the depart that follows it is treated
+      as a separate stay, and the entity is absent from snapshots taken between stays.
     - The function uses memory management techniques (del and gc.collect()) to handle large datasets.
+    - With skip_unchanged_snapshots, the time between consecutive snapshots is no longer
+      constant, so animations will pass through quiet periods faster than busy ones.
+    - Snapshots are always taken at multiples of every_x_time_units, so a window gives the same
+      snapshots as the full output between window_start and window_end. The output has the
+      same rows, although columns that only apply outside the window (such as 'additional') may
+      be missing. The one exception is an entity still present after window_end that
+      step_snapshot_max hides from some snapshot within the window onwards, whether or not it
+      ever leaves: the full output gives it an exit step after the last snapshot it is shown in,
+      while a window does not, as finding it would mean ranking the snapshots after the window.
+    - If the time column holds datetimes (datetime64, optionally timezone-aware), snapshots are
+      taken at multiples of every_x_time_units counted from the Unix epoch, starting with the
+      one at or before the first event, so e.g. hourly snapshots fall on the hour. The
+      'snapshot_time' and time columns of the output are datetimes too. Internally, times are
+      counted in whole ticks of the largest duration that divides every_x_time_units and the
+      offset of every event from the first snapshot, so no precision is lost. Cannot be
+      combined with return_state.
+    - The 'sweep' engine's cost grows with the size of the output rather than with the number of
+      snapshots multiplied by the size of the event log.
+    - When n_jobs is not 1, worker processes read the sorted event log from shared memory rather
+      than receiving their own copy. As with any use of multiprocessing, scripts calling this
+      should guard their entry point with `if __name__ == "__main__":` on platforms that start
+      processes by spawning (e.g. Windows and macOS).
+
+    TODO
+    ----
+    - Add behavior for when limit_duration is None.
+    - Implement pathway order and precedence columns.
+    - Fix the automatic exit at the end of the simulation run for all entities.
+    """
+    _check_backend(backend)
+
+    if backend == "polars":
+        if engine != "sweep":
+            raise ValueError("backend='polars' can only be used with the 'sweep' engine.")
+
+        if return_state or skip_unchanged_snapshots or slim:
+            raise ValueError(
+                "return_state, skip_unchanged_snapshots and slim cannot be used with backend='polars'."
+                )
+
+    if pd.api.types.is_datetime64_any_dtype(event_log[time_col_name]):
+        if return_state:
+            raise ValueError("return_state cannot be used when the time column holds datetimes.")
+
+        # The engines work in whole ticks since the first snapshot, and the output is converted
+        # back to datetimes at the end
+        datetime_grid = _DatetimeGrid(event_log[time_col_name], every_x_time_units)
+        event_log = event_log.assign(**{time_col_name: datetime_grid.times()})
+        limit_duration = datetime_grid.limit(limit_duration)
+        every_x_time_units = datetime_grid.duration(every_x_time_units, "every_x_time_units")
+        window_start = datetime_grid.timestamp(window_start, "window_start", round_up=True)
+        window_end = datetime_grid.timestamp(window_end, "window_end")
+        if max_snapshot_gap is not None:
+            max_snapshot_gap = datetime_grid.duration(max_snapshot_gap, "max_snapshot_gap")
+    else:
+        datetime_grid = None
+
+    lifetimes = _entity_lifetimes(
+        event_log,
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_col_name=event_col_name,
+        run_col_name=run_col_name
+        )
+
+    windowed = window_start is not None or window_end is not None
+
+    if windowed:
+        if return_state:
+            raise ValueError("window_start and window_end cannot be used with return_state.")
+
+        window_start = 0 if window_start is None else window_start
+        window_end = limit_duration if window_end is None else window_end
+
+        if window_end < window_start:
+            raise ValueError("window_end must not be before window_start.")
+
+        # Start one snapshot early, so that entities last shown just before the window still
+        # get their exit step at the start of it
+        engine_window_start = window_start - every_x_time_units
+
+        event_log, lifetimes = _event_log_window(
+            event_log,
+            lifetimes,
+            window_start=engine_window_start,
+            window_end=window_end,
+            time_col_name=time_col_name,
+            entity_col_name=entity_col_name,
+            run_col_name=run_col_name
+            )
+
+        if debug_mode:
+            print(f'Event log cut down to window at {time.strftime("%H:%M:%S", time.localtime())}')
+    else:
+        engine_window_start = None
+
+    if backend == "polars":
+        # Rows are taken from this copy by position, so keep the index as a column in the
+        # same way as the sweep engine does
+        polars_log = _import_polars().from_pandas(event_log.reset_index(drop=False))
+    else:
+        polars_log = None
+
+    #TODO: Add in behaviour for if limit_duration is None
+
+    if return_state and limit_duration % every_x_time_units != 0:
+        raise ValueError("limit_duration must be a multiple of every_x_time_units when return_state is True.")
+
+    if return_state and skip_unchanged_snapshots:
+        raise ValueError("skip_unchanged_snapshots cannot be used with return_state.")
+
+    if return_state and run_col_name is not None:
+        raise ValueError("run_col_name cannot be used with return_state.")
+
+    if return_state and slim:
+        raise ValueError("slim cannot be used with return_state.")
+
+    if max_snapshot_gap is not None and max_snapshot_gap < every_x_time_units:
+        raise ValueError("max_snapshot_gap must be at least every_x_time_units.")
+
+    if slim:
+        # The entity lifetimes have already been found, so the snapshots only need the columns
+        # used to place and label entities
+        event_log = _slim_dataframe(
+            event_log,
+            columns=[time_col_name, entity_col_name, event_type_col_name, event_col_name,
+                     pathway_col_name, run_col_name, resource_col_name]
+            )
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    elif n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer, or -1 to use all CPUs.")
+
+    if engine == "sweep":
+        reshape_engine_kwargs = {
+            "n_jobs": n_jobs, "polars_log": polars_log, "changing_only": skip_unchanged_snapshots
+            }
+        reshape_engine = _reshape_sweep
+    elif engine == "loop":
+        reshape_engine_kwargs = {}
+        reshape_engine = _reshape_loop
+    else:
+        raise ValueError(f"Invalid engine '{engine}'. Valid options are: 'sweep', 'loop'.")
+
+    full_entity_df = reshape_engine(
+        event_log,
+        lifetimes,
+        every_x_time_units=every_x_time_units,
+        limit_duration=limit_duration,
+        step_snapshot_max=step_snapshot_max,
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_type_col_name=event_type_col_name,
+        event_col_name=event_col_name,
+        cap_resource_use=cap_resource_use,
+        run_col_name=run_col_name,
+        debug_mode=debug_mode,
+        window_start=engine_window_start,
+        window_end=window_end,
+        **reshape_engine_kwargs
+        )
+
+    if debug_mode:
+        print(f'Snapshot df concatenation complete at {time.strftime("%H:%M:%S", time.localtime())}')
+
+    if entity_col_name not in full_entity_df.columns:
+        # Nobody was present in any snapshot (e.g. a window before the first arrival), so only
+        # empty snapshots were taken; give them the columns of the event log all the same,
+        # after the snapshot columns as when the first snapshot is empty
+        missing_cols = [
+            col for col in dict.fromkeys(['index', *event_log.columns, 'rank'])
+            if col not in full_entity_df.columns
+            ]
+        if backend == "polars":
+            pl = _import_polars()
+            full_entity_df = full_entity_df.with_columns(
+                pl.lit(None, dtype=polars_log.schema.get(col, pl.Float64)).alias(col)
+                for col in missing_cols
+                )
+        else:
+            full_entity_df = full_entity_df.assign(**{
+                col: (event_log[col] if col in event_log.columns else pd.Series(dtype=float))
+                .iloc[:0].reindex(full_entity_df.index)
+                for col in missing_cols
+                })
+
+    if backend == "polars":
+        full_entity_df = _finish_reshape_polars(
+            full_entity_df,
+            lifetimes,
+            every_x_time_units=every_x_time_units,
+            limit_duration=limit_duration,
+            entity_col_name=entity_col_name,
+            event_col_name=event_col_name,
+            run_col_name=run_col_name,
+            window_start=window_start,
+            window_end=window_end
+            )
+
+        if datetime_grid is not None:
+            full_entity_df = datetime_grid.restore(full_entity_df, time_col_name)
+
+        return full_entity_df
+
+    if return_state:
+        reshape_state = _build_reshape_state(
+            event_log,
+            lifetimes,
+            full_entity_df,
+            limit_duration=limit_duration,
+            reshape_kwargs={
+                "every_x_time_units": every_x_time_units,
+                "step_snapshot_max": step_snapshot_max,
+                "time_col_name": time_col_name,
+                "entity_col_name": entity_col_name,
+                "event_type_col_name": event_type_col_name,
+                "event_col_name": event_col_name,
+                "pathway_col_name": pathway_col_name,
+                "cap_resource_use": cap_resource_use
+            }
+            )
+
+    # Add a final exit step for each client
+
+    # This is helpful as it ensures all patients are visually seen to exit rather than
+    # just disappearing after their final step
+
+    # It makes it easier to track the split of people going on to an optional step when
+    # this step is at the end of the pathway
+
+    # First, get the last step for every single person
+    # (in every run, if there are multiple runs)
+    entity_keys = [entity_col_name] if run_col_name is None else [run_col_name, entity_col_name]
+    final_step = (
+        full_entity_df
+        .sort_values([*entity_keys, 'snapshot_time'], ascending=True)
+        .groupby(entity_keys, observed=True)
+        .tail(1)
+        .copy()
+    )
+
+    # Propose their 'exit' time
+    final_step['snapshot_time'] = final_step['snapshot_time'] + every_x_time_units
+    final_step[event_col_name] = "depart"
+
+    # Only keep rows for people whose exit step will happen *before* the simulation end
+    final_step = final_step[final_step["snapshot_time"] <= (limit_duration)]
+
+    if windowed:
+        # Entities shown again after the window, whether still present or coming back, do not
+        # leave at their last step within it
+        continuing = _continuing_after_window(
+            lifetimes, every_x_time_units, limit_duration, window_end, entity_keys
+            )
+        final_step = final_step[
+            ~pd.MultiIndex.from_frame(final_step[entity_keys]).isin(
+                pd.MultiIndex.from_frame(continuing[entity_keys])
+                )
+            ]
+
+    full_entity_df = pd.concat([full_entity_df, final_step], ignore_index=True)
+
+    del final_step
+    gc.collect()
+
+    if windowed:
+        full_entity_df = full_entity_df[
+            (full_entity_df['snapshot_time'] >= window_start) &
+            (full_entity_df['snapshot_time'] <= window_end)
+            ]
+
+    if slim:
+        full_entity_df = _slim_dataframe(full_entity_df.drop(columns='index', errors='ignore'))
+
+    sort_keys = ['snapshot_time', event_col_name] if run_col_name is None else [run_col_name, 'snapshot_time', event_col_name]
+    full_entity_df = full_entity_df.sort_values(sort_keys).reset_index(drop=True)
+
+    if skip_unchanged_snapshots:
+        full_entity_df = _skip_unchanged_snapshots(
+            full_entity_df,
+            every_x_time_units,
+            max_snapshot_gap=max_snapshot_gap,
+            run_col_name=run_col_name
+            )
+
+        if debug_mode:
+            print(f'Unchanged snapshots removed at {time.strftime("%H:%M:%S", time.localtime())}')
+
+    if datetime_grid is not None:
+        full_entity_df = datetime_grid.restore(full_entity_df, time_col_name)
+
+    if return_state:
+        return full_entity_df, reshape_state
+
+    return full_entity_df
+
+def iter_snapshots(event_log,
+                   every_x_time_units=10,
+                   limit_duration=10*60*24,
+                   step_snapshot_max=50,
+                   time_col_name="time",
+                   entity_col_name="entity_id",
+                   event_type_col_name="event_type",
+                   event_col_name="event",
+                   pathway_col_name=None,
+                   cap_resource_use=False,
+                   snapshots_per_batch=1,
+                   debug_mode=False):
+    """
+    Lazily generate the snapshots produced by reshape_for_animations(), a batch at a time.
+
+    Rather than building one dataframe covering every snapshot, this yields a small dataframe
+    for each batch of consecutive snapshots, in time order. Memory use is therefore bounded by
+    the size of one batch rather than the length of the simulation, so downstream consumers
+    (e.g. frame builders or file writers) can process arbitrarily long runs.
+
+    Parameters
+    ----------
+    event_log : pd.DataFrame
+        The input event log containing entity events and timestamps in the form of a number of time
+        units since the simulation began, or as datetimes (see reshape_for_animations()).
+    every_x_time_units : int, optional
+        The time interval between snapshots in preferred time units (default is 10). A timedelta
+        if the time column holds datetimes.
+    limit_duration : int, optional
+        The maximum duration to consider in preferred time units (default is 10 days). A
+        timedelta or datetime if the time column holds datetimes.
+    step_snapshot_max : int, optional
+        The maximum number of entities to include in each snapshot for each event (default is 50).
+    time_col_name : str, default="time"
+        Name of the column in `event_log` that contains the timestamp of each event.
+        Timestamps should represent the number of time units since the simulation began.
+    entity_col_name : str, default="entity_id"
+        Name of the column in `event_log` that contains the unique identifier for each entity
+        (e.g., "entity_id", "entity", "patient", "patient_id", "customer", "ID").
+    event_type_col_name : str, default="event_type"
+        Name of the column in `event_log` that specifies the category of the event.
+        Supported event types include 'arrival_departure', 'resource_use',
+        'resource_use_end', and 'queue'.
+    event_col_name : str, default="event"
+        Name of the column in `event_log` that specifies the actual event that occurred.
+    pathway_col_name : str, optional, default=None
+        Name of the column in `event_log` that identifies the specific pathway or
+        process flow the entity is following. If `None`, it is assumed that pathway
+        information is not present.
+    cap_resource_use : bool, optional
+        If True, 'resource_use' and 'resource_use_end' events are also limited to
+        step_snapshot_max entities per snapshot (default is False).
+    snapshots_per_batch : int, optional
+        The number of consecutive snapshots to include in each yielded dataframe (default is 1).
+    debug_mode : bool, optional
+        If True, print debug information during processing (default is False).
+
+    Yields
+    ------
+    pd.DataFrame
+        The rows of reshape_for_animations() for the next batch of snapshots, sorted by
+        snapshot time and event.
+
+    Notes
+    -----
+    - Concatenating every yielded dataframe gives the same rows, in the same order, as
+      reshape_for_animations(). The only difference is in the columns: every batch has the same
+      columns in the same order, so an 'additional' column is always present, even if the
+      step_snapshot_max limit is never reached.
+    - Each entity's final 'depart' step is included in the batch containing the snapshot it
+      belongs to. Working out which snapshot an entity is last shown in requires an initial
+      pass over the snapshots, so the generator does roughly twice the work of a single call
+      to reshape_for_animations(), in exchange for much lower memory use.
+    """
+    if snapshots_per_batch < 1:
+        raise ValueError("snapshots_per_batch must be at least 1.")
+
+    if pd.api.types.is_datetime64_any_dtype(event_log[time_col_name]):
+        datetime_grid = _DatetimeGrid(event_log[time_col_name], every_x_time_units)
+        event_log = event_log.assign(**{time_col_name: datetime_grid.times()})
+        limit_duration = datetime_grid.limit(limit_duration)
+        every_x_time_units = datetime_grid.duration(every_x_time_units, "every_x_time_units")
+    else:
+        datetime_grid = None
+
+    snapshot_times = np.arange(0, limit_duration + every_x_time_units, every_x_time_units)
+
+    sweep = _SnapshotSweep(
+        event_log,
+        _entity_lifetimes(
+            event_log,
+            time_col_name=time_col_name,
+            entity_col_name=entity_col_name,
+            event_col_name=event_col_name
+            ),
+        snapshot_times=snapshot_times,
+        step_snapshot_max=step_snapshot_max,
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_type_col_name=event_type_col_name,
+        event_col_name=event_col_name,
+        cap_resource_use=cap_resource_use
+        )
+
+    # First pass - find the last snapshot each entity is shown in, as this is where their
+    # final exit step is added
+    last_shown = np.full(sweep.entity_count, -1)
+    for _, _, rows, snapshot_idx, _, _ in sweep.iter_snapshot_rows(snapshots_per_batch):
+        np.maximum.at(last_shown, sweep.entity_codes[rows], snapshot_idx)
+
+    # Only keep exit steps that will happen *before* the simulation end
+    departs_in_time = snapshot_times + every_x_time_units <= limit_duration
+
+    if debug_mode:
+        print(f'Final snapshot for each entity found at {time.strftime("%H:%M:%S", time.localtime())}')
+
+    columns = list(sweep.event_log.columns) + ['rank', 'snapshot_time', 'additional']
+    carried_exits = None
+
+    for first, last, rows, snapshot_idx, rank, additional in sweep.iter_snapshot_rows(snapshots_per_batch):
+        is_exit = (
+            (last_shown[sweep.entity_codes[rows]] == snapshot_idx) &
+            departs_in_time[snapshot_idx]
+            )
+
+        # Exit steps belong to the following snapshot, which may be in the next batch
+        exits_this_batch = is_exit & (snapshot_idx + 1 < last)
+        exit_rows = [(rows[exits_this_batch], snapshot_idx[exits_this_batch],
+                      rank[exits_this_batch], additional[exits_this_batch])]
+        if carried_exits is not None:
+            exit_rows.insert(0, carried_exits)
+        carry = is_exit & (snapshot_idx + 1 == last)
+        carried_exits = (rows[carry], snapshot_idx[carry], rank[carry], additional[carry])
+
+        exit_rows = [np.concatenate(arrays) for arrays in zip(*exit_rows)]
+        # Exit steps are ordered by entity, as they are in reshape_for_animations()
+        exit_order = np.argsort(sweep.entity_codes[exit_rows[0]], kind='stable')
+        exit_df = sweep.to_dataframe(*[array[exit_order] for array in exit_rows])
+        exit_df['snapshot_time'] = exit_df['snapshot_time'] + every_x_time_units
+        exit_df[event_col_name] = "depart"
+
+        present = np.zeros(last - first, dtype=bool)
+        present[snapshot_idx - first] = True
+        empty_snapshots = pd.DataFrame({'snapshot_time': snapshot_times[first:last][~present]})
+
+        snapshot_dfs = [
+            df for df in [sweep.to_dataframe(rows, snapshot_idx, rank, additional),
+                          empty_snapshots,
+                          exit_df]
+            if len(df) > 0
+        ]
+
+        batch_df = (
+            pd.concat(snapshot_dfs, ignore_index=True)
+            .reindex(columns=columns)
+            .sort_values(['snapshot_time', event_col_name])
+            .reset_index(drop=True)
+        )
+
+        if datetime_grid is not None:
+            batch_df = datetime_grid.restore(batch_df, time_col_name)
+
+        yield batch_df
+
+class ReshapeState:
+    """
+    State saved from reshape_for_animations() that allows its output to be extended when new
+    events arrive, using extend_reshape_for_animations().
+
+    Only the events of entities who are still present at the end of the reshaped period are
+    kept, along with a record of how each entity was last shown, so extending the output does
+    not require the full event history to be reprocessed.
+
+    Attributes
+    ----------
+    limit_duration : int
+        The time the reshaped dataframe currently extends to.
+    reshape_kwargs : dict
+        The column names, snapshot interval and step_snapshot_max used for the reshape. These are
+        reused when the output is extended.
+    open_event_log : pd.DataFrame
+        All events for entities who are still present in the system after `limit_duration`, or
+        who have not yet arrived, with their original index.
+    last_shown : pd.Series
+        The last snapshot time each entity was shown at, indexed by entity. These are used to
+        remove the exit step of any entity shown again, including entities who come back.
+    final_snapshot_rows : pd.DataFrame
+        The rows of the snapshot at `limit_duration`. These are used to add the final exit step
+        for any entity shown in that snapshot who is not shown again.
+    departures_seen : bool
+        Whether the event log has had any 'depart' events so far. Until it has, nobody is
+        shown, as in reshape_for_animations().
+    """
+    def __init__(self,
+                 limit_duration,
+                 reshape_kwargs,
+                 open_event_log,
+                 last_shown,
+                 final_snapshot_rows,
+                 departures_seen):
+        self.limit_duration = limit_duration
+        self.reshape_kwargs = reshape_kwargs
+        self.open_event_log = open_event_log
+        self.last_shown = last_shown
+        self.final_snapshot_rows = final_snapshot_rows
+        self.departures_seen = departures_seen
+
+    def __repr__(self):
+        return (f"ReshapeState(limit_duration={self.limit_duration}, "
+                f"open_entities={self.open_event_log[self.reshape_kwargs['entity_col_name']].nunique()}, "
+                f"open_events={len(self.open_event_log)})")
+
+def _build_reshape_state(event_log,
+                         lifetimes,
+                         snapshot_df,
+                         limit_duration,
+                         reshape_kwargs,
+                         previous_state=None):
+    """
+    Build a ReshapeState from an event log, its entity lifetimes and the snapshot rows (without
+    final exit steps) computed from it up to `limit_duration`.
+
+    When extending a previous state, `event_log` only needs to contain the events of the
+    previous state's open entities plus any new events, and `snapshot_df` only the newly
+    computed snapshots.
+    """
+    entity_col_name = reshape_kwargs["entity_col_name"]
+
+    departures_seen = (event_log[reshape_kwargs["event_col_name"]] == 'depart').any()
+    if previous_state is not None:
+        departures_seen = departures_seen or previous_state.departures_seen
+
+    shown_rows = snapshot_df[snapshot_df[entity_col_name].notnull()]
+    last_shown = shown_rows.groupby(entity_col_name)['snapshot_time'].max()
+    # combine_first() cannot be given an empty series without a warning from pandas
+    if previous_state is not None and len(previous_state.last_shown) > 0:
+        if len(last_shown) == 0:
+            last_shown = previous_state.last_shown
+        else:
+            last_shown = last_shown.combine_first(previous_state.last_shown)
+
+    # An entity is still open if it has not departed by limit_duration, or has not arrived at all
+    open_lifetime = lifetimes['depart'].isnull() | (lifetimes['depart'] > limit_duration)
+
+    entities = event_log[entity_col_name]
+    open_entities = (
+        entities.isin(lifetimes.loc[open_lifetime, entity_col_name]) |
+        ~entities.isin(lifetimes[entity_col_name])
+        )
+    open_event_log = event_log[open_entities]
+
+    # Entities who have left can come back for a new stay, which only needs their new events,
+    # so only when they were last shown is kept for them
+    return ReshapeState(
+        limit_duration=limit_duration,
+        reshape_kwargs=reshape_kwargs,
+        open_event_log=open_event_log,
+        last_shown=last_shown,
+        final_snapshot_rows=shown_rows[shown_rows['snapshot_time'] == limit_duration],
+        departures_seen=bool(departures_seen)
+    )
+
+def extend_reshape_for_animations(full_entity_df,
+                                  reshape_state,
+                                  new_event_log,
+                                  limit_duration,
+                                  debug_mode=False):
+    """
+    Extend the output of reshape_for_animations() with newly arrived events.
+
+    Only the snapshots after the previously reshaped period are computed, using the events of
+    entities who were still present at the end of that period plus the new events, so the cost
+    scales with the size of the new data rather than the full history. Final 'depart' exit steps
+    are corrected for any entity whose journey continues into the new period.
+
+    Parameters
+    ----------
+    full_entity_df : pd.DataFrame
+        The previously reshaped dataframe, as returned by reshape_for_animations() or a previous
+        call to this function.
+    reshape_state : ReshapeState
+        The state returned alongside `full_entity_df`.
+    new_event_log : pd.DataFrame
+        The new events, in the same format as the original event log. Every event must occur
+        after the previous `limit_duration`. Entities who have already departed may come back,
+        with a new 'arrival' starting a new stay. If the original event log had a meaningful
+        index, the new events should carry on from it, as the index is used to order entities
+        within each event.
+    limit_duration : int
+        The new maximum duration to consider in preferred time units. Must be greater than the
+        previous limit_duration and a multiple of every_x_time_units.
+    debug_mode : bool, optional
+        If True, print debug information during processing (default is False).
+
+    Returns
+    -------
+    tuple
+        The extended dataframe and a new ReshapeState that can be used to extend it again.
+        The dataframe is identical to calling reshape_for_animations() on the combined event log
+        with the new `limit_duration`, provided the events first passed to
+        reshape_for_animations() included a 'depart' event. Otherwise, the snapshots reshaped
+        before the first 'depart' event was passed in show nobody, and are not redrawn (see
+        Notes).
+
+    Raises
+    ------
+    ValueError
+        If `limit_duration` is not a multiple of every_x_time_units or does not extend the
+        previous limit, or if any new event occurs before the previous limit.
+
+    Notes
+    -----
+    - Use `reshape_for_animations(..., return_state=True)` to obtain the initial state.
+    - The previous dataframe is copied once when the new rows are appended, but none of its
+      snapshots are recomputed. In particular, if the event log had no 'depart' events at all
+      up to the previous limit, nobody was shown in its snapshots, and they are not redrawn
+      once departures arrive.
+    """
+    state = reshape_state
+    reshape_kwargs = state.reshape_kwargs
+    every_x_time_units = reshape_kwargs["every_x_time_units"]
+    time_col_name = reshape_kwargs["time_col_name"]
+    entity_col_name = reshape_kwargs["entity_col_name"]
+    event_col_name = reshape_kwargs["event_col_name"]
+
+    if limit_duration <= state.limit_duration or limit_duration % every_x_time_units != 0:
+        raise ValueError(
+            f"limit_duration must be greater than the previous limit ({state.limit_duration}) "
+            f"and a multiple of every_x_time_units ({every_x_time_units})."
+            )
+
+    if (new_event_log[time_col_name] <= state.limit_duration).any():
+        raise ValueError(
+            f"All new events must occur after the previous limit_duration ({state.limit_duration})."
+            )
+
+    event_log = pd.concat([state.open_event_log, new_event_log])
+    # Departures dropped with the entities who have left still count, so that those present are
+    # shown even when none of them has left yet
+    lifetimes = _entity_lifetimes(
+        event_log,
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_col_name=event_col_name,
+        departures_seen=state.departures_seen
+        )
+
+    snapshot_times = np.arange(0, limit_duration + every_x_time_units, every_x_time_units)
+    first_new = np.searchsorted(snapshot_times, state.limit_duration, side='right')
+
+    sweep = _SnapshotSweep(
+        event_log,
+        lifetimes,
+        snapshot_times=snapshot_times,
+        step_snapshot_max=reshape_kwargs["step_snapshot_max"],
+        time_col_name=time_col_name,
+        entity_col_name=entity_col_name,
+        event_type_col_name=reshape_kwargs["event_type_col_name"],
+        event_col_name=event_col_name,
+        cap_resource_use=reshape_kwargs["cap_resource_use"]
+        )
+
+    rows, snapshot_idx, rank, additional = sweep.snapshot_rows(first_new, len(snapshot_times))
+
+    if debug_mode:
+        print(f'New snapshots computed at {time.strftime("%H:%M:%S", time.localtime())}')
+
+    snapshot_df = sweep.to_dataframe(rows, snapshot_idx, rank, additional)
+
+    present = np.zeros(len(snapshot_times), dtype=bool)
+    present[snapshot_idx] = True
+    empty_snapshots = pd.DataFrame({'snapshot_time': snapshot_times[first_new:][~present[first_new:]]})
+
+    ################################################################################
+    # Final exit steps
+    ################################################################################
+    last_new = np.full(sweep.entity_count, -1)
+    np.maximum.at(last_new, sweep.entity_codes[rows], snapshot_idx)
+    is_exit = (last_new[sweep.entity_codes[rows]] == snapshot_idx) & (snapshot_idx + 1 < len(snapshot_times))
+
+    shown_entities = snapshot_df[entity_col_name]
+    final_snapshot_rows = state.final_snapshot_rows
+    exit_steps = pd.concat(
+        [
+            # Entities last shown in one of the new snapshots
+            snapshot_df[is_exit],
+            # Entities last shown in the final snapshot of the previous period, whose exit step
+            # would previously have fallen after the limit
+            final_snapshot_rows[~final_snapshot_rows[entity_col_name].isin(shown_entities)]
+        ],
+        ignore_index=True
+        ).sort_values(entity_col_name, kind='stable')
+    exit_steps['snapshot_time'] = exit_steps['snapshot_time'] + every_x_time_units
+    exit_steps[event_col_name] = "depart"
+
+    snapshot_dfs = [df for df in [snapshot_df, empty_snapshots, exit_steps] if len(df) > 0]
+    if len(snapshot_dfs) > 0:
+        new_rows = pd.concat(snapshot_dfs, ignore_index=True)
+    else:
+        new_rows = pd.DataFrame(columns=['snapshot_time'])
+    # Nobody may be shown in the new snapshots, leaving them without the event log's columns
+    new_rows = new_rows.reindex(columns=new_rows.columns.union(full_entity_df.columns, sort=False))
+    new_rows = new_rows.sort_values(['snapshot_time', event_col_name])
+
+    if 'additional' not in full_entity_df.columns and new_rows['additional'].isna().all():
+        new_rows = new_rows.drop(columns='additional')
+
+    # Entities shown again in the new period no longer exit where they previously did
+    last_shown = state.last_shown
+    superseded_exits = last_shown[
+        last_shown.index.isin(shown_entities) &
+        (last_shown + every_x_time_units <= state.limit_duration)
+        ]
+    previous_rows = full_entity_df
+    if len(superseded_exits) > 0:
+        superseded = (
+            (previous_rows[event_col_name] == "depart") &
+            pd.MultiIndex.from_frame(previous_rows[[entity_col_name, 'snapshot_time']]).isin(
+                pd.MultiIndex.from_arrays(
+                    [superseded_exits.index, superseded_exits + every_x_time_units]
+                    )
+                )
+            )
+        previous_rows = previous_rows[~superseded]
+
+    full_entity_df = pd.concat([previous_rows, new_rows], ignore_index=True)
+
+    new_state = _build_reshape_state(
+        event_log,
+        lifetimes,
+        snapshot_df,
+        limit_duration=limit_duration,
+        reshape_kwargs=reshape_kwargs,
+        previous_state=state
+        )
+
+    return full_entity_df, new_state
+
+class SnapshotCube:
+    """
+    Compact, array-backed alternative to the dataframe returned by reshape_for_animations().
+
+    In the reshaped dataframe, an entity's full row is repeated in every snapshot it appears
+    in, even when nothing about it has changed. A SnapshotCube instead stores each distinct row
+    (excluding 'snapshot_time', 'rank' and 'additional') once, and represents every snapshot as
+    a list of (row code, rank, additional) entries. Most snapshots are stored as a delta to the
+    previous snapshot, listing only the entries removed and added, with a full keyframe stored
+    at regular intervals so any snapshot can be decoded without replaying the whole animation.
+
+    Use SnapshotCube.from_dataframe() to compress an existing reshaped dataframe, or
+    SnapshotCube.from_event_log() to build one directly from an event log a batch of snapshots
+    at a time, without the full reshaped dataframe ever being held in memory.
+    to_dataframe() recovers the original dataframe, and generate_animation_df() accepts a
+    SnapshotCube in place of a dataframe.
+
+    Attributes
+    ----------
+    base_rows : pd.DataFrame
+        Each distinct row of the reshaped dataframe, excluding the snapshot columns.
+    snapshot_times : np.ndarray
+        The time of each snapshot, in the order they appear in the reshaped dataframe.
+    snapshot_sizes : np.ndarray
+        The number of rows in each snapshot.
+    keyframe_interval : int
+        The maximum number of snapshots between stored keyframes.
+    """
+    snapshot_columns = ['rank', 'snapshot_time', 'additional']
+
+    def __init__(self, keyframe_interval=50):
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1.")
+
+        self.keyframe_interval = keyframe_interval
+        self.columns = None
+        self.base_rows = None
+        self.snapshot_times = np.array([])
+        self.snapshot_sizes = np.array([], dtype=np.int64)
+
+        self._base_row_hashes = pd.Index([], dtype=np.uint64)
+        self._snapshot_time_dtype = None
+        self._state = None
+        self._parts = {name: [] for name in [
+            'snapshot_times', 'snapshot_sizes', 'is_keyframe', 'entry_counts', 'removed_counts',
+            'codes', 'rank', 'additional', 'insert_positions', 'removed_positions'
+            ]}
+
+    @classmethod
+    def from_dataframe(cls, full_entity_df, keyframe_interval=50):
+        """
+        Compress a dataframe returned by reshape_for_animations().
+
+        Parameters
+        ----------
+        full_entity_df : pd.DataFrame
+            Output of reshape_for_animations(). Rows belonging to the same snapshot must be
+            consecutive, as they are in the output of that function.
+        keyframe_interval : int, optional
+            The maximum number of snapshots between stored keyframes (default is 50). Smaller
+            values make decoding individual snapshots faster at the cost of memory.
+
+        Returns
+        -------
+        SnapshotCube
+        """
+        return cls.from_batches([full_entity_df], keyframe_interval=keyframe_interval)
+
+    @classmethod
+    def from_batches(cls, batches, keyframe_interval=50):
+        """
+        Build a SnapshotCube from an iterable of reshaped dataframes, each containing one or more
+        complete snapshots, such as the output of iter_snapshots().
+
+        Parameters
+        ----------
+        batches : iterable of pd.DataFrame
+            Consecutive parts of a reshaped dataframe.
+        keyframe_interval : int, optional
+            The maximum number of snapshots between stored keyframes (default is 50).
+
+        Returns
+        -------
+        SnapshotCube
+        """
+        cube = cls(keyframe_interval=keyframe_interval)
+        for batch in batches:
+            cube._append(batch)
+        cube._finish()
+        return cube
+
+    @classmethod
+    def from_event_log(cls, event_log, keyframe_interval=50, snapshots_per_batch=100, **reshape_kwargs):
+        """
+        Reshape an event log directly into a SnapshotCube.
+
+        Snapshots are computed with iter_snapshots() and compressed one batch at a time, so
+        memory use is bounded by the size of the cube plus a single batch.
+
+        Parameters
+        ----------
+        event_log : pd.DataFrame
+            The input event log, as passed to reshape_for_animations().
+        keyframe_interval : int, optional
+            The maximum number of snapshots between stored keyframes (default is 50).
+        snapshots_per_batch : int, optional
+            The number of snapshots to compute and compress at a time (default is 100).
+        **reshape_kwargs
+            Any other arguments accepted by iter_snapshots(), such as every_x_time_units,
+            limit_duration, step_snapshot_max or the column names.
+
+        Returns
+        -------
+        SnapshotCube
+        """
+        return cls.from_batches(
+            iter_snapshots(event_log, snapshots_per_batch=snapshots_per_batch, **reshape_kwargs),
+            keyframe_interval=keyframe_interval
+            )
+
+    def __len__(self):
+        return len(self.snapshot_times)
+
+    def __repr__(self):
+        return (f"SnapshotCube(snapshots={len(self)}, rows={int(self.snapshot_sizes.sum())}, "
+                f"distinct_rows={0 if self.base_rows is None else len(self.base_rows)}, "
+                f"keyframes={int(self._is_keyframe.sum()) if len(self) > 0 else 0})")
+
+    @property
+    def nbytes(self):
+        """
+        Approximate number of bytes used by the cube, including its table of distinct rows.
+        """
+        array_bytes = sum(
+            array.nbytes for array in [
+                self.snapshot_times, self.snapshot_sizes, self._is_keyframe, self._entry_offsets,
+                self._removed_offsets, self._codes, self._rank, self._additional,
+                self._insert_positions, self._removed_positions
+                ]
+            )
+        base_row_bytes = 0 if self.base_rows is None else self.base_rows.memory_usage(deep=True).sum()
+        return int(array_bytes + base_row_bytes)
+
+    ################################################################################
+    # Encoding
+    ################################################################################
+    def _append(self, batch):
+        if len(batch) == 0:
+            return
+
+        if self.columns is None:
+            self.columns = list(batch.columns)
+            self._base_columns = [col for col in self.columns if col not in self.snapshot_columns]
+            self._has_column = {col: col in batch.columns for col in self.snapshot_columns}
+            self._snapshot_time_dtype = batch['snapshot_time'].dtype
+            self._rank_dtype = batch['rank'].dtype if 'rank' in batch.columns else None
+            self._additional_dtype = batch['additional'].dtype if 'additional' in batch.columns else None
+        batch = batch.reindex(columns=self.columns)
+
+        # Give each distinct base row a code, adding any not seen in earlier batches
+        base_rows = batch[self._base_columns]
+        row_hashes = pd.util.hash_pandas_object(base_rows, index=False).to_numpy()
+        codes = self._base_row_hashes.get_indexer(row_hashes)
+        new_rows = codes < 0
+        if new_rows.any():
+            new_hashes, first_new = np.unique(row_hashes[new_rows], return_index=True)
+            new_positions = np.flatnonzero(new_rows)[first_new]
+            new_order = np.argsort(new_positions, kind='stable')
+            new_hashes, new_positions = new_hashes[new_order], new_positions[new_order]
+            self._base_row_hashes = self._base_row_hashes.append(pd.Index(new_hashes))
+            self.base_rows = pd.concat(
+                [self.base_rows, base_rows.iloc[new_positions]], ignore_index=True
+                ) if self.base_rows is not None else base_rows.iloc[new_positions].reset_index(drop=True)
+            codes = self._base_row_hashes.get_indexer(row_hashes)
+
+        codes = codes.astype(np.int32)
+        rank = (batch['rank'] if self._has_column['rank'] else pd.Series(np.nan, index=batch.index)).to_numpy(dtype=np.float32)
+        additional = (batch['additional'] if self._has_column['additional'] else pd.Series(np.nan, index=batch.index)).to_numpy(dtype=np.float32)
+        entry_hashes = pd.util.hash_pandas_object(
+            pd.DataFrame({'code': codes, 'rank': rank, 'additional': additional}), index=False
+            ).to_numpy()
+
+        snapshot_times = batch['snapshot_time'].to_numpy()
+        new_snapshot = np.ones(len(batch), dtype=bool)
+        new_snapshot[1:] = snapshot_times[1:] != snapshot_times[:-1]
+        starts = np.flatnonzero(new_snapshot)
+        ends = np.append(starts[1:], len(batch))
+
+        for start, end in zip(starts, ends):
+            self._add_snapshot(
+                snapshot_times[start], codes[start:end], rank[start:end],
+                additional[start:end], entry_hashes[start:end]
+                )
+
+    def _add_snapshot(self, snapshot_time, codes, rank, additional, entry_hashes):
+        parts = self._parts
+        snapshot_count = len(parts['snapshot_times'])
+        parts['snapshot_times'].append(snapshot_time)
+        parts['snapshot_sizes'].append(len(codes))
+
+        delta = None
+        if self._state is not None and snapshot_count % self.keyframe_interval != 0:
+            delta = self._compute_delta(self._state, codes, rank, additional, entry_hashes)
+
+        if delta is None:
+            parts['is_keyframe'].append(True)
+            parts['entry_counts'].append(len(codes))
+            parts['removed_counts'].append(0)
+            parts['codes'].append(codes)
+            parts['rank'].append(rank)
+            parts['additional'].append(additional)
+            parts['insert_positions'].append(np.arange(len(codes), dtype=np.int32))
+        else:
+            removed_positions, insert_positions, added = delta
+            parts['is_keyframe'].append(False)
+            parts['entry_counts'].append(len(added))
+            parts['removed_counts'].append(len(removed_positions))
+            parts['codes'].append(codes[added])
+            parts['rank'].append(rank[added])
+            parts['additional'].append(additional[added])
+            parts['insert_positions'].append(insert_positions)
+            parts['removed_positions'].append(removed_positions)
+
+        self._state = (codes, rank, additional, entry_hashes)
+
+    @staticmethod
+    def _compute_delta(previous_state, codes, rank, additional, entry_hashes):
+        """
+        Work out the entries to remove from the previous snapshot and insert into it to give
+        this snapshot. Returns None if the snapshot cannot be stored as a delta (e.g. because
+        entries kept from the previous snapshot have changed order), in which case it is stored
+        as a keyframe instead.
+        """
+        previous_codes, previous_rank, previous_additional, previous_hashes = previous_state
+
+        kept_previous = np.isin(previous_hashes, entry_hashes)
+        kept_current = np.isin(entry_hashes, previous_hashes)
+        if not np.array_equal(previous_hashes[kept_previous], entry_hashes[kept_current]):
+            return None
+
+        removed_positions = np.flatnonzero(~kept_previous).astype(np.int32)
+        added = np.flatnonzero(~kept_current)
+        insert_positions = (added - np.arange(len(added))).astype(np.int32)
+
+        # Check the delta reproduces the snapshot exactly before relying on it
+        decoded = SnapshotCube._apply_delta(
+            (previous_codes, previous_rank, previous_additional),
+            removed_positions, insert_positions,
+            (codes[added], rank[added], additional[added])
+            )
+        if not (
+            np.array_equal(decoded[0], codes) and
+            np.array_equal(decoded[1], rank, equal_nan=True) and
+            np.array_equal(decoded[2], additional, equal_nan=True)
+            ):
+            return None
+
+        return removed_positions, insert_positions, added
+
+    @staticmethod
+    def _apply_delta(previous_entries, removed_positions, insert_positions, added_entries):
+        return tuple(
+            np.insert(np.delete(previous, removed_positions), insert_positions, added)
+            for previous, added in zip(previous_entries, added_entries)
+            )
 
-    TODO
-    ----
-    - Add behavior for when limit_duration is None.
-    - Consider adding 'first step' and 'last step' parameters.
-    - Implement pathway order and precedence columns.
-    - Fix the automatic exit at the end of the simulation run for all entities.
-    """
-    entity_dfs = []
+    def _finish(self):
+        parts = self._parts
+        self.snapshot_times = np.array(parts['snapshot_times'], dtype=self._snapshot_time_dtype)
+        self.snapshot_sizes = np.array(parts['snapshot_sizes'], dtype=np.int64)
+        self._is_keyframe = np.array(parts['is_keyframe'], dtype=bool)
+        self._entry_offsets = np.concatenate([[0], np.cumsum(parts['entry_counts'], dtype=np.int64)])
+        self._removed_offsets = np.concatenate([[0], np.cumsum(parts['removed_counts'], dtype=np.int64)])
 
-    if pathway_col_name is not None:
-        pivoted_log = event_log.pivot_table(
-            values=time_col_name,
-            index=[
-                entity_col_name,
-                event_type_col_name,
-                pathway_col_name
-                ],
-                columns=event_col_name
-            ).reset_index()
+        def join(name, dtype):
+            return np.concatenate(parts[name]).astype(dtype) if len(parts[name]) > 0 else np.array([], dtype=dtype)
 
-    else:
-        pivoted_log = event_log.pivot_table(
-            values=time_col_name,
-            index=[
-                entity_col_name,
-                event_type_col_name
-                ],
-                columns=event_col_name
-            ).reset_index()
+        self._codes = join('codes', np.int32)
+        self._rank = join('rank', np.float32)
+        self._additional = join('additional', np.float32)
+        self._insert_positions = join('insert_positions', np.int32)
+        self._removed_positions = join('removed_positions', np.int32)
 
-    #TODO: Add in behaviour for if limit_duration is None
+        del self._parts, self._state, self._base_row_hashes
 
     ################################################################################
-    # Iterate through every matching minute
-    # and generate snapshot df of position of any entities present at that moment
+    # Decoding
     ################################################################################
-    # Note that we want to do this for everything up to AND INCLUDING the duration
-    for time_unit in range(limit_duration+every_x_time_units):
-        # print(minute)
-        # Get entities who arrived before the current minute and who left the system after the current minute
-        # (or arrived but didn't reach the point of being seen before the model run ended)
-        # When turning this into a function, think we will want user to pass
-        # 'first step' and 'last step' or something similar
-        # and will want to reshape the event log for this so that it has a clear start/end regardless
-        # of pathway (move all the pathway stuff into a separate column?)
+    def _snapshot_entries(self, snapshot, previous_entries):
+        entries = slice(self._entry_offsets[snapshot], self._entry_offsets[snapshot + 1])
+        added_entries = (self._codes[entries], self._rank[entries], self._additional[entries])
+        if self._is_keyframe[snapshot]:
+            return added_entries
+        removed = slice(self._removed_offsets[snapshot], self._removed_offsets[snapshot + 1])
+        return self._apply_delta(
+            previous_entries, self._removed_positions[removed],
+            self._insert_positions[entries], added_entries
+            )
 
-        # Think we maybe need a pathway order and pathway precedence column
-        # But what about shared elements of each pathway?
-        if time_unit % every_x_time_units == 0:
-            try:
-                # Work out which entities - if any - were present in the simulation at the current time
-                # They will have arrived at or before the minute in question, and they will depart at
-                # or after the minute in question, or never depart during our model run
-                # (which can happen if they arrive towards the end, or there is a bottleneck)
-                current_entities_in_moment = (pivoted_log[
-
-                    (pivoted_log['arrival'] <= time_unit) &
-
-                    (
-                        (pivoted_log['depart'] >= time_unit) |
-                        (pivoted_log['depart'].isnull() )
-                    )]
-                [entity_col_name]
-                .values
+    def _iter_entries(self, first=0, last=None):
+        if last is None:
+            last = len(self)
+        # Start from the last keyframe at or before the first snapshot requested
+        keyframe = np.flatnonzero(self._is_keyframe[:first + 1])[-1] if first < last else first
+        entries = None
+        for snapshot in range(keyframe, last):
+            entries = self._snapshot_entries(snapshot, entries)
+            if snapshot >= first:
+                yield snapshot, entries
+
+    def _entries_to_dataframe(self, snapshot_idx, codes, rank, additional):
+        df = self.base_rows.take(codes).reset_index(drop=True)
+        if self._has_column['rank']:
+            df['rank'] = rank.astype(self._rank_dtype)
+        df['snapshot_time'] = self.snapshot_times[snapshot_idx]
+        if self._has_column['additional']:
+            df['additional'] = additional.astype(self._additional_dtype)
+        return df[self.columns]
+
+    def to_dataframe(self, first=0, last=None):
+        """
+        Decode some or all of the snapshots into the dataframe format returned by
+        reshape_for_animations().
+
+        Parameters
+        ----------
+        first : int, optional
+            Index of the first snapshot to decode (default is 0).
+        last : int, optional
+            Index after the last snapshot to decode (default is the end of the animation).
+
+        Returns
+        -------
+        pd.DataFrame
+            The reshaped dataframe. Decoding every snapshot gives a dataframe identical to the
+            one the cube was built from.
+        """
+        if self.columns is None:
+            return pd.DataFrame(columns=self.snapshot_columns)
+
+        decoded = [
+            (np.full(len(entries[0]), snapshot),) + entries
+            for snapshot, entries in self._iter_entries(first, last)
+            ]
+        if len(decoded) == 0:
+            return self._entries_to_dataframe(
+                np.array([], dtype=np.int64), np.array([], dtype=np.int32),
+                np.array([], dtype=np.float32), np.array([], dtype=np.float32)
                 )
-            except KeyError:
-                current_entities_in_moment = [] # Use an empty list for consistency
 
-            # If we do have any entities, they will have been passed as a list
-            # so now just filter our event log down to the events these entities have been
-            # involved in
-            if len(current_entities_in_moment) > 0:
-                # Grab just those entities from the filtered log (the unpivoted version)
+        return self._entries_to_dataframe(*(np.concatenate(arrays) for arrays in zip(*decoded)))
 
-                # Filter out any events that have taken place after the minute we are interested in
+    def snapshot(self, snapshot):
+        """
+        Decode a single snapshot into a dataframe, starting from the nearest keyframe.
 
-                entity_minute_df = event_log[
-                    (event_log[entity_col_name].isin(current_entities_in_moment)) &
-                    (event_log[time_col_name] <= time_unit)
-                    ]
+        Parameters
+        ----------
+        snapshot : int
+            Index of the snapshot to decode.
 
-                # Each entity can only be in a single place at once
+        Returns
+        -------
+        pd.DataFrame
+        """
+        return self.to_dataframe(first=snapshot, last=snapshot + 1)
 
-                # TODO: Are there instances where this assumption may be broken, and how would we
-                # handle them? e.g. someone who is in a ward but waiting for an x-ray to be read
-                # could need to be represented in both queues simultaneously
+class EntityStateIndex:
+    """
+    Index of the state of every entity over time, built once from an event log.
 
-                # We have filtered out  events that occurred later than the current minute,
-                # so filter out any events then just take the latest event that has
-                # taken place for each entity
-                most_recent_events_time_unit_ungrouped = entity_minute_df \
-                    .reset_index(drop=False) \
-                    .sort_values([time_col_name, 'index'], ascending=True) \
-                    .groupby([entity_col_name]) \
-                    .tail(1)
+    An entity's state at time t is its latest event at or before t, for as long as it is
+    present in the system (between its arrival and departure, as in reshape_for_animations()).
+    The index stores every entity's states as a sorted list of time intervals, so the state of
+    the whole system at any time, or over any period, can be looked up without reshaping the
+    event log into snapshots.
 
-                # Now rank entities within a given event by the order in which they turned up to that event
-                most_recent_events_time_unit_ungrouped['rank'] = most_recent_events_time_unit_ungrouped \
-                              .groupby([event_col_name])['index'] \
-                              .rank(method='first')
+    Lookups take O(log n + k) time, where n is the number of intervals and k is the number
+    returned. To achieve this, the set of intervals open at regularly spaced checkpoints is
+    stored, so only the intervals that start or end between the nearest checkpoint and the
+    requested time need to be checked.
 
-                most_recent_events_time_unit_ungrouped['max'] = (
-                    most_recent_events_time_unit_ungrouped.groupby(event_col_name)['rank'] \
-                    .transform('max')
+    Parameters
+    ----------
+    event_log : pd.DataFrame
+        The input event log, as passed to reshape_for_animations().
+    time_col_name, entity_col_name, event_type_col_name, event_col_name : str, optional
+        Names of the relevant columns in `event_log`.
+    pathway_col_name : str, optional
+        Name of the pathway column, if any (default is None).
+    run_col_name : str, optional
+        Name of the column identifying the run each event belongs to (default is None). If
+        provided, the same entity ID in different runs is treated as a different entity.
+
+    Attributes
+    ----------
+    event_log : pd.DataFrame
+        The event log, with its original index kept as an 'index' column as in the output of
+        reshape_for_animations().
+    intervals : pd.DataFrame
+        One row per state interval, sorted by entity and start time, giving the event log row,
+        entity code, event code, start and end of each interval. Intervals include their start
+        but not their end, except that an entity is still present at the moment it departs.
+    checkpoint_interval : int
+        The number of interval starts and ends between stored checkpoints.
+    """
+    # Smallest number of interval starts and ends between checkpoints
+    min_checkpoint_interval = 32
+
+    def __init__(self,
+                 event_log,
+                 time_col_name="time",
+                 entity_col_name="entity_id",
+                 event_type_col_name="event_type",
+                 event_col_name="event",
+                 pathway_col_name=None,
+                 run_col_name=None):
+        self.time_col_name = time_col_name
+        self.entity_col_name = entity_col_name
+        self.event_col_name = event_col_name
+        self.run_col_name = run_col_name
+
+        self.event_log = event_log.reset_index(drop=False)
+
+        lifetimes = _entity_lifetimes(
+            event_log,
+            time_col_name=time_col_name,
+            entity_col_name=entity_col_name,
+            event_col_name=event_col_name,
+            run_col_name=run_col_name
+            )
+
+        times = self.event_log[time_col_name].to_numpy(dtype=float)
+        entity_codes, self.entities = _entity_codes(self.event_log, entity_col_name, run_col_name)
+        index_codes = pd.factorize(self.event_log['index'], sort=True)[0]
+        positions = np.arange(len(self.event_log))
+
+        if run_col_name is None:
+            event_codes, self.events = pd.factorize(self.event_log[event_col_name], sort=True)
+        else:
+            event_codes, self.events = pd.factorize(
+                pd.MultiIndex.from_frame(self.event_log[[run_col_name, event_col_name]]), sort=True
+                )
+            event_codes[self.event_log[event_col_name].isnull().to_numpy()] = -1
+
+        # Order events in the same way as the snapshots of reshape_for_animations(), by time
+        # with ties broken by the original index
+        time_order = np.lexsort((positions, index_codes, times))
+        self._time_key = np.empty_like(positions)
+        self._time_key[time_order] = positions
+
+        ################################################################################
+        # Periods in which each entity is present in the system
+        ################################################################################
+        # One period per stay, so entities who leave and come back are absent in between
+        if len(lifetimes) > 0:
+            if run_col_name is None:
+                life_entities = self.entities.get_indexer(lifetimes[entity_col_name])
+            else:
+                life_entities = self.entities.get_indexer(
+                    pd.MultiIndex.from_frame(lifetimes[[run_col_name, entity_col_name]])
                     )
+            life_start = lifetimes['arrival'].to_numpy(dtype=float)
+            # Entities are still present at the moment they depart, so end each period just
+            # after it; entities who never depart remain present indefinitely
+            life_end = np.nextafter(lifetimes['depart'].fillna(np.inf).to_numpy(dtype=float), np.inf)
+            valid_lifetimes = (life_entities >= 0) & (life_start < life_end)
+            life_entities = life_entities[valid_lifetimes]
+            life_start, life_end = life_start[valid_lifetimes], life_end[valid_lifetimes]
+        else:
+            life_entities = np.array([], dtype=np.int64)
+            life_start = np.array([], dtype=float)
+            life_end = np.array([], dtype=float)
+
+        ################################################################################
+        # Periods in which each event is the latest event for its entity
+        ################################################################################
+        valid_events = (entity_codes >= 0) & ~np.isnan(times)
+        event_rows = np.lexsort((positions, index_codes, times, entity_codes))
+        event_rows = event_rows[valid_events[event_rows]]
+
+        event_entities = entity_codes[event_rows]
+        event_times = times[event_rows]
+        next_times = np.append(event_times[1:], np.inf)
+        next_times[:-1][event_entities[1:] != event_entities[:-1]] = np.inf
+
+        # Intersect the two sets of periods in the same way as _SnapshotSweep, replacing each
+        # time with its rank so that every entity can be given its own non-overlapping range
+        all_times = np.unique(np.concatenate([event_times, next_times, life_start, life_end]))
+        stride = len(all_times) + 1
+
+        def global_position(entities, event_times):
+            return entities * stride + np.searchsorted(all_times, event_times)
+
+        life_start = global_position(life_entities, life_start)
+        life_end = global_position(life_entities, life_end)
+
+        # Merge overlapping periods so each entity is described by a set of disjoint periods
+        life_order = np.argsort(life_start, kind='stable')
+        life_start, life_end = life_start[life_order], life_end[life_order]
+        if len(life_start) > 0:
+            new_range = np.ones(len(life_start), dtype=bool)
+            new_range[1:] = life_start[1:] > np.maximum.accumulate(life_end)[:-1]
+            range_starts = np.flatnonzero(new_range)
+            life_end = np.maximum.reduceat(life_end, range_starts)
+            life_start = life_start[range_starts]
+
+        segment_start = global_position(event_entities, event_times)
+        segment_end = global_position(event_entities, next_times)
+
+        first_range = np.searchsorted(life_end, segment_start, side='right')
+        last_range = np.searchsorted(life_start, segment_end, side='left')
+        overlap_counts = np.where(segment_start < segment_end, np.maximum(last_range - first_range, 0), 0)
+
+        segment_ids = np.repeat(np.arange(len(event_rows)), overlap_counts)
+        range_ids = np.repeat(first_range, overlap_counts) + _kernels.offsets_within(overlap_counts)
+
+        interval_entities = event_entities[segment_ids]
+        interval_rows = event_rows[segment_ids]
+        interval_start = all_times[
+            np.maximum(segment_start[segment_ids], life_start[range_ids]) - interval_entities * stride
+            ]
+        interval_end = all_times[
+            np.minimum(segment_end[segment_ids], life_end[range_ids]) - interval_entities * stride
+            ]
+        ends_at_departure = life_end[range_ids] < segment_end[segment_ids]
+
+        # Entities whose latest event is missing are not shown in any snapshot, so leave them
+        # out of the index rather than showing them in their previous state
+        has_event = event_codes[interval_rows] >= 0
+
+        self.intervals = pd.DataFrame({
+            'row': interval_rows[has_event],
+            'entity': interval_entities[has_event],
+            'event': event_codes[interval_rows[has_event]],
+            'start': interval_start[has_event],
+            'end': interval_end[has_event]
+            })
+        # Report periods ending with the entity's departure as ending at the departure time
+        self._state_end = np.where(
+            ends_at_departure[has_event],
+            np.nextafter(interval_end[has_event], -np.inf),
+            interval_end[has_event]
+            )
 
-                # ----------------------------------------------------------------------------- #
+        self._build_time_index()
+        self._build_occupancy()
+
+    def _build_time_index(self):
+        """
+        Sort the intervals by start time and store the intervals open at each checkpoint.
+        """
+        starts = self.intervals['start'].to_numpy()
+        ends = self.intervals['end'].to_numpy()
+
+        self._start_order = np.argsort(starts, kind='stable')
+        self._sorted_starts = starts[self._start_order]
+        self._sorted_ends = ends[self._start_order]
+
+        # Space checkpoints so that at most checkpoint_interval intervals start or end between
+        # consecutive checkpoints, with the interval no smaller than the typical number of open
+        # intervals so that the stored sets take up O(n) space in total
+        finite_ends = np.where(np.isfinite(ends), ends, np.nan)
+        time_span = np.nanmax(np.append(finite_ends, starts)) - starts.min() if len(starts) > 0 else 0
+        if time_span > 0:
+            mean_open = np.sum(np.minimum(ends, starts.min() + time_span) - starts) / time_span
+        else:
+            mean_open = len(starts)
+        self.checkpoint_interval = max(self.min_checkpoint_interval, int(np.ceil(mean_open)))
+
+        boundary_times = np.sort(np.concatenate([starts, ends[np.isfinite(ends)]]))
+        self._checkpoint_times = np.unique(boundary_times[::self.checkpoint_interval])
+
+        # An interval is open at the checkpoints in [start, end)
+        first_checkpoint = np.searchsorted(self._checkpoint_times, self._sorted_starts, side='left')
+        last_checkpoint = np.searchsorted(self._checkpoint_times, self._sorted_ends, side='left')
+        checkpoint_counts = last_checkpoint - first_checkpoint
+
+        open_checkpoints = (
+            np.repeat(first_checkpoint, checkpoint_counts) + _kernels.offsets_within(checkpoint_counts)
+            )
+        open_intervals = np.repeat(np.arange(len(starts)), checkpoint_counts)
+
+        checkpoint_order = np.argsort(open_checkpoints, kind='stable')
+        self._checkpoint_intervals = open_intervals[checkpoint_order]
+        self._checkpoint_offsets = np.concatenate([
+            [0],
+            np.cumsum(np.bincount(open_checkpoints, minlength=len(self._checkpoint_times)))
+            ])
+
+    def _build_occupancy(self):
+        """
+        Store, for each event, the times at which its number of entities changes.
+        """
+        event_codes = self.intervals['event'].to_numpy()
+        starts = self.intervals['start'].to_numpy()
+        ends = self.intervals['end'].to_numpy()
+
+        change_events = np.concatenate([event_codes, event_codes])
+        change_times = np.concatenate([starts, ends])
+        changes = np.concatenate([np.ones(len(starts)), -np.ones(len(ends))]).astype(np.int64)
+
+        # Every interval ends (entities who never depart at infinity), so the running total
+        # returns to zero at the end of each event's changes
+        change_order = np.lexsort((change_times, change_events))
+        self._occupancy_times = change_times[change_order]
+        self._occupancy_counts = np.cumsum(changes[change_order])
+        self._occupancy_offsets = np.concatenate([
+            [0], np.cumsum(np.bincount(change_events, minlength=len(self.events)))
+            ])
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __repr__(self):
+        return (f"EntityStateIndex(entities={len(self.entities)}, intervals={len(self)}, "
+                f"checkpoints={len(self._checkpoint_times)})")
+
+    def _open_at(self, time):
+        """
+        Return the positions, in start order, of the intervals with start <= time < end, along
+        with those that start later but no later than the checkpoint following `time`.
+        """
+        checkpoint = np.searchsorted(self._checkpoint_times, time, side='right') - 1
+        if checkpoint >= 0:
+            candidates = self._checkpoint_intervals[
+                self._checkpoint_offsets[checkpoint]:self._checkpoint_offsets[checkpoint + 1]
+                ]
+            first_new = np.searchsorted(self._sorted_starts, self._checkpoint_times[checkpoint], side='right')
+        else:
+            candidates = np.array([], dtype=np.int64)
+            first_new = 0
+
+        last_new = np.searchsorted(self._sorted_starts, time, side='right')
+        candidates = np.concatenate([candidates, np.arange(first_new, last_new)])
+
+        return candidates[self._sorted_ends[candidates] > time]
+
+    def _to_dataframe(self, positions):
+        """
+        Turn positions in start order into a dataframe of event log rows, in time order.
+        """
+        interval_ids = self._start_order[positions]
+        rows = self.intervals['row'].to_numpy()[interval_ids]
+
+        output_order = np.lexsort((self.intervals['start'].to_numpy()[interval_ids], self._time_key[rows]))
+        interval_ids, rows = interval_ids[output_order], rows[output_order]
+
+        state_df = self.event_log.take(rows).reset_index(drop=True)
+        state_df['state_start'] = self.intervals['start'].to_numpy()[interval_ids]
+        state_df['state_end'] = self._state_end[interval_ids]
+        return state_df
+
+    def state_at(self, time):
+        """
+        Return the state of every entity present in the system at a given time.
+
+        Parameters
+        ----------
+        time : float
+            The time to look up, in simulation time units.
+
+        Returns
+        -------
+        pd.DataFrame
+            The latest event log row of each entity present at `time`, in time order, with
+            the original index in an 'index' column. The 'state_start' and 'state_end'
+            columns give the period over which the entity remains in that state.
+            These rows match the rows of a snapshot taken by reshape_for_animations() at the
+            same time, before any limit on the number of entities per step is applied.
+        """
+        return self._to_dataframe(self._open_at(time))
+
+    def state_between(self, start_time, end_time):
+        """
+        Return every state held by any entity at some point in a period.
+
+        Parameters
+        ----------
+        start_time, end_time : float
+            The start and end of the period (both inclusive), in simulation time units.
+
+        Returns
+        -------
+        pd.DataFrame
+            One event log row per state held during the period, in time order, with
+            'state_start' and 'state_end' columns as in state_at(). An entity appears once
+            for every state it holds during the period.
+        """
+        if end_time < start_time:
+            raise ValueError("end_time must not be before start_time.")
+
+        first_new = np.searchsorted(self._sorted_starts, start_time, side='right')
+        last_new = np.searchsorted(self._sorted_starts, end_time, side='right')
+
+        return self._to_dataframe(
+            np.concatenate([self._open_at(start_time), np.arange(first_new, last_new)])
+            )
 
-                # Exclude event types that should not be part of snapshot logic
-                excluded_types = ['resource_use', 'resource_use_end']
+    def entity_states(self, entity_id):
+        """
+        Return every state held by a single entity, in time order.
+
+        Parameters
+        ----------
+        entity_id : any
+            The entity to look up. If the index was built with a run_col_name, this should
+            be a (run, entity) tuple.
+
+        Returns
+        -------
+        pd.DataFrame
+            One event log row per state, with 'state_start' and 'state_end' columns as in
+            state_at().
+        """
+        entity_code = self.entities.get_indexer([entity_id])[0]
+        if entity_code < 0:
+            raise ValueError(f"No events found for {self.entity_col_name} = {entity_id}")
+
+        interval_entities = self.intervals['entity'].to_numpy()
+        first = np.searchsorted(interval_entities, entity_code, side='left')
+        last = np.searchsorted(interval_entities, entity_code, side='right')
+
+        start_positions = np.empty(len(self.intervals), dtype=np.int64)
+        start_positions[self._start_order] = np.arange(len(self.intervals))
+
+        return self._to_dataframe(start_positions[first:last])
+
+    def occupancy(self, time):
+        """
+        Return the number of entities at each event at a given time.
+
+        Parameters
+        ----------
+        time : float
+            The time to look up, in simulation time units.
+
+        Returns
+        -------
+        pd.Series
+            The number of entities whose latest event is each event, indexed by event (or by
+            run and event, if the index was built with a run_col_name).
+        """
+        counts = np.zeros(len(self.events), dtype=np.int64)
+        for event_code in range(len(self.events)):
+            first = self._occupancy_offsets[event_code]
+            last = self._occupancy_offsets[event_code + 1]
+            position = np.searchsorted(self._occupancy_times[first:last], time, side='right') - 1
+            if position >= 0:
+                counts[event_code] = self._occupancy_counts[first + position]
+
+        return pd.Series(counts, index=self.events, name='count')
+
+def _rank_and_sort_rows(full_entity_df, rank_keys, sort_keys):
+    """
+    Rank the rows within each group of `rank_keys` in order of appearance (matching
+    groupby().rank(method='first')), and find the order of the rows sorted by `sort_keys`
+    (matching sort_values()), using integer codes of the key columns.
 
-                # Apply snapshot logic per event (assuming 'event_id' identifies each event)
-                def process_event_group(df):
-                    if df[event_type_col_name].iloc[0] in excluded_types:
-                        return df  # Return unchanged
-                    else:
-                        # Keep only top (step_snapshot_max + 1) ranks
-                        df = df[df['rank'] <= (step_snapshot_max + 1)].copy()
+    Neither the key columns nor the dataframe are copied.
+    """
+    row_count = len(full_entity_df)
+    key_codes = {}
+    has_missing_key = np.zeros(row_count, dtype=bool)
+    for key in dict.fromkeys([*rank_keys, *sort_keys]):
+        codes, uniques = pd.factorize(full_entity_df[key], sort=True)
+        if key in rank_keys:
+            has_missing_key |= codes < 0
+        # Missing values sort last
+        codes[codes < 0] = len(uniques)
+        key_codes[key] = codes
+
+    # np.lexsort() sorts by the last key first, and keeps rows with equal keys in order
+    group_order = np.lexsort([key_codes[key] for key in reversed(rank_keys)])
+    new_group = np.zeros(row_count, dtype=bool)
+    new_group[:1] = True
+    for key in rank_keys:
+        group_codes = key_codes[key][group_order]
+        new_group[1:] |= group_codes[1:] != group_codes[:-1]
+        del group_codes
+    positions = np.arange(row_count)
+    group_starts = np.maximum.accumulate(np.where(new_group, positions, 0))
+    del new_group
+
+    rank = np.empty(row_count)
+    rank[group_order] = positions - group_starts + 1
+    rank[has_missing_key] = np.nan
+    del group_order, group_starts, positions
+
+    sorted_rows = np.lexsort([key_codes.pop(key) for key in reversed(sort_keys)])
+
+    return rank, sorted_rows
+
+def _slot_coordinates(x, y, slots, gap_between, wrap_at=None, gap_between_rows=0):
+    """
+    Lookup tables of the coordinates of each slot of each event, used by
+    generate_animation_df() to place entities by indexing into them.
 
-                        # Identify max rank row (to possibly add 'additional' column)
-                        max_row = df[df['rank'] == float(step_snapshot_max + 1)].copy()
-                        if len(max_row) > 0:
-                            max_row['additional'] = max_row['max'] - max_row['rank']
-                            df = pd.concat([
-                                df[df['rank'] != float(step_snapshot_max + 1)],
-                                max_row
-                            ], ignore_index=True)
-                        return df
+    Slot value k of an event at (x, y) is placed k gaps to the left of it, wrapping onto a new
+    row every `wrap_at` slots if `wrap_at` is not None.
 
-                # Apply the per-event logic
-                most_recent_events_time_unit_ungrouped = (
-                    most_recent_events_time_unit_ungrouped
-                    .groupby(event_col_name, group_keys=False)
-                    .apply(process_event_group)
+    Returns
+    -------
+    tuple
+        Arrays of the x and y coordinates, of shape (len(x), len(slots)), and the row of each
+        slot (None if not wrapping).
+    """
+    x_final = x[:, None] - slots[None, :] * gap_between
+    y_final = np.broadcast_to(y[:, None], x_final.shape)
+    row = None
+
+    if wrap_at is not None:
+        row = np.floor((slots - 1) / (wrap_at))
+        x_final = x_final + (wrap_at * row * gap_between) + gap_between
+        y_final = y_final + (row * gap_between_rows)
+
+    return x_final, y_final, row
+
+class ResourceLayout:
+    """
+    The position of every resource slot of every event, shared by generate_animation_df() and
+    generate_animation().
+
+    generate_animation_df() places entities using a resource at the slot given by their
+    resource ID, and generate_animation() draws a marker at each slot of the resources in the
+    scenario. Building a ResourceLayout once and passing it to both guarantees that entities
+    and markers line up, and lets the slot coordinates be reused across every render of the
+    same model (for example, each window of a paged animation, or repeated calls to
+    animate_activity_log()).
+
+    Parameters
+    ----------
+    event_position_df : pd.DataFrame
+        DataFrame with columns 'event', 'x' and 'y', specifying the position of each event,
+        and a 'resource' column naming the scenario attribute holding the number of resources
+        available at each resource use step. Must have a single row for each event.
+    scenario : object, optional
+        Object containing attributes for resource counts at different steps. If None, the
+        layout can still place entities, but has no resource markers to draw.
+    wrap_resources_at : int, optional
+        Number of resources to show before wrapping to a new row (default is 20).
+    gap_between_resources : int, optional
+        Horizontal spacing between resources in pixels (default is 10).
+    gap_between_resource_rows : int, optional
+        Vertical spacing between rows in pixels (default is 30).
+    event_col_name : str, default="event"
+        Name of the column in `event_position_df` holding the event names.
+
+    Attributes
+    ----------
+    events : pd.Index
+        The events in `event_position_df`.
+    resource_counts : pd.Series or None
+        The number of resources available at each event with a resource, or None if no
+        scenario was given.
+
+    Notes
+    -----
+    - Resource ID k of an event at (x, y) is placed k gaps to the left of it, wrapping onto a
+      new row every `wrap_resources_at` resources, so the slots of a scenario with n resources
+      are resource IDs 1 to n.
+    - The coordinates of slots 1 to n (for the largest n in the scenario) are worked out when
+      the layout is built. Tables for higher resource IDs are added the first time they are
+      needed and kept for later calls.
+    """
+    def __init__(self,
+                 event_position_df,
+                 scenario=None,
+                 wrap_resources_at=20,
+                 gap_between_resources=10,
+                 gap_between_resource_rows=30,
+                 event_col_name="event"):
+        self.events = pd.Index(event_position_df[event_col_name])
+        if not self.events.is_unique:
+            raise ValueError("event_position_df must have a single row for each event.")
+
+        self.event_position_df = event_position_df
+        self.wrap_resources_at = wrap_resources_at
+        self.gap_between_resources = gap_between_resources
+        self.gap_between_resource_rows = gap_between_resource_rows
+        self.event_col_name = event_col_name
+
+        # The position of each event, with a row of missing values at the end that events
+        # without a position (code -1) index into
+        self._x, self._y = [
+            np.append(
+                pd.to_numeric(event_position_df[col]).to_numpy(dtype=float, na_value=np.nan), np.nan
+                )
+            for col in ['x', 'y']
+            ]
+
+        self.resource_counts = None
+        if scenario is not None:
+            if 'resource' not in event_position_df.columns:
+                raise ValueError(
+                    "event_position_df must have a 'resource' column when a scenario is given."
+                    )
+            events_with_resources = event_position_df[event_position_df['resource'].notnull()]
+            self.resource_counts = pd.Series(
+                [int(getattr(scenario, resource)) for resource in events_with_resources['resource']],
+                index=pd.Index(events_with_resources[event_col_name]),
+                dtype=np.int64,
+                name='resource_count'
                 )
 
-                # Clean up and store snapshot
-                entity_dfs.append(
-                    most_recent_events_time_unit_ungrouped
-                    .drop(columns='max', errors='ignore')
-                    .assign(snapshot_time=time_unit)
+        self._slot_x = self._slot_y = np.empty((len(self._x), 0))
+        self._extend_slots(
+            0 if self.resource_counts is None else self.resource_counts.to_numpy().max(initial=0)
+            )
+
+    def _extend_slots(self, slot_count):
+        # Grow the tables of slot coordinates to cover resource IDs 1 to slot_count
+        if slot_count <= self._slot_x.shape[1]:
+            return
+        self._slot_x, self._slot_y, _ = _slot_coordinates(
+            self._x, self._y, np.arange(1, slot_count + 1, dtype=float), self.gap_between_resources,
+            self.wrap_resources_at, self.gap_between_resource_rows
+            )
+
+    def positions(self, events, resource_ids):
+        """
+        The position of entities using the given resources.
+
+        Parameters
+        ----------
+        events : array-like
+            The event each entity is at.
+        resource_ids : array-like
+            The ID of the resource each entity is using.
+
+        Returns
+        -------
+        tuple
+            Arrays of the x and y coordinates of each entity, and the row each is placed in
+            (None if resources are not wrapped). Entities at events without a position, or
+            without a resource ID, have missing coordinates.
+        """
+        event_codes = self.events.get_indexer(events)
+        resource_ids = np.asarray(resource_ids, dtype=float)
+        slot_codes, slots = pd.factorize(resource_ids, use_na_sentinel=False)
+        slots = np.asarray(slots, dtype=float)
+
+        # Whole-number resource IDs from 1 up are looked up in the slot tables, and any others
+        # are worked out directly
+        in_table = (slots >= 1) & (slots == np.floor(slots))
+        self._extend_slots(int(slots[in_table].max(initial=0)))
+
+        slot_x = np.empty((len(self._x), len(slots)))
+        slot_y = np.empty((len(self._x), len(slots)))
+        table_columns = slots[in_table].astype(np.int64) - 1
+        slot_x[:, in_table] = self._slot_x[:, table_columns]
+        slot_y[:, in_table] = self._slot_y[:, table_columns]
+        if not in_table.all():
+            slot_x[:, ~in_table], slot_y[:, ~in_table], _ = _slot_coordinates(
+                self._x, self._y, slots[~in_table], self.gap_between_resources,
+                self.wrap_resources_at, self.gap_between_resource_rows
                 )
 
-            else:
-                # If no entities, append a DataFrame with just the snapshot_time
-                # This creates a row with NaN for all other columns, preserving the time step.
-                empty_df = pd.DataFrame([{'snapshot_time': time_unit}])
-                entity_dfs.append(empty_df)
+        row = None
+        if self.wrap_resources_at is not None:
+            row = np.floor((slots - 1) / (self.wrap_resources_at)).take(slot_codes)
+
+        return slot_x[event_codes, slot_codes], slot_y[event_codes, slot_codes], row
+
+    def markers(self, resource_col_name="resource_id"):
+        """
+        One row for each resource available in the scenario, positioned in its slot.
+
+        Parameters
+        ----------
+        resource_col_name : str, default="resource_id"
+            Name of the column holding the index of each resource within its event,
+            counting from 0.
+
+        Returns
+        -------
+        pd.DataFrame
+            The row of `event_position_df` for the event of each resource, with the
+            'resource_count' of the event, the resource index, and its 'x_final' and
+            'y_final' position (and 'row', if resources are wrapped).
+        """
+        if self.resource_counts is None:
+            raise ValueError("Resource markers require a ResourceLayout built with a scenario.")
+
+        counts = self.resource_counts.to_numpy()
+        event_codes = np.repeat(self.events.get_indexer(self.resource_counts.index), counts)
+        # Count the resources of each event from 0
+        resource_index = np.arange(len(event_codes)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        resource_markers = self.event_position_df.iloc[event_codes].copy()
+        resource_markers['resource_count'] = counts.repeat(counts)
+        resource_markers[resource_col_name] = resource_index
+        resource_markers['x_final'] = self._slot_x[event_codes, resource_index]
+        resource_markers['y_final'] = self._slot_y[event_codes, resource_index]
+        if self.wrap_resources_at is not None:
+            resource_markers['row'] = np.floor(resource_index / (self.wrap_resources_at))
+
+        return resource_markers
+
+def _generate_animation_df_polars(full_entity_df,
+                                  event_position_df,
+                                  icon_list,
+                                  resource_layout,
+                                  wrap_queues_at=20,
+                                  step_snapshot_max=50,
+                                  gap_between_entities=10,
+                                  gap_between_queue_rows=30,
+                                  time_col_name="time",
+                                  entity_col_name="entity_id",
+                                  event_type_col_name="event_type",
+                                  event_col_name="event",
+                                  resource_col_name="resource_id",
+                                  run_col_name=None,
+                                  entity_ids=None):
+    """
+    Polars version of generate_animation_df(), used by the 'polars' backend.
 
-    if debug_mode:
-        print(f'Iteration through time-unit-by-time-unit logs complete {time.strftime("%H:%M:%S", time.localtime())}')
+    Follows the same steps as the pandas version, so that the result converted to pandas
+    matches its output, and returns a polars dataframe.
+    """
+    pl = _import_polars()
+
+    if isinstance(full_entity_df, pd.DataFrame):
+        full_entity_df = pl.from_pandas(full_entity_df)
+    if isinstance(event_position_df, pd.DataFrame):
+        event_position_df = pl.from_pandas(event_position_df)
+
+    run_keys = [] if run_col_name is None else [run_col_name]
+    rank_keys = [*run_keys, event_col_name, "snapshot_time"]
+
+    # Order entities within event/time unit to determine their eventual position in the line,
+    # leaving rows with a missing key unranked as groupby() does
+    full_entity_df = full_entity_df.with_columns(
+        pl.when(pl.all_horizontal(pl.col(rank_keys).is_not_null()))
+        .then(pl.int_range(1, pl.len() + 1).over(rank_keys))
+        .cast(pl.Float64)
+        .alias('rank')
+        )
 
-    # Join together all entity dfs - so the dataframe created per time snapshot - are put into
-    # one large dataframe
-    full_entity_df = (pd.concat(entity_dfs, ignore_index=True)).reset_index(drop=True)
+    full_entity_df_plus_pos = (
+        full_entity_df
+        .join(event_position_df, on=event_col_name, how='left', maintain_order='left_right')
+        .sort([*run_keys, event_col_name, "snapshot_time", time_col_name],
+              nulls_last=True, maintain_order=True)
+        )
 
-    if debug_mode:
-        print(f'Snapshot df concatenation complete at {time.strftime("%H:%M:%S", time.localtime())}')
+    # Separate the empty snapshots from the entity data
+    empty_snapshots = full_entity_df_plus_pos.filter(pl.col(entity_col_name).is_null())
+    entity_data = full_entity_df_plus_pos.filter(pl.col(entity_col_name).is_not_null())
 
-    # We no longer need to keep the individual dataframes in that list, so get rid of them
-    # to free up memory asap
-    del entity_dfs
-    gc.collect()
+    # Determine the position for any resource use steps
+    resource_use = entity_data.filter(pl.col(event_type_col_name) == "resource_use")
 
-    # Add a final exit step for each client
+    if resource_use.height > 0:
+        resource_x, resource_y, resource_row = resource_layout.positions(
+            resource_use.get_column(event_col_name).to_numpy(),
+            resource_use.get_column(resource_col_name).to_numpy()
+            )
+        resource_use = resource_use.rename({"y": "y_final"}).with_columns(
+            pl.Series('y_final', resource_y, nan_to_null=True),
+            pl.Series('x_final', resource_x, nan_to_null=True)
+            )
 
-    # This is helpful as it ensures all patients are visually seen to exit rather than
-    # just disappearing after their final step
+        if resource_row is not None:
+            resource_use = resource_use.with_columns(pl.Series('row', resource_row, nan_to_null=True))
 
-    # It makes it easier to track the split of people going on to an optional step when
-    # this step is at the end of the pathway
+    # Determine the position for any queuing steps
+    queues = entity_data.filter(pl.col(event_type_col_name) == "queue").rename({"y": "y_final"})
+    queues = queues.with_columns(
+        (pl.col('x') - pl.col('rank') * gap_between_entities).alias('x_final')
+        )
 
-    # First, get the last step for every single person
-    final_step = (
-        full_entity_df
-        .sort_values([entity_col_name, 'snapshot_time'], ascending=True)
-        .groupby(entity_col_name)
-        .tail(1)
-        .copy()
-    )
+    if wrap_queues_at is not None:
+        queues = queues.with_columns(
+            ((pl.col('rank') - 1) / wrap_queues_at).floor().alias('row')
+            ).with_columns(
+            pl.col('x_final') + (wrap_queues_at * pl.col('row') * gap_between_entities) +
+            gap_between_entities,
+            pl.col('y_final') + (pl.col('row') * gap_between_queue_rows)
+            )
 
-    # Propose their 'exit' time
-    final_step['snapshot_time'] = final_step['snapshot_time'] + every_x_time_units
-    final_step[event_col_name] = "depart"
+    queues = queues.with_columns(
+        pl.when(pl.col('rank') != step_snapshot_max + 1)
+        .then(pl.col('x_final'))
+        .otherwise(pl.col('x_final') - (gap_between_entities * (wrap_queues_at/2)))
+        )
 
-    # Only keep rows for people whose exit step will happen *before* the simulation end
-    final_step = final_step[final_step["snapshot_time"] <= (limit_duration)]
+    if resource_use.height > 0:
+        processed_entities_df = pl.concat([queues, resource_use], how='diagonal_relaxed')
+    else:
+        processed_entities_df = queues
 
-    full_entity_df = pd.concat([full_entity_df, final_step], ignore_index=True)
+    # Add the empty snapshots back into the main dataframe
+    full_entity_df_plus_pos = pl.concat(
+        [processed_entities_df, empty_snapshots], how='diagonal_relaxed'
+        )
 
-    del final_step
-    gc.collect()
+    if entity_ids is None:
+        entity_ids = full_entity_df.get_column(entity_col_name)
+    individual_entities = (
+        pl.Series(entity_col_name, entity_ids)
+        .unique()
+        .sort(nulls_last=True)
+        .cast(full_entity_df_plus_pos.schema[entity_col_name])
+        )
+
+    full_icon_list = icon_list * int(np.ceil(len(individual_entities)/len(icon_list)))
+
+    full_icon_list = full_icon_list[0:len(individual_entities)]
+
+    # Empty snapshots take the icon of the missing entity ID, as they do in pandas
+    full_entity_df_plus_pos = full_entity_df_plus_pos.join(
+        pl.DataFrame([individual_entities, pl.Series('icon', full_icon_list, dtype=pl.String)]),
+        on=entity_col_name,
+        how='inner',
+        nulls_equal=True,
+        maintain_order='left'
+        )
+
+    if 'additional' in full_entity_df_plus_pos.columns:
+        exceeded_snapshot_limit = full_entity_df_plus_pos.filter(
+            pl.col('additional').is_not_null()
+            ).with_columns(
+            pl.format(
+                "+ {} more",
+                pl.col('additional').cast(pl.Int64).cast(pl.String).str.pad_start(5)
+                ).alias('icon')
+            )
+
+        full_entity_df_plus_pos = pl.concat(
+            [
+                full_entity_df_plus_pos.filter(pl.col('additional').is_null()),
+                exceeded_snapshot_limit
+            ]
+            )
 
-    return full_entity_df.sort_values(['snapshot_time', event_col_name]).reset_index(drop=True)
+    return full_entity_df_plus_pos
 
 def generate_animation_df(
         full_entity_df,
@@ -275,9 +3318,14 @@ def generate_animation_df(
         event_type_col_name="event_type",
         event_col_name="event",
         resource_col_name="resource_id",
+        run_col_name=None,
         debug_mode=False,
         custom_entity_icon_list=None,
-        include_fun_emojis=False
+        include_fun_emojis=False,
+        slim=False,
+        entity_ids=None,
+        backend="pandas",
+        resource_layout=None
 ):
     """
     Generate a DataFrame for animation purposes by adding position information to entity data.
@@ -287,8 +3335,9 @@ def generate_animation_df(
 
     Parameters
     ----------
-    full_entity_df : pd.DataFrame
-        Output of reshape_for_animation(), containing entity event data.
+    full_entity_df : pd.DataFrame or SnapshotCube
+        Output of reshape_for_animation(), containing entity event data, or a SnapshotCube
+        built from it.
     event_position_df : pd.DataFrame
         DataFrame with columns 'event', 'x', and 'y', specifying initial positions for each event type.
     wrap_queues_at : int, optional
@@ -319,6 +3368,10 @@ def generate_animation_df(
         Name of the column for the resource identifier. Used for 'resource_use' events.
     event_col_name : str, default="event"
         Name of the column in `event_log` that specifies the actual event that occurred.
+    run_col_name : str, optional, default=None
+        Name of the column identifying the run each row belongs to, if `full_entity_df` was
+        produced by reshape_for_animations() with a run_col_name. Entities are then positioned
+        within each run separately.
     debug_mode : bool, optional
         If True, print debug information during processing (default is False).
     custom_entity_icon_list : list, optional
@@ -329,11 +3382,33 @@ def generate_animation_df(
     include_fun_emojis : bool, default=False
         If True, include the more 'fun' emojis, such as Santa Claus. Ignored if a custom entity icon list
         is passed.
-
+    slim : bool, default=False
+        If True, keep string columns (including the event and icon columns) dictionary-encoded as
+        categoricals and downcast numeric columns to 32-bit types where no values change, to
+        reduce memory use. Best combined with `slim=True` in reshape_for_animations().
+    entity_ids : array-like, optional
+        All of the entity IDs to assign icons across. Icons are assigned to entities in sorted
+        order, so when positioning one part of a reshaped dataframe at a time, pass the IDs of
+        every entity in the full dataframe to give each entity the same icon in every part.
+        Defaults to the entities in `full_entity_df`.
+    backend : str, default="pandas"
+        The dataframe library used to position the entities. "polars" ranks, merges, sorts and
+        positions the entities with polars, accepting either a pandas or a polars DataFrame (such
+        as the output of reshape_for_animations() with the same backend), and returns a polars
+        DataFrame with the same rows and columns. generate_animation() converts this back to
+        pandas. Requires the optional dependency polars (`pip install vidigi[polars]`), and
+        cannot be combined with `slim`.
+    resource_layout : ResourceLayout, optional
+        The layout used to place entities using resources. Pass the same layout to
+        generate_animation() so the resource markers line up with the entities using them,
+        and reuse it across calls for the same model. If given, `wrap_resources_at`,
+        `gap_between_resources` and `gap_between_resource_rows` are taken from the layout.
+        Defaults to a layout built from `event_position_df` and those arguments.
     Returns
     -------
     pd.DataFrame
         A DataFrame with added columns for x and y positions, and icons for each entity.
+        If `backend` is "polars", this is a polars DataFrame.
 
     Notes
     -----
@@ -341,6 +3416,16 @@ def generate_animation_df(
     - It assigns unique icons to entities for visualization.
     - Queues can be wrapped to multiple rows if they exceed a specified length.
     - The function adds a visual indicator for additional entities when exceeding the snapshot limit.
+    - The coordinates of every queue slot (by rank) and resource slot (by resource ID) of every
+      event are worked out once, in lookup tables, and each row's position is then looked up in
+      them, so the cost of placing entities grows with the number of rows rather than requiring
+      the event log to be merged, split and rejoined.
+    - `event_position_df` must have a single row for each event.
+    - `full_entity_df` is never modified. Entities are ranked and ordered by sorting integer
+      codes of the key columns, and the placed dataframe is built with a single gather of its
+      rows rather than from copies of its queue, resource use and empty rows, with each
+      intermediate array released once used, so the peak memory used stays below twice the
+      size of the output.
 
     TODO
     ----
@@ -352,101 +3437,24 @@ def generate_animation_df(
     # TODO: Write a test  to ensure that no patient ID appears in multiple places at a single time unit
     # and return an error if it does so
 
-    # Order entities within event/time unit to determine their eventual position in the line
-    full_entity_df['rank'] = (
-        full_entity_df.groupby([event_col_name, "snapshot_time"])
-        ["snapshot_time"]
-        .rank(method='first')
-        )
-
-    full_entity_df_plus_pos = (
-        full_entity_df
-        .merge(event_position_df, on=event_col_name, how='left')
-        .sort_values([event_col_name, "snapshot_time", time_col_name])
-        )
-
-    # Separate the empty snapshots from the entity data
-    # We can identify them as rows where the entity ID is null.
-    empty_snapshots = full_entity_df_plus_pos[
-        full_entity_df_plus_pos[entity_col_name].isnull()
-    ].copy()
-
-    entity_data = full_entity_df_plus_pos[
-        full_entity_df_plus_pos[entity_col_name].notnull()
-    ].copy()
-
-    # Determine the position for any resource use steps
-    resource_use = (
-        entity_data[entity_data[event_type_col_name] == "resource_use"]
-        .copy()
-        )
-    # resource_use['y_final'] =  resource_use['y']
-
-    if len(resource_use) > 0:
-        resource_use = resource_use.rename(columns={"y": "y_final"})
-        resource_use['x_final'] = resource_use['x'] - resource_use[resource_col_name] * gap_between_resources
-
-        # If we want resources to wrap at a certain queue length, do this here
-        # They'll wrap at the defined point and then the queue will start expanding upwards
-        # from the starting row
-        if wrap_resources_at is not None:
-            resource_use['row'] = np.floor((resource_use[resource_col_name] - 1) / (wrap_resources_at))
-
-            resource_use['x_final'] = (
-                resource_use['x_final'] +
-                (wrap_resources_at * resource_use['row'] * gap_between_resources) +
-                gap_between_resources
-                )
-
-            resource_use['y_final'] = resource_use['y_final'] + (resource_use['row'] * gap_between_resource_rows)
-
-    # Determine the position for any queuing steps
-    queues = entity_data[entity_data['event_type']=='queue'].copy()
-
-    # queues['y_final'] =  queues['y']
-    queues = queues.rename(columns={"y": "y_final"})
-    queues['x_final'] = queues['x'] - queues['rank'] * gap_between_entities
-
-    # If we want people to wrap at a certain queue length, do this here
-    # They'll wrap at the defined point and then the queue will start expanding upwards
-    # from the starting row
-    if wrap_queues_at is not None:
-        queues['row'] = np.floor((queues['rank'] - 1) / (wrap_queues_at))
-
-        queues['x_final'] = (
-            queues['x_final'] +
-            (wrap_queues_at * queues['row'] * gap_between_entities) +
-            gap_between_entities
-        )
-
-        queues['y_final'] = queues['y_final'] + (queues['row'] * gap_between_queue_rows)
-
-    queues['x_final'] = np.where(
-        queues['rank'] != step_snapshot_max + 1,
-        queues['x_final'],
-        queues['x_final'] - (gap_between_entities * (wrap_queues_at/2))
-        )
+    _check_backend(backend)
 
-    if len(resource_use) > 0:
-        processed_entities_df = pd.concat([queues, resource_use], ignore_index=True)
-        del resource_use, queues
-    else:
-        processed_entities_df = queues.copy()
-        del queues
-
-    # Add the empty snapshots back into the main dataframe
-    full_entity_df_plus_pos = pd.concat(
-        [processed_entities_df, empty_snapshots],
-        ignore_index=True
-    )
+    if backend == "polars" and slim:
+        raise ValueError("slim cannot be used with backend='polars'.")
 
-    if debug_mode:
-        print(f'Placement dataframe finished construction at {time.strftime("%H:%M:%S", time.localtime())}')
+    if isinstance(full_entity_df, SnapshotCube):
+        full_entity_df = full_entity_df.to_dataframe()
 
-    # full_patient_df_plus_pos['icon'] = '🙍'
+    if resource_layout is None:
+        resource_layout = ResourceLayout(
+            event_position_df if isinstance(event_position_df, pd.DataFrame) else event_position_df.to_pandas(),
+            wrap_resources_at=wrap_resources_at,
+            gap_between_resources=gap_between_resources,
+            gap_between_resource_rows=gap_between_resource_rows,
+            event_col_name=event_col_name
+            )
 
-    # TODO: Add warnings if duplicates are found (because in theory they shouldn't be)
-    individual_entities = full_entity_df[entity_col_name].drop_duplicates().sort_values()
+    run_keys = [] if run_col_name is None else [run_col_name]
 
     # Recommend https://emojipedia.org/ for finding emojis to add to list
     # note that best compatibility across systems can be achieved by using
@@ -480,33 +3488,186 @@ def generate_animation_df(
     else:
         icon_list = custom_entity_icon_list.copy()
 
+    if backend == "polars":
+        return _generate_animation_df_polars(
+            full_entity_df,
+            event_position_df,
+            icon_list=icon_list,
+            resource_layout=resource_layout,
+            wrap_queues_at=wrap_queues_at,
+            step_snapshot_max=step_snapshot_max,
+            gap_between_entities=gap_between_entities,
+            gap_between_queue_rows=gap_between_queue_rows,
+            time_col_name=time_col_name,
+            entity_col_name=entity_col_name,
+            event_type_col_name=event_type_col_name,
+            event_col_name=event_col_name,
+            resource_col_name=resource_col_name,
+            run_col_name=run_col_name,
+            entity_ids=entity_ids
+            )
+
+    if slim:
+        full_entity_df = _slim_dataframe(full_entity_df)
+        # Share categories with the event positions so the merge keeps the encoding
+        event_categories = full_entity_df[event_col_name].cat.categories.union(
+            event_position_df[event_col_name].dropna().unique()
+            )
+        full_entity_df[event_col_name] = full_entity_df[event_col_name].cat.set_categories(event_categories)
+        event_position_df = event_position_df.assign(**{
+            event_col_name: pd.Categorical(event_position_df[event_col_name], categories=event_categories)
+            })
+
+    rank_keys = [*run_keys, event_col_name, "snapshot_time"]
+    sort_keys = [*rank_keys, time_col_name]
+    # Order entities within event/time unit to determine their eventual position in the line,
+    # and find the order the rows are placed in, i.e. sorted by event and time
+    rank, sorted_rows = _rank_and_sort_rows(full_entity_df, rank_keys, sort_keys)
+
+    # Only queues and resource use steps are placed, along with the empty snapshots (rows
+    # where the entity ID is null) that keep every time step in the animation
+    entities = full_entity_df[entity_col_name]
+    is_empty = entities.isnull().to_numpy()
+    type_codes, event_types = pd.factorize(full_entity_df[event_type_col_name])
+    queue_code, resource_use_code = event_types.get_indexer(["queue", "resource_use"])
+    is_queue = ~is_empty & (queue_code >= 0) & (type_codes == queue_code)
+    is_resource_use = ~is_empty & (resource_use_code >= 0) & (type_codes == resource_use_code)
+
+    # Assign icons to entities in sorted order, looping through the icon list
+    # TODO: Add warnings if duplicates are found (because in theory they shouldn't be)
+    if entity_ids is None:
+        entity_ids = entities
+    individual_entities = pd.Series(entity_ids).drop_duplicates().sort_values()
+
     full_icon_list = icon_list * int(np.ceil(len(individual_entities)/len(icon_list)))
 
-    full_icon_list = full_icon_list[0:len(individual_entities)]
+    full_icon_list = np.array(full_icon_list[0:len(individual_entities)], dtype=object)
 
-    full_entity_df_plus_pos = full_entity_df_plus_pos.merge(
-        pd.DataFrame(
-            {entity_col_name:list(individual_entities),
-            'icon':full_icon_list}
-            ),
-        on=entity_col_name
-        )
+    # Empty snapshots take the icon of the missing entity ID, if there is one, and rows of
+    # entities without an icon are dropped
+    icon_codes = pd.Index(individual_entities).get_indexer(entities)
+    has_icon = icon_codes >= 0
 
-    if 'additional' in full_entity_df_plus_pos.columns:
-        exceeded_snapshot_limit = (
-            full_entity_df_plus_pos[full_entity_df_plus_pos['additional'].notna()].copy()
+    ################################################################################
+    # Slot coordinate tables
+    ################################################################################
+    event_index = pd.Index(event_position_df[event_col_name])
+    if not event_index.is_unique:
+        raise ValueError("event_position_df must have a single row for each event.")
+    event_codes = event_index.get_indexer(full_entity_df[event_col_name])
+    # Events without a position are placed in an extra row of the tables full of missing values
+    any_unplaced = (event_codes < 0).any()
+    event_codes = np.where(event_codes < 0, len(event_index), event_codes)
+
+    def event_values(col):
+        # The position of each event (with a missing value for events without a position),
+        # taking on a missing-value-capable dtype if any rows have no position
+        values = event_position_df[col]
+        values = values.array if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) else values.to_numpy()
+        if not any_unplaced:
+            return values
+        return pd.api.extensions.take(
+            values, np.append(np.arange(len(event_index)), -1), allow_fill=True
             )
 
-        exceeded_snapshot_limit['icon'] = (
-            exceeded_snapshot_limit['additional'].apply(lambda x: f"+ {int(x):5d} more")
+    event_x, event_y = event_values('x'), event_values('y')
+
+    # Queues are laid out by rank, with a slot for each rank up to the one carrying the
+    # number of additional entities not shown
+    queue_slot_count = int(max(step_snapshot_max + 1, np.nanmax(rank[is_queue], initial=0)))
+    queue_slots = np.arange(1, queue_slot_count + 1, dtype=float)
+    queue_slot_codes = np.zeros(len(full_entity_df), dtype=np.int64)
+    queue_slot_codes[is_queue] = rank[is_queue] - 1
+    queue_x, queue_y, queue_row = _slot_coordinates(
+        event_x, event_y, queue_slots, gap_between_entities, wrap_queues_at, gap_between_queue_rows
+        )
+    # Step the '+ N more' slot back from the end of the queue
+    if wrap_queues_at is not None and step_snapshot_max + 1 <= len(queue_slots):
+        queue_x[:, step_snapshot_max] = (
+            queue_x[:, step_snapshot_max] - (gap_between_entities * (wrap_queues_at/2))
             )
 
-        full_entity_df_plus_pos = pd.concat(
-            [
-                full_entity_df_plus_pos[full_entity_df_plus_pos['additional'].isna()],
-                exceeded_snapshot_limit
-            ],
-            ignore_index=True
+    if debug_mode:
+        print(f'Slot coordinate tables built at {time.strftime("%H:%M:%S", time.localtime())}')
+
+    ################################################################################
+    # Place every row with a single gather from the tables
+    ################################################################################
+    # Queues come first, then resource use steps and then the empty snapshots, each sorted
+    queue_rows = sorted_rows[(is_queue & has_icon)[sorted_rows]]
+    resource_rows = sorted_rows[(is_resource_use & has_icon)[sorted_rows]]
+    empty_rows = sorted_rows[(is_empty & has_icon)[sorted_rows]]
+    rows = np.concatenate([queue_rows, resource_rows, empty_rows])
+    placed = slice(0, len(queue_rows) + len(resource_rows))
+
+    queue_index = event_codes[queue_rows] * len(queue_slots) + queue_slot_codes[queue_rows]
+    # Resources are laid out by resource ID (logs without resource use need not have any)
+    resource_ids = (
+        full_entity_df[resource_col_name].to_numpy()[resource_rows] if len(resource_rows)
+        else np.empty(0)
         )
+    resource_x, resource_y, resource_row = resource_layout.positions(
+        full_entity_df[event_col_name].to_numpy()[resource_rows], resource_ids
+        )
+
+    # The rows of the final entity shown in each capped step, labelled with the number not
+    # shown, are moved to the end
+    output_order = slice(None)
+    if 'additional' in full_entity_df.columns:
+        exceeded_snapshot_limit = full_entity_df['additional'].notna().to_numpy()[rows]
+        output_order = np.argsort(exceeded_snapshot_limit, kind='stable')
+
+    # Each column is computed for the rows in placement order, then put into output order as
+    # it is added, so the placed dataframe is only built once
+    full_entity_df_plus_pos = full_entity_df.take(rows[output_order])
+    full_entity_df_plus_pos.index = pd.RangeIndex(len(rows))
+    full_entity_df_plus_pos['rank'] = rank[rows][output_order]
+    del rank, sorted_rows
+    for col in event_position_df.columns.drop(event_col_name):
+        full_entity_df_plus_pos[col] = event_values(col).take(event_codes[rows][output_order])
+
+    # Entities are placed at their final position, replacing the position of their event
+    full_entity_df_plus_pos.rename(columns={"y": "y_final"}, inplace=True)
+    for col, queue_table, resource_values in [('y_final', queue_y, resource_y), ('x_final', queue_x, resource_x)]:
+        values = np.full(len(rows), np.nan)
+        values[:len(queue_rows)] = queue_table.ravel().take(queue_index)
+        values[len(queue_rows):placed.stop] = resource_values
+        full_entity_df_plus_pos[col] = values[output_order]
+        del values
+
+    if wrap_queues_at is not None or (resource_row is not None and is_resource_use.any()):
+        row = np.full(len(rows), np.nan)
+        if wrap_queues_at is not None:
+            row[:len(queue_rows)] = queue_row.take(queue_slot_codes[queue_rows])
+        if resource_row is not None:
+            row[len(queue_rows):placed.stop] = resource_row
+        full_entity_df_plus_pos['row'] = row[output_order]
+        del row
+
+    # The empty snapshots keep the position of their event, if they have one
+    y = np.full(len(rows), np.nan)
+    y[placed.stop:] = event_y.take(event_codes[empty_rows])
+    full_entity_df_plus_pos['y'] = y[output_order]
+    del y, event_codes, queue_slot_codes
+
+    icons = full_icon_list.take(icon_codes[rows][output_order])
+
+    if 'additional' in full_entity_df.columns:
+        # Label the capped rows, now at the end, working out each distinct label only once
+        exceeded_snapshot_limit = exceeded_snapshot_limit[output_order]
+        additional_counts, additional_codes = np.unique(
+            full_entity_df_plus_pos['additional'].to_numpy()[exceeded_snapshot_limit].astype(np.int64),
+            return_inverse=True
+            )
+        additional_labels = np.array([f"+ {count:5d} more" for count in additional_counts], dtype=object)
+        icons[exceeded_snapshot_limit] = additional_labels.take(additional_codes)
+
+    full_entity_df_plus_pos['icon'] = icons
+
+    if debug_mode:
+        print(f'Placement dataframe finished construction at {time.strftime("%H:%M:%S", time.localtime())}')
+
+    if slim:
+        full_entity_df_plus_pos = _slim_dataframe(full_entity_df_plus_pos)
 
     return full_entity_df_plus_pos